@@ -0,0 +1,263 @@
+# Offline load test of the whole bot: python -m benchmarks.load_test [count ...]
+# Synthetic updates go through GameBot.dp.feed_update against a fake Bot
+# session, so nothing touches the network. Each roster size runs in a fresh
+# process (the managers keep their state on the class) and the results are
+# written as JSON, e.g. to compare a branch against master.
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Chat, Message, Update
+
+from benchmarks.startup import load_manager, timed, write_snapshot
+from benchmarks.user_memory import ITEMS, SKILLS
+from game_bot import GameBot, PageCallback
+from managers.catalog_manager import CatalogManager
+from managers.stats_manager import StatsManager
+from managers.user import UserStatus
+from managers.user_manager import UserManager
+
+GM_ID = 1
+TOKEN = "42:" + "A" * 35
+# Session kinds and how often each is picked
+MIX = {"commands": 30, "pages": 20, "action": 15, "ask": 10, "character": 15, "gm": 10}
+PLAYER_COMMANDS = ("/start", "/help", "/description", "/profile", "/skill_info", "/inventory")
+
+
+class FakeSession(BaseSession):
+    # Answers every method locally: a Message for sends and edits, True for
+    # the rest. `latency` adds a simulated round trip in seconds.
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.requests = 0
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: int | None = None):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method.__returning__ is bool:
+            return True
+        chat_id = getattr(method, "chat_id", None)
+        return Message(
+            message_id=self.requests, date=datetime.datetime.now(),
+            chat=Chat(id=chat_id if isinstance(chat_id, int) else 0, type="private"),
+            text=getattr(method, "text", None)
+        ).as_(bot)
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+#region Updates
+class UpdateFactory:
+    def __init__(self, seed: int, active: list[int], pending: list[int], first_new_id: int):
+        self.rng = random.Random(seed)
+        self.active = active
+        self.pending = pending
+        self.next_new_id = first_new_id
+        self.update_id = 0
+
+    def _sender(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"Player {user_id}"}
+
+    def message(self, user_id: int, text: str) -> dict:
+        self.update_id += 1
+        return {"update_id": self.update_id, "message": {
+            "message_id": self.update_id, "date": int(time.time()), "text": text,
+            "chat": {"id": user_id, "type": "private"}, "from": self._sender(user_id)
+        }}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        self.update_id += 1
+        return {"update_id": self.update_id, "callback_query": {
+            "id": str(self.update_id), "chat_instance": "load_test", "data": data, "from": self._sender(user_id),
+            "message": {"message_id": self.update_id, "date": int(time.time()), "text": "-",
+                        "chat": {"id": user_id, "type": "private"}}
+        }}
+
+    def player(self) -> int:
+        return self.rng.choice(self.active)
+
+    # One session is a run of updates from a single user, fed in order
+    def session(self) -> list[dict]:
+        kind = self.rng.choices(list(MIX), list(MIX.values()))[0]
+        return getattr(self, f"_{kind}")()
+
+    def _commands(self) -> list[dict]:
+        user_id = self.player()
+        return [self.message(user_id, self.rng.choice(PLAYER_COMMANDS)) for _ in range(3)]
+
+    # Buttons carry the user's current content version, so turn_page really
+    # pages through the list (and its cache) instead of starting over
+    def _pages(self) -> list[dict]:
+        user_id, kind = self.player(), self.rng.choice(("skill", "inventory"))
+        user = UserManager.lookup(user_id)
+        version = user.skills_version if kind == "skill" else user.inventory_version
+        return [self.message(user_id, f"/{'skill_info' if kind == 'skill' else 'inventory'}")] + [
+            self.callback(user_id, PageCallback(kind=kind, page=page, version=version).pack()) for page in (1, 2, 0)
+        ]
+
+    def _action(self) -> list[dict]:
+        user_id = self.player()
+        return [self.message(user_id, "/action"), self.message(user_id, "The character does something")]
+
+    def _ask(self) -> list[dict]:
+        user_id = self.player()
+        return [self.message(user_id, "/ask_gm"), self.message(user_id, "A question for the GM")]
+
+    def _character(self) -> list[dict]:
+        user_id = self.next_new_id
+        self.next_new_id += 1
+        return [self.message(user_id, text) for text in (
+            "/create_character", f"Character {user_id}\nrace_0\nclass_0",
+            "Race description", "Class description", "Character description"
+        )]
+
+    def _gm(self) -> list[dict]:
+        player = self.player()
+        commands = ["/stats", "/digest_queue", "/archive", f"/archive_user {player}",
+                    f"/give_item {self.rng.choice(ITEMS)} 1 {player}", f"/ban_ask {player}", f"/unban_ask {player}"]
+        if self.pending:
+            commands.append(f"/approve {self.pending.pop()}")
+        return [self.message(GM_ID, self.rng.choice(commands))]
+#endregion
+
+
+#region Run
+def percentiles(samples: list[float]) -> dict:
+    if len(samples) < 2:
+        return {"p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    cuts = statistics.quantiles(samples, n=100)
+    return {"p50_ms": cuts[49] * 1000, "p99_ms": cuts[98] * 1000, "max_ms": max(samples) * 1000}
+
+def write_catalog(data_dir: str) -> None:
+    shutil.copy(os.path.join("data", "replies.yaml"), data_dir)
+    for name, ids in (("skills.json", SKILLS), ("items.json", ITEMS)):
+        file = open(os.path.join(data_dir, name), "w", encoding="utf-8")
+        json.dump({key: {"name": key, "description": f"Description of {key}"} for key in ids}, file)
+        file.close()
+
+async def feed(factory: UpdateFactory, updates: int, concurrency: int, latencies: list[float]) -> float:
+    sessions = asyncio.Queue()
+    queued = 0
+    while queued < updates:
+        session = factory.session()
+        sessions.put_nowait(session)
+        queued += len(session)
+
+    async def worker():
+        while not sessions.empty():
+            for raw in sessions.get_nowait():
+                started = time.perf_counter()
+                update = Update.model_validate(raw, context={"bot": GameBot.bot})
+                await GameBot.dp.feed_update(GameBot.bot, update)
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started
+
+async def drive(factory: UpdateFactory, updates: int, concurrency: int) -> dict:
+    await GameBot.dp.emit_startup(bot=GameBot.bot, **GameBot.dp.workflow_data)
+    # Measure the steady state, not the background decoding after a start
+    await UserManager.wait_ready()
+    await UserManager._loading
+
+    latencies = []
+    elapsed = await feed(factory, updates, concurrency, latencies)
+    await GameBot.dp.emit_shutdown(bot=GameBot.bot, **GameBot.dp.workflow_data)
+    return {
+        "updates": len(latencies),
+        "elapsed_s": elapsed,
+        "updates_per_s": len(latencies) / elapsed,
+        "latency": percentiles(latencies),
+        "requests": GameBot.bot.session.requests,
+        "handlers": {
+            name: {"count": histogram.count, "errors": histogram.errors,
+                   "p50_ms": histogram.quantile(0.5) * 1000, "p99_ms": histogram.quantile(0.99) * 1000}
+            for name, histogram in sorted(StatsManager.handlers.items())
+        }
+    }
+
+# One roster size, in its own process
+def run(count: int, updates: int, concurrency: int, latency: float, seed: int) -> dict:
+    os.environ.update({
+        "PTB_GM_ID": str(GM_ID), "PTB_TOKEN": TOKEN, "PTB_STORAGE": "json", "PTB_STATE_STORE": "memory",
+        "PTB_ROLLOVER": "off", "PTB_METRICS_PORT": "", "PTB_SEND_RATE": "1e9", "PTB_SEND_CHAT_RATE": "1e9"
+    })
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_snapshot(data_dir, count)
+        write_catalog(data_dir)
+        CatalogManager.data_dir = data_dir
+
+        load = timed(lambda: load_manager(data_dir, False))
+        save = timed(UserManager._save)
+        tracemalloc.start()
+        load_manager(data_dir, False)
+        memory = tracemalloc.get_traced_memory()[0] / count
+        tracemalloc.stop()
+
+        active = UserManager.find(status=UserStatus.ACTIVE)
+        pending = UserManager.find(status=UserStatus.AWAIT)
+        UserManager.storage.close()
+        UserManager.storage = None
+
+        GameBot.setup(FakeSession(latency))
+        factory = UpdateFactory(seed, active, pending, max(UserManager.user_data) + 1)
+        result = asyncio.run(drive(factory, updates, concurrency))
+    return {"users": count, "load_s": load, "save_s": save, "memory_per_user_bytes": memory, **result}
+
+def revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline load test of GameBot")
+    parser.add_argument("counts", type=int, nargs="*", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--updates", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=100, help="users sending updates at the same time")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated Bot API round trip in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=os.path.join("benchmarks", "results.json"))
+    args = parser.parse_args()
+
+    results = []
+    for count in args.counts:
+        executor = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"))
+        result = executor.submit(run, count, args.updates, args.concurrency, args.latency, args.seed).result()
+        executor.shutdown()
+        results.append(result)
+        print(f"{count:>9} users: {result['updates_per_s']:8.0f} updates/s, "
+              f"p50 {result['latency']['p50_ms']:.2f}ms, p99 {result['latency']['p99_ms']:.2f}ms, "
+              f"{result['memory_per_user_bytes']:.0f} B/user, load {result['load_s']:.3f}s, save {result['save_s']:.3f}s")
+
+    file = open(args.output, "w", encoding="utf-8")
+    json.dump({
+        "revision": revision(), "python": platform.python_version(), "time": int(time.time()),
+        "settings": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results
+    }, file, indent=2)
+    file.close()
+    print(f"Results written to {args.output}")
+#endregion
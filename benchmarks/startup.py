@@ -0,0 +1,54 @@
+# Cold-start cost of loading the roster: python -m benchmarks.startup [count ...]
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.user_memory import LegacyUser, synthetic_records
+from managers.user_manager import UserManager
+
+def write_snapshot(data_dir: str, count: int) -> None:
+    file = open(os.path.join(data_dir, "user_data.json"), "w", encoding="utf-8")
+    users = {}
+    for line in synthetic_records(count):
+        raw = json.loads(line)
+        users[raw["user_id"]] = raw
+    json.dump({"meta": {"seq": 0}, "users": users}, file, indent=2)
+    file.close()
+
+def timed(function) -> float:
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started
+
+def load_dacite(data_dir: str) -> None:
+    from dacite import from_dict
+    file = open(os.path.join(data_dir, "user_data.json"), "r", encoding="utf-8")
+    raw_users = json.load(file)["users"]
+    file.close()
+    {int(key): from_dict(data_class=LegacyUser, data=raw_users[key]) for key in raw_users}
+
+def load_manager(data_dir: str, lazy: bool) -> None:
+    if UserManager.storage is not None:
+        UserManager.storage.close()
+    UserManager.storage = None
+    UserManager.data_dir = data_dir
+    UserManager._load_users(lazy)
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or [1_000, 100_000]
+    for count in counts:
+        with tempfile.TemporaryDirectory() as data_dir:
+            write_snapshot(data_dir, count)
+            try:
+                dacite = f"{timed(lambda: load_dacite(data_dir)):.3f}s"
+            except ImportError:
+                dacite = "n/a"
+            eager = timed(lambda: load_manager(data_dir, False))
+            ready = timed(lambda: load_manager(data_dir, True))
+            rest = timed(UserManager._materialize_all)
+            UserManager.storage.close()
+            UserManager.storage = None
+        print(f"{count:>9} users: dacite {dacite}, direct {eager:.3f}s, "
+              f"background: ready {ready:.3f}s + {rest:.3f}s decoding")
@@ -0,0 +1,68 @@
+# Resident bytes per User at roster scale: python -m benchmarks.user_memory [count ...]
+from dataclasses import dataclass
+import json
+import random
+import sys
+import tracemalloc
+
+from managers.user import User
+
+# The pre-slots model, kept here as the baseline
+@dataclass
+class LegacyUser:
+    status: str
+    ask_ban: bool
+    user_id: int
+    date_joined: str
+    action_count: int
+    char_name: str
+    char_race: str
+    char_class: str
+    action: bool
+    skills: list[str]
+    inventory: list[str]
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+RACES = [f"race_{i}" for i in range(20)]
+CLASSES = [f"class_{i}" for i in range(15)]
+SKILLS = [f"skill_{i}" for i in range(50)]
+ITEMS = [f"item_{i}" for i in range(100)]
+
+def synthetic_records(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    for user_id in range(count):
+        yield json.dumps({
+            "status": rng.choice(("await", "active")),
+            "ask_ban": rng.random() < 0.05,
+            "user_id": 100000000 + user_id,
+            "date_joined": f"{rng.randint(1, 28):02}.{rng.randint(1, 12):02} 2025",
+            "action_count": rng.randint(0, 60),
+            "char_name": f"Character {user_id}",
+            "char_race": rng.choice(RACES),
+            "char_class": rng.choice(CLASSES),
+            "action": rng.random() < 0.5,
+            "skills": rng.sample(SKILLS, rng.randint(0, 4)),
+            "inventory": [rng.choice(ITEMS) for _ in range(rng.randint(0, 12))]
+        })
+
+def measure(model, count: int) -> float:
+    # Records are decoded inside the traced region (as a JSON load would do)
+    # and only what the model keeps alive is counted.
+    tracemalloc.start()
+    users = {}
+    for line in synthetic_records(count):
+        raw = json.loads(line)
+        users[raw["user_id"]] = model.from_dict(raw)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / count
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or [100_000, 1_000_000]
+    for count in counts:
+        legacy, compact = measure(LegacyUser, count), measure(User, count)
+        print(f"{count:>9} users: legacy {legacy:7.1f} B/user, compact {compact:7.1f} B/user "
+              f"({compact / legacy:.0%})")
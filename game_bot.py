@@ -1,557 +1,840 @@
 import asyncio
 import datetime
+import html
+import itertools
 import logging
 
 import dotenv
-from enum import Enum
+from enum import IntEnum
 import os
-
-from aiogram import Bot, Dispatcher, Router, types
-from aiogram.filters import CommandStart, Command
-from aiogram.types import Message, CallbackQuery
+import signal
+from typing import Callable
+
+from aiogram import Bot, Dispatcher, F, Router, types
+from aiogram.client.session.base import BaseSession
+from aiogram.filters import CommandStart, Command, CommandObject, MagicData
+from aiogram.filters.callback_data import CallbackData
+from aiogram.methods import SendDocument
+from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.enums.parse_mode import ParseMode
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-
+from aiohttp import web
+
+from managers.archive_manager import ArchiveManager
+from managers.broadcast_manager import BroadcastManager
+from managers.binary_snapshot import MAX_COUNT
+from managers.catalog_manager import CatalogManager
+from managers.digest_manager import DigestManager, split_message
+from managers.media_manager import MediaManager
+from managers.page_manager import PageManager
+from managers.profile_manager import ProfileManager
 from managers.replies_manager import RepliesManager
+from managers.rollover_manager import RolloverManager
+from managers.send_manager import Lane, SendManager
+from managers.state_store import StateStore, open_state_store
+from managers.user import User, UserStatus
 from managers.user_manager import UserManager
-
-class AwaitStatus(Enum):
+from managers.stats_manager import StatsManager
+from managers.throttle_manager import ThrottleManager
+from middlewares.context import ContextMiddleware, Role
+from middlewares.load_gate import LoadGateMiddleware
+from middlewares.log_context import LogContextMiddleware
+from middlewares.stats import StatsMiddleware
+from middlewares.throttling import ThrottlingMiddleware
+from webhook import WebhookServer, start_metrics
+
+class AwaitStatus(IntEnum):
     INFO = 0
     RACE = 1
     CLASS = 2
     DESCRIPTION = 3
     ACTION = 4
     ASK = 5
+    BROADCAST = 6
+
+# Pagination state travels in the button itself, so any worker (or a
+# restarted bot) can serve the click
+class PageCallback(CallbackData, prefix="page"):
+    kind: str
+    page: int
+    version: int
+
+class ArchiveCallback(CallbackData, prefix="archive"):
+    index: str
+    key: int
+    page: int
 
 class GameBot:
     dp = Dispatcher()
-    router = Router()
+    # Commands anyone can use are on `dp`; the rest are split by who may use
+    # them and tried in this order (see setup)
+    gm_router = Router(name="gm")
+    player_router = Router(name="player")
+    guest_router = Router(name="guest")
+    conversation_router = Router(name="conversation")
     bot: Bot = None
-    await_messages: dict[int, dict] = {}
-    skill_pages: dict[int, int] = {}
-    inventory_pages: dict[int, int] = {}
+    await_messages: StateStore = None
+    metrics: web.AppRunner = None
+    # Bulk notifications still being sent; the loop keeps only weak references to tasks
+    notifying: set[asyncio.Task] = set()
     gm_id = 0
 
     def __new__(cls):
-        RepliesManager()
-        UserManager()
-
+        cls.setup()
+        match os.getenv("PTB_MODE", "polling"):
+            case "polling":
+                asyncio.run(cls.dp.start_polling(cls.bot))
+            case "webhook":
+                WebhookServer.from_env(cls.dp, cls.bot).run()
+            case mode:
+                raise EnvironmentError(f"Неизвестный режим работы: {mode}")
+
+    # Everything short of taking updates, so the dispatcher can also be fed
+    # directly (see benchmarks/load_test.py); `session` replaces the HTTP one
+    @classmethod
+    def setup(cls, session: BaseSession | None = None) -> None:
         dotenv.load_dotenv()
+        CatalogManager()
+        UserManager(background=True)
+        cls.await_messages = open_state_store(os.getenv("PTB_STATE_STORE", "memory"), UserManager.data_dir)
+
         cls.gm_id = int(os.getenv("PTB_GM_ID"))
         bot_token = os.getenv("PTB_TOKEN")
         if not (cls.gm_id and bot_token):
             raise EnvironmentError("Отсутствуют необходимые переменные")
 
-        cls.bot = Bot(bot_token)
-        cls.dp.include_router(cls.router)
-        asyncio.run(cls.dp.start_polling(cls.bot))
+        cls.bot = Bot(bot_token, session=session)
+        cls.gm_router.message.filter(MagicData(F.role == Role.GM))
+        cls.gm_router.callback_query.filter(MagicData(F.role == Role.GM))
+        cls.player_router.message.filter(MagicData(F.user.is_not(None)))
+        cls.player_router.callback_query.filter(MagicData(F.user.is_not(None)))
+        cls.conversation_router.message.filter(MagicData(F.conversation.is_not(None)))
+        cls.dp.include_routers(cls.gm_router, cls.player_router, cls.guest_router, cls.conversation_router)
+        cls.dp.update.outer_middleware(LogContextMiddleware())
+        cls.dp.update.outer_middleware(LoadGateMiddleware())
+        cls.dp.update.outer_middleware(ContextMiddleware(cls.gm_id, cls.await_messages))
+        cls.dp.update.outer_middleware(ThrottlingMiddleware())
+        cls.dp.message.middleware(StatsMiddleware())
+        cls.dp.callback_query.middleware(StatsMiddleware())
+        cls.dp.startup.register(cls.on_startup)
+        cls.dp.shutdown.register(cls.on_shutdown)
 
     @classmethod
     def get_bot(cls) -> Bot:
         return cls.bot
 
-    #region Router
     @staticmethod
-    @router.callback_query(lambda c: c.data == "skill_back")
-    async def skill_back(callback: CallbackQuery) -> None:
-        user_id = callback.from_user.id
-        user = UserManager.get_user(user_id)
-        if len(user.skills) == 1:
-            return
-        if GameBot.skill_pages[user_id] != 0:
-            GameBot.skill_pages[user_id] -= 1
-        else:
-            GameBot.skill_pages[user_id] = len(user.skills)-1
-
-        skill = UserManager.get_skill(user.skills[GameBot.skill_pages[user_id]])
+    async def on_startup() -> None:
+        # Updates are taken right after this returns; users keep loading in the background
+        UserManager.start_loading(on_failure=GameBot.stop)
+        CatalogManager.start_watching()
+        await asyncio.to_thread(ArchiveManager.open, UserManager.data_dir)
+        await asyncio.to_thread(MediaManager.load, UserManager.data_dir)
+        StatsManager.gauge("users", lambda: len(UserManager.user_data) + len(UserManager._raw))
+        StatsManager.gauge("conversations", lambda: len(GameBot.await_messages))
+        StatsManager.gauge("digest_pending", DigestManager.pending)
+        ProfileManager.container("UserManager.user_data", lambda: UserManager.user_data)
+        ProfileManager.container("UserManager._raw", lambda: UserManager._raw)
+        ProfileManager.container("GameBot.await_messages", lambda: GameBot.await_messages)
+        ProfileManager.container("PageManager._cache", lambda: PageManager._cache)
+        ProfileManager.container("ThrottleManager._counters", lambda: ThrottleManager._counters)
+        ProfileManager.container("DigestManager._history", lambda: DigestManager._history)
+        ProfileManager.start(UserManager.data_dir)
+        if port := os.getenv("PTB_METRICS_PORT"):
+            GameBot.metrics = await start_metrics(os.getenv("PTB_METRICS_HOST", "127.0.0.1"), int(port))
+        SendManager.start(GameBot.bot)
+        DigestManager.start(GameBot.gm_id)
+        RolloverManager.start(GameBot.gm_id)
+        BroadcastManager.start(GameBot.gm_id, UserManager.data_dir)
+        ThrottleManager.start(UserManager.data_dir)
+
+    # Polling and the webhook server both shut down cleanly on SIGTERM
+    @staticmethod
+    def stop() -> None:
+        logging.log(logging.CRITICAL, "Stopping the bot")
+        signal.raise_signal(signal.SIGTERM)
 
-        current_markup = callback.message.reply_markup
-        skill_msg = RepliesManager.get("skill_info", skill_name=skill["name"], skill_desc=skill["description"])
-        await callback.message.edit_text(text=skill_msg, parse_mode=ParseMode.HTML, reply_markup=current_markup)
+    @staticmethod
+    async def on_shutdown() -> None:
+        # Updates stop on SIGTERM/SIGINT before this runs; flush the last snapshot off the loop
+        CatalogManager.stop_watching()
+        RolloverManager.stop()
+        BroadcastManager.stop()
+        ThrottleManager.stop()
+        ProfileManager.stop()
+        if GameBot.metrics is not None:
+            await GameBot.metrics.cleanup()
+        DigestManager.flush()
+        # Running notifications get the same grace period as the send queue
+        if GameBot.notifying:
+            await asyncio.wait(GameBot.notifying, timeout=SendManager.drain_timeout)
+        await SendManager.stop()
+        ArchiveManager.close()
+        GameBot.await_messages.close()
+        await asyncio.to_thread(UserManager.shutdown)
 
+    #region Router
     @staticmethod
-    @router.callback_query(lambda c: c.data == "skill_next")
-    async def skill_back(callback: CallbackQuery) -> None:
-        user_id = callback.from_user.id
-        user = UserManager.get_user(user_id)
-        if len(user.skills) == 1:
-            return
-        if GameBot.skill_pages[user_id] != len(user.skills) - 1:
-            GameBot.skill_pages[user_id] += 1
-        else:
-            GameBot.skill_pages[user_id] = 0
+    def page_buttons(page: int, pages: int, pack: Callable[[int], str]) -> types.InlineKeyboardMarkup | None:
+        if pages <= 1:
+            return None
+        builder = InlineKeyboardBuilder()
+        builder.add(types.InlineKeyboardButton(text="<-", callback_data=pack((page - 1) % pages)))
+        builder.add(types.InlineKeyboardButton(text="->", callback_data=pack((page + 1) % pages)))
+        return builder.as_markup()
 
-        skill = UserManager.get_skill(user.skills[GameBot.skill_pages[user_id]])
+    @staticmethod
+    def page_markup(kind: str, page: int, pages: int, version: int) -> types.InlineKeyboardMarkup | None:
+        return GameBot.page_buttons(page, pages, lambda to: PageCallback(kind=kind, page=to, version=version).pack())
 
-        current_markup = callback.message.reply_markup
-        skill_msg = RepliesManager.get("skill_info", skill_name=skill["name"], skill_desc=skill["description"])
-        await callback.message.edit_text(text=skill_msg, parse_mode=ParseMode.HTML, reply_markup=current_markup)
+    @staticmethod
+    def archive_markup(index: str, key: int, page: int, pages: int) -> types.InlineKeyboardMarkup | None:
+        return GameBot.page_buttons(page, pages, lambda to: ArchiveCallback(index=index, key=key, page=to).pack())
 
     @staticmethod
-    @router.callback_query(lambda c: c.data == "inventory_back")
-    async def inventory_back(callback: CallbackQuery) -> None:
-        user_id = callback.from_user.id
-        user = UserManager.get_user(user_id)
-        if len(user.inventory) <= 10:
-            return
-        if GameBot.inventory_pages[user_id] != 0:
-            GameBot.inventory_pages[user_id] -= 1
-        else:
-            GameBot.inventory_pages[user_id] = (len(user.inventory)-1)//10
+    @gm_router.callback_query(ArchiveCallback.filter())
+    async def turn_archive_page(callback: CallbackQuery, callback_data: ArchiveCallback) -> None:
+        text, pages = ArchiveManager.page(callback_data.index, callback_data.key, callback_data.page)
+        markup = GameBot.archive_markup(callback_data.index, callback_data.key, callback_data.page, pages)
+        await callback.message.edit_text(text=text, reply_markup=markup)
+        await callback.answer()
 
-        items = ""
-        page = GameBot.inventory_pages[user_id] * 10
-        for i in range(min(10, len(user.inventory) - page)):
-            item = UserManager.get_item(user.inventory[page + i])
-            items += f"\n{page + i + 1}. {item['name']}\n{item['description']}\n"
+    @staticmethod
+    @gm_router.callback_query(PageCallback.filter(F.kind == "digest"))
+    async def turn_digest_page(callback: CallbackQuery, callback_data: PageCallback) -> None:
+        version = DigestManager.version()
+        page = callback_data.page if callback_data.version == version else 0
+        text, pages = DigestManager.page(page)
+        markup = GameBot.page_markup("digest", page, pages, version)
+        await callback.message.edit_text(text=text, reply_markup=markup)
+        await callback.answer()
 
-        current_markup = callback.message.reply_markup
-        inventory_msg = RepliesManager.get("inventory_info", items=items)
-        await callback.message.edit_text(text=inventory_msg, parse_mode=ParseMode.HTML, reply_markup=current_markup)
+    @staticmethod
+    @gm_router.callback_query(PageCallback.filter(F.kind.in_({"pending", "idle"})))
+    async def turn_roster_page(callback: CallbackQuery, callback_data: PageCallback) -> None:
+        text, pages = PageManager.roster_page(callback_data.kind, GameBot.roster(callback_data.kind), callback_data.page)
+        markup = GameBot.page_markup(callback_data.kind, max(min(callback_data.page, pages - 1), 0), pages, 0)
+        await callback.message.edit_text(text=text, reply_markup=markup)
+        await callback.answer()
 
     @staticmethod
-    @router.callback_query(lambda c: c.data == "inventory_next")
-    async def inventory_next(callback: CallbackQuery) -> None:
-        user_id = callback.from_user.id
-        user = UserManager.get_user(user_id)
-        if len(user.inventory) <= 10:
-            return
-        if GameBot.inventory_pages[user_id] != (len(user.inventory)-1)//10:
-            GameBot.inventory_pages[user_id] += 1
+    @player_router.callback_query(PageCallback.filter(F.kind.in_({"skill", "inventory"})))
+    async def turn_page(callback: CallbackQuery, callback_data: PageCallback, user: User) -> None:
+        if callback_data.kind == "skill":
+            version, render = user.skills_version, PageManager.skill_page
         else:
-            GameBot.inventory_pages[user_id] = 0
+            version, render = user.inventory_version, PageManager.inventory_page
+        # The list changed since these buttons were sent; start over from the first page
+        page = callback_data.page if callback_data.version == version else 0
 
-        items = ""
-        page = GameBot.inventory_pages[user_id] * 10
-        for i in range(min(10, len(user.inventory) - page)):
-            item = UserManager.get_item(user.inventory[page + i])
-            items += f"\n{page + i + 1}. {item['name']}\n{item['description']}\n"
+        text, pages = render(user, page)
+        markup = GameBot.page_markup(callback_data.kind, page, pages, version)
+        await callback.message.edit_text(text=text, parse_mode=ParseMode.HTML, reply_markup=markup)
+        await callback.answer()
 
-        current_markup = callback.message.reply_markup
-        inventory_msg = RepliesManager.get("inventory_info", items=items)
-        await callback.message.edit_text(text=inventory_msg, parse_mode=ParseMode.HTML, reply_markup=current_markup)
+    # Buttons the sender may not (or no longer can) use
+    @staticmethod
+    @guest_router.callback_query()
+    async def unhandled_callback(callback: CallbackQuery) -> None:
+        await callback.answer()
     #endregion
 
     @staticmethod
     @dp.message(CommandStart())
-    async def start(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if user_id in UserManager.user_list():
-            help_msg = RepliesManager.get("help_msg")
-            sub_help = RepliesManager.get("sub_help", **{"char_name": UserManager.get_user(user_id).char_name, "help_msg": help_msg})
+    async def start(msg: Message, user: User | None) -> None:
+        if user is not None:
+            sub_help = RepliesManager.get("sub_help", char_name=user.char_name)
         else:
             sub_help = RepliesManager.get("sub_help_first")
         start_msg = RepliesManager.get("start_msg", **{"sub_help": sub_help, "gm_id": GameBot.gm_id})
 
-        await msg.answer(start_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        SendManager.send(msg.chat.id, start_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
     @staticmethod
     @dp.message(Command("help"))
     async def help(msg: Message) -> None:
         help_msg = RepliesManager.get("help_msg")
-        await msg.answer(help_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        SendManager.send(msg.chat.id, help_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
     @staticmethod
     @dp.message(Command("description"))
-    async def description(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if user_id in UserManager.user_list():
-            join_msg = RepliesManager.get("join", **{"char_name": UserManager.get_user(user_id).char_name})
+    async def description(msg: Message, user: User | None) -> None:
+        if user is not None:
+            join_msg = RepliesManager.get("join", **{"char_name": user.char_name})
         else:
             join_msg = RepliesManager.get("join_first")
         desc_msg = RepliesManager.get("description_msg", **{"join": join_msg})
 
-        await msg.answer(desc_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        SendManager.send(msg.chat.id, desc_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
+    #region Player commands
     @staticmethod
-    @dp.message(Command("profile"))
-    async def profile(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if not user_id in UserManager.user_list():
-            error_msg = RepliesManager.get("char_not_found_error")
-            await msg.answer(error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
-            return
-
-        info = UserManager.get_user(user_id)
+    @player_router.message(Command("profile"))
+    async def profile(msg: Message, user: User) -> None:
         profile_msg = RepliesManager.get("profile_msg",
-            char_name=info.char_name, join_date=info.date_joined, action_count=info.action_count,
-            char_race=info.char_race, char_class=info.char_class,
-            add_info=RepliesManager.get("await_gm_info") if info.status == "await" else "",
-            action=int(info.action), skill_list=\
-                "\n".join([f"{i+1}. {UserManager.get_skill_name(info.skills[i])}" for i in range(len(info.skills))])
-                if info.skills != [] else RepliesManager.get("no_skills_info")
+            char_name=user.char_name, join_date=user.join_date, action_count=user.action_count,
+            char_race=user.char_race, char_class=user.char_class,
+            add_info=RepliesManager.get("await_gm_info") if user.status == UserStatus.AWAIT else "",
+            action=int(user.action), skill_list=\
+                "\n".join([f"{i+1}. {UserManager.get_skill_name(user.skills[i])}" for i in range(len(user.skills))])
+                if user.skills else RepliesManager.get("no_skills_info")
         )
-        await msg.answer(profile_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        SendManager.send(msg.chat.id, profile_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
     @staticmethod
-    @dp.message(Command("skill_info"))
-    async def skill_info(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if not user_id in UserManager.user_list():
-            error_msg = RepliesManager.get("char_not_found_error")
-            await msg.answer(error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
-            return
-
-        builder = InlineKeyboardBuilder()
-        builder.add(types.InlineKeyboardButton(
-            text="<-",
-            callback_data="skill_back"
-        ))
-        builder.add(types.InlineKeyboardButton(
-            text="->",
-            callback_data="skill_next"
-        ))
-        GameBot.skill_pages[user_id] = 0
-        user = UserManager.get_user(user_id)
-        if not user.skills:
-            skill_msg = RepliesManager.get("no_skills_info")
-            await msg.answer(skill_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
-            return
-
-        skill = UserManager.get_skill(user.skills[0])
-        skill_msg = RepliesManager.get("skill_info", skill_name=skill["name"], skill_desc=skill["description"])
-        await msg.answer(skill_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True, reply_markup=builder.as_markup())
-
-    @staticmethod
-    @dp.message(Command("inventory"))
-    async def inventory(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if not user_id in UserManager.user_list():
-            error_msg = RepliesManager.get("char_not_found_error")
-            await msg.answer(error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
-            return
+    @player_router.message(Command("skill_info"))
+    async def skill_info(msg: Message, user: User) -> None:
+        skill_msg, pages = PageManager.skill_page(user, 0)
+        markup = GameBot.page_markup("skill", 0, pages, user.skills_version)
+        SendManager.send(msg.chat.id, skill_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True, reply_markup=markup)
 
-        builder = InlineKeyboardBuilder()
-        builder.add(types.InlineKeyboardButton(
-            text="<-",
-            callback_data="inventory_back"
-        ))
-        builder.add(types.InlineKeyboardButton(
-            text="->",
-            callback_data="inventory_next"
-        ))
-        GameBot.inventory_pages[user_id] = 0
-        user = UserManager.get_user(user_id)
-        if not user.inventory:
-            inventory_msg = RepliesManager.get("inventory_empty_info")
-            await msg.answer(inventory_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
-            return
-
-        items = ""
-        page = GameBot.inventory_pages[user_id]*10
-        for i in range(min(10, len(user.inventory) - page)):
-            item = UserManager.get_item(user.inventory[page+i])
-            items += f"\n{page + i + 1}. {item['name']}\n{item['description']}\n"
-
-        inventory_msg = RepliesManager.get("inventory_info", items=items)
-        await msg.answer(inventory_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True,
-                         reply_markup=builder.as_markup())
-
-    @staticmethod
-    @dp.message(Command("action"))
-    async def action(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if not user_id in UserManager.user_list():
-            error_msg = RepliesManager.get("char_not_found_error")
-            await msg.answer(error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
-            return
+    @staticmethod
+    @player_router.message(Command("inventory"))
+    async def inventory(msg: Message, user: User) -> None:
+        inventory_msg, pages = PageManager.inventory_page(user, 0)
+        markup = GameBot.page_markup("inventory", 0, pages, user.inventory_version)
+        SendManager.send(msg.chat.id, inventory_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True, reply_markup=markup)
 
-        user = UserManager.get_user(user_id)
-        if user.status == "await":
+    @staticmethod
+    @player_router.message(Command("action"))
+    async def action(msg: Message, user: User) -> None:
+        if user.status == UserStatus.AWAIT:
             error_msg = RepliesManager.get("not_approved_error")
-            await msg.answer(error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
             return
         if not user.action:
             error_msg = RepliesManager.get("no_actions_error")
-            await msg.answer(error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
             return
 
-        GameBot.await_messages[user_id] = {"status": AwaitStatus.ACTION}
+        GameBot.await_messages.set(user.user_id, {"status": AwaitStatus.ACTION})
         action_msg = RepliesManager.get("action_msg")
-        await msg.answer(action_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        SendManager.send(msg.chat.id, action_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
     @staticmethod
-    async def get_action(msg: Message) -> None:
-        user_id = msg.from_user.id
+    async def get_action(msg: Message, user: User) -> None:
+        user_id = user.user_id
         GameBot.await_messages.pop(user_id)
 
         UserManager.do_action(user_id)
         send_msg = RepliesManager.get("gm_msg_send")
-        await msg.answer(send_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        SendManager.send(msg.chat.id, send_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
-        name = UserManager.get_user(user_id).char_name
-        gm_msg = RepliesManager.get("new_action", char_name=name, user_id=user_id, action=msg.text)
-        await GameBot.get_bot().send_message(chat_id=GameBot.gm_id, text=gm_msg)
+        ArchiveManager.append("action", user_id, user.char_name, msg.text)
+        gm_msg = RepliesManager.get("new_action", char_name=user.char_name, user_id=user_id, action=msg.text)
+        DigestManager.notify(gm_msg)
 
     @staticmethod
-    @dp.message(Command("ask_gm"))
-    async def ask_gm(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if not user_id in UserManager.user_list():
-            error_msg = RepliesManager.get("char_not_found_error")
-            await msg.answer(error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
-            return
-
-        user = UserManager.get_user(user_id)
+    @player_router.message(Command("ask_gm"))
+    async def ask_gm(msg: Message, user: User) -> None:
         if user.ask_ban:
             error_msg = RepliesManager.get("ask_ban_error")
-            await msg.answer(error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
             return
 
-        GameBot.await_messages[user_id] = {"status": AwaitStatus.ASK}
+        GameBot.await_messages.set(user.user_id, {"status": AwaitStatus.ASK})
         ask_msg = RepliesManager.get("ask_gm_msg")
-        await msg.answer(ask_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        SendManager.send(msg.chat.id, ask_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
     @staticmethod
-    async def get_ask(msg: Message) -> None:
-        user_id = msg.from_user.id
+    async def get_ask(msg: Message, user: User) -> None:
+        user_id = user.user_id
         GameBot.await_messages.pop(user_id)
 
         send_msg = RepliesManager.get("gm_msg_send")
-        await msg.answer(send_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        SendManager.send(msg.chat.id, send_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+        ArchiveManager.append("ask", user_id, user.char_name, msg.text)
+        gm_msg = RepliesManager.get("new_ask", char_name=user.char_name, user_id=user_id, ask=msg.text)
+        DigestManager.notify(gm_msg)
 
-        name = UserManager.get_user(user_id).char_name
-        gm_msg = RepliesManager.get("new_ask", char_name=name, user_id=user_id, ask=msg.text)
-        await GameBot.get_bot().send_message(chat_id=GameBot.gm_id, text=gm_msg)
+    # The player commands again, for senders without a character
+    @staticmethod
+    @guest_router.message(Command("profile", "skill_info", "inventory", "action", "ask_gm"))
+    async def char_not_found(msg: Message) -> None:
+        error_msg = RepliesManager.get("char_not_found_error")
+        SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+    #endregion
 
     #region Create character
     @staticmethod
     @dp.message(Command("create_character"))
-    async def create_character(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if user_id in UserManager.user_list():
+    async def create_character(msg: Message, user: User | None) -> None:
+        if user is not None:
             error_msg = RepliesManager.get("char_exist_error")
-            await msg.answer(error_msg)
+            SendManager.send(msg.chat.id, error_msg)
             return
-        GameBot.await_messages[user_id] = {"status": AwaitStatus.INFO}
+        GameBot.await_messages.set(msg.from_user.id, {"status": AwaitStatus.INFO})
 
         char_msg = RepliesManager.get("create_char")
-        await msg.answer(char_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        SendManager.send(msg.chat.id, char_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
     @staticmethod
     async def get_basic_info(msg: Message) -> None:
-        user_id = msg.from_user.id
         info = msg.text.split("\n")
         if len(info) != 3:
             error_msg = RepliesManager.get("parse_error")
-            await msg.answer(error_msg)
+            SendManager.send(msg.chat.id, error_msg)
             return
 
-        GameBot.await_messages[user_id] = \
-        {
+        GameBot.await_messages.set(msg.from_user.id, {
             "status": AwaitStatus.RACE,
             "name": info[0], "race": info[1], "class": info[2]
-        }
+        })
 
         await_msg = RepliesManager.get("await_race")
-        await msg.answer(await_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        SendManager.send(msg.chat.id, await_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
     @staticmethod
-    async def get_race_desc(msg: Message) -> None:
-        user_id = msg.from_user.id
-        GameBot.await_messages[user_id]["status"] = AwaitStatus.CLASS
-        GameBot.await_messages[user_id]["race_desc"] = msg.text
+    async def get_race_desc(msg: Message, conversation: dict) -> None:
+        conversation["status"] = AwaitStatus.CLASS
+        conversation["race_desc"] = msg.text
+        GameBot.await_messages.set(msg.from_user.id, conversation)
 
         await_msg = RepliesManager.get("await_class")
-        await msg.answer(await_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        SendManager.send(msg.chat.id, await_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
     @staticmethod
-    async def get_class_desc(msg: Message) -> None:
-        user_id = msg.from_user.id
-        GameBot.await_messages[user_id]["status"] = AwaitStatus.DESCRIPTION
-        GameBot.await_messages[user_id]["class_desc"] = msg.text
-
+    async def get_class_desc(msg: Message, conversation: dict) -> None:
+        conversation["status"] = AwaitStatus.DESCRIPTION
+        conversation["class_desc"] = msg.text
+        GameBot.await_messages.set(msg.from_user.id, conversation)
 
         await_msg = RepliesManager.get("await_description")
-        await msg.answer(await_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        SendManager.send(msg.chat.id, await_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
     @staticmethod
-    async def get_char_desc(msg: Message) -> None:
+    async def get_char_desc(msg: Message, conversation: dict) -> None:
         user_id = msg.from_user.id
-        info = GameBot.await_messages.pop(user_id)
+        GameBot.await_messages.pop(user_id)
 
         now = datetime.date.today()
         UserManager.create(
-            ask_ban=False, user_id=user_id, date_joined=now.strftime("%d.%m %Y"), action_count=0,
-            char_name=info["name"], char_race=info["race"], char_class=info["class"],
-            action=False, skills=[], inventory=[]
+            ask_ban=False, user_id=user_id, date_joined=now.toordinal(), action_count=0,
+            char_name=conversation["name"], char_race=conversation["race"], char_class=conversation["class"],
+            action=False, skills=[], inventory={}
         )
 
         await_msg = RepliesManager.get("await_gm")
-        await msg.answer(await_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        SendManager.send(msg.chat.id, await_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
         gm_msg = RepliesManager.get("new_user",
-            user_id=user_id, char_name=info["name"],
-            char_race=info["race"], race_desc=info["race_desc"],
-            char_class=info["class"], class_desc=info["class_desc"],
+            user_id=user_id, char_name=conversation["name"],
+            char_race=conversation["race"], race_desc=conversation["race_desc"],
+            char_class=conversation["class"], class_desc=conversation["class_desc"],
             description=msg.text
         )
-        await GameBot.get_bot().send_message(chat_id=GameBot.gm_id, text=gm_msg)
+        DigestManager.notify(gm_msg)
     #endregion
 
     #region GM commands
     @staticmethod
-    @dp.message(Command("approve"))
-    async def approve(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if user_id != GameBot.gm_id:
-            return
+    def targets_error(msg: Message, invalid: list[str]) -> None:
+        error_msg = RepliesManager.get("targets_error", targets=html.escape(", ".join(invalid)))
+        SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+    # Bulk commands notify the players in the background and report to the GM
+    # with `reply` (given `count` and the number of failed deliveries) once
+    # every message is out, so the handler returns right away
+    @staticmethod
+    def notify(msg: Message, user_ids: list[int], text: str, reply: str, **kwargs) -> None:
+        async def run():
+            try:
+                result = await SendManager.fan_out(user_ids, text, parse_mode=ParseMode.HTML)
+                gm_msg = RepliesManager.get(reply, failed=len(result["failed"]), **kwargs)
+                SendManager.send(msg.chat.id, gm_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            except Exception:
+                logging.exception(f"Notifications for '{reply}' failed")
+
+        task = asyncio.create_task(run())
+        GameBot.notifying.add(task)
+        task.add_done_callback(GameBot.notifying.discard)
+
+    # Commands aimed at one player take a single id, checked like the bulk
+    # targets; returns None after reporting a bad one
+    @staticmethod
+    def single_target(msg: Message, target: str, status: UserStatus | None = None) -> int | None:
+        if target in UserManager.TARGET_FILTERS:
+            user_ids, invalid = [], [target]
+        else:
+            user_ids, invalid = UserManager.resolve([target], status)
+        if invalid:
+            GameBot.targets_error(msg, invalid)
+            return None
+        return user_ids[0]
 
+    # Bulk commands take ids and filters (all, active, pending), e.g. /approve 1 2 3
+    @staticmethod
+    @gm_router.message(Command("approve"))
+    async def approve(msg: Message) -> None:
         args = msg.text.split()
-        if len(args) != 2:
+        if len(args) < 2:
             error_msg = RepliesManager.get("parse_error")
-            await msg.answer(error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            return
+        user_ids, invalid = UserManager.resolve(args[1:], UserStatus.AWAIT)
+        if invalid:
+            GameBot.targets_error(msg, invalid)
             return
 
-        UserManager.approve_user(int(args[1]))
-        approve_msg = RepliesManager.get("approve_msg")
-        await GameBot.get_bot().send_message(chat_id=args[1], text=approve_msg, parse_mode=ParseMode.HTML)
-
-        gm_msg = RepliesManager.get("user_approved")
-        await msg.answer(gm_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        UserManager.approve_users(user_ids)
+        GameBot.notify(msg, user_ids, RepliesManager.get("approve_msg"), "user_approved", count=len(user_ids))
 
+    # /reject 1 2 3 reason
     @staticmethod
-    @dp.message(Command("reject"))
+    @gm_router.message(Command("reject"))
     async def reject(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if user_id != GameBot.gm_id:
-            return
-
         args = msg.text.split()
-        if len(args) < 3:
+        targets = list(itertools.takewhile(lambda arg: arg.isdigit() or arg in UserManager.TARGET_FILTERS, args[1:]))
+        reason = " ".join(args[1 + len(targets):])
+        if not (targets and reason):
             error_msg = RepliesManager.get("parse_error")
-            await msg.answer(error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            return
+        user_ids, invalid = UserManager.resolve(targets, UserStatus.AWAIT)
+        if invalid:
+            GameBot.targets_error(msg, invalid)
             return
 
-        UserManager.reject_user(int(args[1]))
-        reject_msg = RepliesManager.get("reject_msg", reason=" ".join(args[2:]))
-        await GameBot.get_bot().send_message(chat_id=args[1], text=reject_msg, parse_mode=ParseMode.HTML)
-
-        gm_msg = RepliesManager.get("user_rejected")
-        await msg.answer(gm_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        UserManager.reject_users(user_ids)
+        reject_msg = RepliesManager.get("reject_msg", reason=reason)
+        GameBot.notify(msg, user_ids, reject_msg, "user_rejected", count=len(user_ids))
 
     @staticmethod
-    @dp.message(Command("send_msg"))
+    @gm_router.message(Command("send_msg"))
     async def send_msg(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if user_id != GameBot.gm_id:
-            return
-
         args = msg.text.split()
         if len(args) < 3:
             error_msg = RepliesManager.get("parse_error")
-            await msg.answer(error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            return
+
+        user_id = GameBot.single_target(msg, args[1])
+        if user_id is None:
             return
 
         from_gm_msg = RepliesManager.get("from_gm", msg=" ".join(args[2:]))
-        await GameBot.get_bot().send_message(chat_id=args[1], text=from_gm_msg, parse_mode=ParseMode.HTML)
+        SendManager.send(user_id, from_gm_msg, Lane.LOW, parse_mode=ParseMode.HTML)
 
         gm_msg = RepliesManager.get("msg_sent")
-        await msg.answer(gm_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        SendManager.send(msg.chat.id, gm_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
     @staticmethod
-    @dp.message(Command("reject_action"))
+    @gm_router.message(Command("reject_action"))
     async def reject_action(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if user_id != GameBot.gm_id:
-            return
-
         args = msg.text.split()
-        print(args)
         if len(args) < 3:
             error_msg = RepliesManager.get("parse_error")
-            await msg.answer(error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            return
+
+        user_id = GameBot.single_target(msg, args[1], UserStatus.ACTIVE)
+        if user_id is None:
             return
 
-        UserManager.reject_action(int(args[1]))
-        reject_msg = RepliesManager.get("reject_action_msg", reject=" ".join(args[2:]))
-        await GameBot.get_bot().send_message(chat_id=args[1], text=reject_msg, parse_mode=ParseMode.HTML)
+        UserManager.reject_action(user_id)
+        reject_msg = RepliesManager.get("reject_action_msg", reason=" ".join(args[2:]))
+        SendManager.send(user_id, reject_msg, Lane.LOW, parse_mode=ParseMode.HTML)
 
-        gm_msg = RepliesManager.get("action_reject")
-        await msg.answer(gm_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        gm_msg = RepliesManager.get("action_rejected")
+        SendManager.send(msg.chat.id, gm_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
     @staticmethod
-    @dp.message(Command("ban_ask"))
+    @gm_router.message(Command("ban_ask"))
     async def ban_ask(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if user_id != GameBot.gm_id:
+        args = msg.text.split()
+        if len(args) < 2:
+            error_msg = RepliesManager.get("parse_error")
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            return
+        user_ids, invalid = UserManager.resolve(args[1:])
+        if invalid:
+            GameBot.targets_error(msg, invalid)
             return
 
+        UserManager.ban_ask_users(user_ids)
+        ThrottleManager.forget(user_ids)
+        gm_msg = RepliesManager.get("user_banned", count=len(user_ids))
+        SendManager.send(msg.chat.id, gm_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+    @staticmethod
+    @gm_router.message(Command("unban_ask"))
+    async def unban_ask(msg: Message) -> None:
         args = msg.text.split()
-        if len(args) != 2:
+        if len(args) < 2:
             error_msg = RepliesManager.get("parse_error")
-            await msg.answer(error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            return
+        user_ids, invalid = UserManager.resolve(args[1:])
+        if invalid:
+            GameBot.targets_error(msg, invalid)
             return
 
-        UserManager.ban_ask(int(args[1]))
-        gm_msg = RepliesManager.get("user_banned")
-        await msg.answer(gm_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        UserManager.unban_ask_users(user_ids)
+        ThrottleManager.forget(user_ids)
+        gm_msg = RepliesManager.get("user_unbanned", count=len(user_ids))
+        SendManager.send(msg.chat.id, gm_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
+    # /add_skill skill_id 1 2 3 (or a filter); the old /add_skill user_id skill_id still works
     @staticmethod
-    @dp.message(Command("unban_ask"))
-    async def unban_ask(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if user_id != GameBot.gm_id:
+    @gm_router.message(Command("add_skill"))
+    async def add_skill(msg: Message) -> None:
+        args = msg.text.split()
+        if len(args) < 3:
+            error_msg = RepliesManager.get("parse_error")
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            return
+        skills = CatalogManager.catalog.skills
+        single = len(args) == 3 and args[1].isdigit() and args[1] not in skills
+        skill_id, targets = (args[2], [args[1]]) if single else (args[1], args[2:])
+        if skill_id not in skills:
+            error_msg = RepliesManager.get("skill_not_found_error", skill_id=html.escape(skill_id))
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            return
+        user_ids, invalid = UserManager.resolve(targets)
+        if invalid:
+            GameBot.targets_error(msg, invalid)
+            return
+
+        granted = UserManager.grant_skill(user_ids, skill_id)
+        if single and not granted:
+            error_msg = RepliesManager.get("skill_exist_error")
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
             return
 
+        skill_msg = RepliesManager.get("new_skill_added", skill_name=UserManager.get_skill_name(skill_id))
+        GameBot.notify(msg, granted, skill_msg, "skill_added", count=len(granted), skipped=len(user_ids) - len(granted))
+
+    # /give_item item_id count 1 2 3 (or a filter)
+    @staticmethod
+    @gm_router.message(Command("give_item"))
+    async def give_item(msg: Message) -> None:
         args = msg.text.split()
-        if len(args) != 2:
+        if len(args) < 4 or not args[2].isdigit() or not 1 <= int(args[2]) <= MAX_COUNT:
             error_msg = RepliesManager.get("parse_error")
-            await msg.answer(error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            return
+        item_id, count = args[1], int(args[2])
+        if item_id not in CatalogManager.catalog.items:
+            error_msg = RepliesManager.get("item_not_found_error", item_id=html.escape(item_id))
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            return
+        user_ids, invalid = UserManager.resolve(args[3:])
+        if invalid:
+            GameBot.targets_error(msg, invalid)
             return
 
-        UserManager.unban_ask(int(args[1]))
-        gm_msg = RepliesManager.get("user_unbanned")
-        await msg.answer(gm_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        UserManager.give_item(user_ids, item_id, count)
+        item_msg = RepliesManager.get("new_item_added", item_name=UserManager.get_item_name(item_id), count=count)
+        GameBot.notify(msg, user_ids, item_msg, "item_given", count=len(user_ids))
 
     @staticmethod
-    @dp.message(Command("add_skill"))
-    async def add_skill(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if user_id != GameBot.gm_id:
+    @gm_router.message(Command("reload"))
+    async def reload(msg: Message) -> None:
+        # Only the catalog (replies, skills, items) is re-read; user data is untouched
+        reloaded = await CatalogManager.reload(force=True)
+        gm_msg = RepliesManager.get("data_reloaded" if reloaded else "data_reload_error")
+        SendManager.send(msg.chat.id, gm_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+    @staticmethod
+    def parse_week(text: str) -> int:
+        day = datetime.datetime.strptime(text, "%d.%m.%Y").date()
+        return ArchiveManager.week_of(datetime.datetime.combine(day, datetime.time.max))
+
+    # /archive [dd.mm.yyyy] - that week's actions and questions, the current week by default
+    @staticmethod
+    @gm_router.message(Command("archive"))
+    async def archive(msg: Message) -> None:
+        args = msg.text.split()
+        try:
+            week = GameBot.parse_week(args[1]) if len(args) > 1 else ArchiveManager.current_week()
+        except ValueError:
+            error_msg = RepliesManager.get("parse_error")
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
             return
 
+        archive_msg, pages = ArchiveManager.page("week", week, 0)
+        SendManager.send(msg.chat.id, archive_msg, reply_markup=GameBot.archive_markup("week", week, 0, pages))
+
+    @staticmethod
+    @gm_router.message(Command("archive_user"))
+    async def archive_user(msg: Message) -> None:
         args = msg.text.split()
-        if len(args) != 3:
+        if len(args) != 2 or not args[1].isdigit():
             error_msg = RepliesManager.get("parse_error")
-            await msg.answer(error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
             return
 
-        status = UserManager.add_skill(int(args[1]), args[2])
-        if not status:
-            error_msg = RepliesManager.get("skill_exist_error")
-            await msg.answer(error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        player_id = int(args[1])
+        archive_msg, pages = ArchiveManager.page("user", player_id, 0)
+        SendManager.send(msg.chat.id, archive_msg, reply_markup=GameBot.archive_markup("user", player_id, 0, pages))
+
+    # /export [jsonl|csv] [dd.mm.yyyy] - the whole archive, or one week, as a file
+    @staticmethod
+    @gm_router.message(Command("export"))
+    async def export(msg: Message) -> None:
+        export_format, week = "jsonl", None
+        try:
+            for arg in msg.text.split()[1:]:
+                if arg in ("jsonl", "csv"):
+                    export_format = arg
+                else:
+                    week = GameBot.parse_week(arg)
+        except ValueError:
+            error_msg = RepliesManager.get("parse_error")
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
             return
 
-        skill_msg = RepliesManager.get("new_skill_added", skill_name=UserManager.get_skill_name(args[2]))
-        await GameBot.get_bot().send_message(chat_id=args[1], text=skill_msg, parse_mode=ParseMode.HTML)
+        path = await asyncio.to_thread(ArchiveManager.export, week, export_format)
+        if path is None:
+            SendManager.send(msg.chat.id, RepliesManager.get("archive_empty"))
+            return
+        try:
+            await SendManager.enqueue(SendDocument(chat_id=msg.chat.id, document=FSInputFile(path)))
+        finally:
+            os.remove(path)
 
-        gm_msg = RepliesManager.get("skill_added")
-        await msg.answer(gm_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+    @staticmethod
+    @gm_router.message(Command("stats"))
+    async def stats(msg: Message) -> None:
+        stats_msg = f"<pre>{html.escape(StatsManager.render())}</pre>"
+        SendManager.send(msg.chat.id, stats_msg, parse_mode=ParseMode.HTML)
 
+    # /profile_start seconds - profiles the event loop and sends the report
     @staticmethod
-    @dp.message(Command("reload"))
-    async def reload(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if user_id != GameBot.gm_id:
+    @gm_router.message(Command("profile_start"))
+    async def profile_start(msg: Message, command: CommandObject) -> None:
+        if command.args is None or not command.args.isdigit() or not 0 < int(command.args) <= ProfileManager.max_seconds:
+            error_msg = RepliesManager.get("parse_error")
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            return
+        if ProfileManager.busy():
+            error_msg = RepliesManager.get("profile_busy_error")
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
             return
 
-        UserManager.reload_data()
-        gm_msg = RepliesManager.get("data_reloaded")
-        await msg.answer(gm_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
-    #endregion
+        ProfileManager.profile(msg.chat.id, int(command.args))
+        SendManager.send(msg.chat.id, RepliesManager.get("profile_started", seconds=int(command.args)))
 
     @staticmethod
-    @dp.message()
-    async def message(msg: Message) -> None:
-        user_id = msg.from_user.id
-        if not user_id in GameBot.await_messages.keys():
+    @gm_router.message(Command("mem_snapshot"))
+    async def mem_snapshot(msg: Message) -> None:
+        if not await ProfileManager.snapshot(msg.chat.id):
+            error_msg = RepliesManager.get("tracemalloc_off_error")
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+    # /broadcast - asks for a photo or document with a caption for every active player;
+    # /broadcast file [caption] - sends a file from data/media instead
+    @staticmethod
+    @gm_router.message(Command("broadcast"))
+    async def broadcast(msg: Message, command: CommandObject) -> None:
+        if BroadcastManager.busy():
+            error_msg = RepliesManager.get("broadcast_busy_error")
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            return
+        if command.args is None:
+            GameBot.await_messages.set(msg.from_user.id, {"status": AwaitStatus.BROADCAST})
+            SendManager.send(msg.chat.id, RepliesManager.get("broadcast_prompt"))
+            return
+
+        name, _, caption = command.args.partition(" ")
+        if MediaManager.path(name) is None:
+            error_msg = RepliesManager.get("media_not_found_error", name=html.escape(name))
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            return
+        count = await BroadcastManager.broadcast(MediaManager.kind(name), name, html.escape(caption) or None, local=True)
+        SendManager.send(msg.chat.id, RepliesManager.get("broadcast_started", count=count))
+
+    # Anything but a photo or a document cancels the broadcast
+    @staticmethod
+    async def get_broadcast(msg: Message) -> None:
+        GameBot.await_messages.pop(msg.from_user.id)
+        if msg.photo:
+            kind, file_id = "photo", msg.photo[-1].file_id
+        elif msg.document:
+            kind, file_id = "document", msg.document.file_id
+        else:
+            SendManager.send(msg.chat.id, RepliesManager.get("broadcast_cancelled"))
+            return
+        # Another broadcast may have started while this one was being sent
+        if BroadcastManager.busy():
+            error_msg = RepliesManager.get("broadcast_busy_error")
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            return
+
+        count = await BroadcastManager.broadcast(kind, file_id, msg.html_text if msg.caption else None)
+        SendManager.send(msg.chat.id, RepliesManager.get("broadcast_started", count=count))
+
+    @staticmethod
+    def roster(kind: str) -> list[int]:
+        return UserManager.with_status(UserStatus.AWAIT) if kind == "pending" else UserManager.idle()
+
+    # /pending - characters awaiting approval, /idle - players who have not acted this turn
+    @staticmethod
+    @gm_router.message(Command("pending", "idle"))
+    async def send_roster(msg: Message, command: CommandObject) -> None:
+        roster_msg, pages = PageManager.roster_page(command.command, GameBot.roster(command.command), 0)
+        SendManager.send(msg.chat.id, roster_msg, reply_markup=GameBot.page_markup(command.command, 0, pages, 0))
+
+    # /top [count] - the players with the most actions
+    @staticmethod
+    @gm_router.message(Command("top"))
+    async def top(msg: Message, command: CommandObject) -> None:
+        if command.args is not None and not command.args.isdigit():
+            error_msg = RepliesManager.get("parse_error")
+            SendManager.send(msg.chat.id, error_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
             return
 
-        match GameBot.await_messages[user_id]["status"]:
+        leaders = UserManager.top(min(int(command.args or 10), 50))
+        if not leaders:
+            SendManager.send(msg.chat.id, RepliesManager.get("top_empty"))
+            return
+        lines = [RepliesManager.get("top_header")] + [
+            RepliesManager.get("top_entry",
+                place=place, char_name=UserManager.get_user(user_id).char_name, user_id=user_id, action_count=action_count
+            )
+            for place, (user_id, action_count) in enumerate(leaders, 1)
+        ]
+        SendManager.send(msg.chat.id, split_message(lines, separator="")[0])
+
+    # /census - characters per race and per class
+    @staticmethod
+    @gm_router.message(Command("census"))
+    async def census(msg: Message) -> None:
+        races, classes = UserManager.census()
+
+        def entries(counts: list[tuple[str, int]]) -> str:
+            return "".join(RepliesManager.get("census_entry", name=name, count=count) for name, count in counts).strip()
+
+        census_msg = RepliesManager.get("census_msg",
+            count=sum(count for _, count in races), races=entries(races), classes=entries(classes)
+        )
+        SendManager.send(msg.chat.id, split_message([census_msg.strip()])[0])
+
+    @staticmethod
+    @gm_router.message(Command("digest"))
+    async def digest(msg: Message) -> None:
+        if not DigestManager.flush():
+            gm_msg = RepliesManager.get("digest_empty")
+            SendManager.send(msg.chat.id, gm_msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+    @staticmethod
+    @gm_router.message(Command("digest_queue"))
+    async def digest_queue(msg: Message) -> None:
+        version = DigestManager.version()
+        queue_msg, pages = DigestManager.page(0)
+        markup = GameBot.page_markup("digest", 0, pages, version)
+        SendManager.send(msg.chat.id, queue_msg, reply_markup=markup)
+    #endregion
+
+    @staticmethod
+    @conversation_router.message()
+    async def message(msg: Message, user: User | None, conversation: dict) -> None:
+        match conversation["status"]:
             case AwaitStatus.INFO: await GameBot.get_basic_info(msg)
-            case AwaitStatus.RACE: await GameBot.get_race_desc(msg)
-            case AwaitStatus.CLASS: await GameBot.get_class_desc(msg)
-            case AwaitStatus.DESCRIPTION: await GameBot.get_char_desc(msg)
-            case AwaitStatus.ACTION: await GameBot.get_action(msg)
-            case AwaitStatus.ASK: await GameBot.get_ask(msg)
\ No newline at end of file
+            case AwaitStatus.RACE: await GameBot.get_race_desc(msg, conversation)
+            case AwaitStatus.CLASS: await GameBot.get_class_desc(msg, conversation)
+            case AwaitStatus.DESCRIPTION: await GameBot.get_char_desc(msg, conversation)
+            case AwaitStatus.ACTION: await GameBot.get_action(msg, user)
+            case AwaitStatus.ASK: await GameBot.get_ask(msg, user)
+            case AwaitStatus.BROADCAST: await GameBot.get_broadcast(msg)
\ No newline at end of file
@@ -1,10 +1,9 @@
+import dotenv
+
 from game_bot import GameBot
-from datetime import datetime
-import logging
+from managers.log_manager import LogManager
 
 if __name__ == "__main__":
-    logging.basicConfig(
-        filename=f"logs/{datetime.now().strftime("%d.%m.%y_%H-%M-%S")}.log",
-        level=logging.INFO
-    )
+    dotenv.load_dotenv()
+    LogManager.setup()
     bot = GameBot()
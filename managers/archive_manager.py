@@ -0,0 +1,258 @@
+import csv
+import datetime
+import json
+import logging
+import os
+import struct
+import time
+from typing import Any, Dict, Iterator
+
+from managers.digest_manager import split_message
+from managers.replies_manager import RepliesManager
+from managers.rollover_manager import RolloverManager
+
+# (week, record offset), appended in time order so weeks never decrease
+WEEK_ENTRY = struct.Struct("<IQ")
+# (user_id, record offset, index of the user's previous entry or -1)
+USER_ENTRY = struct.Struct("<qQq")
+
+CSV_FIELDS = ("ts", "week", "user_id", "kind", "char_name", "text")
+
+class ArchiveManager:
+    # Every action and question, appended to `archive.log` as one JSON line.
+    # Two fixed-size indexes sit next to it: week.idx is sorted by week and
+    # searched by bisection, user.idx chains each user's entries backwards so
+    # a history is read newest first without scanning. Only the newest entry
+    # and the record count per user are kept in memory; records are read from
+    # disk on demand.
+    data_dir = "data"
+    page_size = 5
+    _log = None
+    _weeks = None
+    _users = None
+    _count = 0
+    # Week of the newest record
+    _last_week = 0
+    # user_id -> (index of the newest entry, number of entries)
+    _last: Dict[int, tuple[int, int]] = {}
+
+    @classmethod
+    def _path(cls, name: str) -> str:
+        return os.path.join(cls.data_dir, "archive", name)
+
+    #region Files
+    @classmethod
+    def open(cls, data_dir: str):
+        cls.data_dir = data_dir
+        os.makedirs(cls._path(""), exist_ok=True)
+        cls._log = open(cls._path("archive.log"), "a+b")
+        cls._weeks = open(cls._path("week.idx"), "a+b")
+        cls._users = open(cls._path("user.idx"), "a+b")
+        cls._recover()
+        logging.log(logging.INFO, f"Archive opened with {cls._count} records")
+
+    @classmethod
+    def _read_last(cls):
+        cls._last = {}
+        cls._users.seek(0)
+        index = 0
+        while chunk := cls._users.read(USER_ENTRY.size * 4096):
+            for user_id, _, _ in USER_ENTRY.iter_unpack(chunk):
+                cls._last[user_id] = (index, cls._last.get(user_id, (0, 0))[1] + 1)
+                index += 1
+
+    @classmethod
+    def _recover(cls):
+        # Appends write the record first and the indexes after it, so a crash
+        # leaves at most a torn record or a record missing from the indexes
+        count = min(os.fstat(cls._weeks.fileno()).st_size // WEEK_ENTRY.size,
+                    os.fstat(cls._users.fileno()).st_size // USER_ENTRY.size)
+        cls._weeks.truncate(count * WEEK_ENTRY.size)
+        cls._users.truncate(count * USER_ENTRY.size)
+        cls._count = count
+        cls._last_week = cls._week_entry(count - 1)[0] if count else 0
+        # Records indexed again below are chained to the users' entries so far
+        cls._read_last()
+
+        end = 0
+        if count:
+            cls._log.seek(cls._week_entry(count - 1)[1])
+            end = cls._log.tell() + len(cls._log.readline())
+        cls._log.seek(end)
+        for line in iter(cls._log.readline, b""):
+            if not line.endswith(b"\n"):
+                break
+            record = json.loads(line)
+            cls._index(record["week"], record["user_id"], end)
+            end += len(line)
+        cls._log.truncate(end)
+        if cls._count != count:
+            logging.log(logging.WARNING, f"Archive indexes rebuilt for {cls._count - count} records")
+
+    @classmethod
+    def close(cls):
+        for file in (cls._log, cls._weeks, cls._users):
+            if file is not None:
+                file.close()
+        cls._log = cls._weeks = cls._users = None
+    #endregion
+
+    #region Writing
+    @classmethod
+    def append(cls, kind: str, user_id: int, char_name: str, text: str):
+        week = cls.current_week()
+        record = {"ts": int(time.time()), "week": week, "user_id": user_id, "kind": kind,
+                  "char_name": char_name, "text": text}
+        offset = os.fstat(cls._log.fileno()).st_size
+        cls._log.write(json.dumps(record, ensure_ascii=False).encode() + b"\n")
+        cls._log.flush()
+        cls._index(week, user_id, offset)
+
+    @classmethod
+    def _index(cls, week: int, user_id: int, offset: int):
+        cls._weeks.write(WEEK_ENTRY.pack(week, offset))
+        previous, count = cls._last.get(user_id, (-1, 0))
+        cls._users.write(USER_ENTRY.pack(user_id, offset, previous))
+        cls._weeks.flush()
+        cls._users.flush()
+        cls._last[user_id] = (cls._count, count + 1)
+        cls._count += 1
+        cls._last_week = week
+
+    # Weeks are turns: the ordinal of the day the turn started on
+    @staticmethod
+    def week_of(moment: datetime.datetime) -> int:
+        return RolloverManager.last_due(moment).date().toordinal()
+
+    # The week new records go to. A schedule moved to an earlier day would
+    # give an earlier week than the last record's, which week.idx (searched
+    # by bisection) cannot hold; records stay in the last week until the new
+    # schedule's week passes it.
+    @classmethod
+    def current_week(cls) -> int:
+        return max(cls.week_of(datetime.datetime.now()), cls._last_week)
+    #endregion
+
+    #region Reading
+    @staticmethod
+    def _entry(file, entry: struct.Struct, index: int) -> tuple:
+        return entry.unpack(os.pread(file.fileno(), entry.size, index * entry.size))
+
+    @classmethod
+    def _week_entry(cls, index: int) -> tuple[int, int]:
+        return cls._entry(cls._weeks, WEEK_ENTRY, index)
+
+    @classmethod
+    def _record(cls, offset: int) -> Dict[str, Any]:
+        # Records are short; read a block and extend it only for long ones
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = os.pread(cls._log.fileno(), 4096, offset + len(data))
+            if not chunk:
+                break
+            newline = chunk.find(b"\n")
+            data += chunk if newline < 0 else chunk[:newline + 1]
+        return json.loads(data)
+
+    # Entry indexes [start, end) belonging to the week
+    @classmethod
+    def week_range(cls, week: int) -> tuple[int, int]:
+        def bisect(target: int) -> int:
+            low, high = 0, cls._count
+            while low < high:
+                middle = (low + high) // 2
+                if cls._week_entry(middle)[0] < target:
+                    low = middle + 1
+                else:
+                    high = middle
+            return low
+        return bisect(week), bisect(week + 1)
+
+    @classmethod
+    def week_page(cls, week: int, page: int, page_size: int) -> tuple[list[Dict[str, Any]], int]:
+        start, end = cls.week_range(week)
+        first = start + page * page_size
+        records = [cls._record(cls._week_entry(index)[1]) for index in range(first, min(first + page_size, end))]
+        return records, end - start
+
+    # Newest first. The chain is walked from the user's latest entry, so
+    # page N costs N * page_size index reads.
+    @classmethod
+    def user_page(cls, user_id: int, page: int, page_size: int) -> tuple[list[Dict[str, Any]], int]:
+        index, total = cls._last.get(user_id, (-1, 0))
+        skipped, records = 0, []
+        while index >= 0 and len(records) < page_size:
+            _, offset, previous = cls._entry(cls._users, USER_ENTRY, index)
+            if skipped < page * page_size:
+                skipped += 1
+            else:
+                records.append(cls._record(offset))
+            index = previous
+        return records, total
+
+    # index is "week" or "user"; returns (text, page count) like PageManager
+    @classmethod
+    def page(cls, index: str, key: int, page: int) -> tuple[str, int]:
+        if index == "week":
+            records, total = cls.week_page(key, page, cls.page_size)
+            header = dict(week=f"{datetime.date.fromordinal(key):%d.%m %Y}")
+        else:
+            records, total = cls.user_page(key, page, cls.page_size)
+            header = dict(user_id=key)
+        if not total:
+            return RepliesManager.get("archive_empty"), 0
+        pages = (total - 1) // cls.page_size + 1
+        header = RepliesManager.get(f"archive_{index}_page", count=total, page=page + 1, pages=pages, **header)
+        entries = [
+            RepliesManager.get(f"archive_{record['kind']}",
+                date=time.strftime("%d.%m %H:%M", time.localtime(record["ts"])),
+                char_name=record["char_name"], user_id=record["user_id"], text=record["text"]
+            ).strip()
+            for record in records
+        ]
+        return split_message([header.strip()] + entries)[0], pages
+    #endregion
+
+    #region Export
+    @classmethod
+    def _iter_records(cls, week: int | None) -> Iterator[bytes]:
+        # A week's records are one contiguous run of the log
+        start, end = cls.week_range(week) if week is not None else (0, cls._count)
+        if start == end:
+            return
+        position = cls._week_entry(start)[1]
+        stop = cls._week_entry(end)[1] if end < cls._count else os.fstat(cls._log.fileno()).st_size
+        file = open(cls._path("archive.log"), "rb")
+        file.seek(position)
+        for line in file:
+            if position >= stop:
+                break
+            yield line
+            position += len(line)
+        file.close()
+
+    # Streams the week (or everything) into a file in data/archive/exports
+    # and returns its path, or None when there is nothing to export. Records
+    # go through one line at a time.
+    @classmethod
+    def export(cls, week: int | None, export_format: str) -> str | None:
+        os.makedirs(cls._path("exports"), exist_ok=True)
+        name = f"archive_{datetime.date.fromordinal(week):%d.%m.%Y}" if week is not None else "archive"
+        path = cls._path(os.path.join("exports", f"{name}_{int(time.time())}.{export_format}"))
+        written = 0
+        file = open(path, "w", encoding="utf-8", newline="")
+        writer = csv.DictWriter(file, CSV_FIELDS) if export_format == "csv" else None
+        if writer is not None:
+            writer.writeheader()
+        for line in cls._iter_records(week):
+            if writer is not None:
+                writer.writerow(json.loads(line))
+            else:
+                file.write(line.decode())
+            written += 1
+        file.close()
+        if not written:
+            os.remove(path)
+            return None
+        return path
+    #endregion
@@ -0,0 +1,193 @@
+import argparse
+from collections.abc import MutableMapping
+import gzip
+import json
+import lzma
+import mmap
+import os
+import struct
+from typing import Dict, Any, Iterable, Iterator
+
+from managers.user import User
+
+# File layout (little endian):
+#   header   magic, version, compression, user count, index offset, meta length
+#   meta     JSON object (journal seq and the like), never compressed
+#   body     records, then the index; compressed as a whole if requested
+#   record   u32 length + fixed fields + length-prefixed strings
+#   index    (user_id, record offset in body) pairs, sorted by user_id
+MAGIC = b"PTBS"
+VERSION = 1
+HEADER = struct.Struct("<4sHBxIQI")
+RECORD_FIXED = struct.Struct("<qBBii")
+INDEX_ENTRY = struct.Struct("<qQ")
+LENGTH = struct.Struct("<I")
+SHORT = struct.Struct("<H")
+COUNT = struct.Struct("<I")
+# The largest item count a record can hold
+MAX_COUNT = 2 ** (8 * COUNT.size) - 1
+
+COMPRESSION = {"none": 0, "gzip": 1, "lzma": 2}
+_compress = {1: gzip.compress, 2: lzma.compress}
+_decompress = {1: gzip.decompress, 2: lzma.decompress}
+
+FLAG_ASK_BAN = 1
+FLAG_ACTION = 2
+
+
+def _pack_str(value: str) -> bytes:
+    data = value.encode()
+    return SHORT.pack(len(data)) + data
+
+def encode_record(user: User) -> bytes:
+    parts = [
+        RECORD_FIXED.pack(
+            user.user_id, user.status,
+            (FLAG_ASK_BAN if user.ask_ban else 0) | (FLAG_ACTION if user.action else 0),
+            user.date_joined, user.action_count
+        ),
+        _pack_str(user.char_name), _pack_str(user.char_race), _pack_str(user.char_class),
+        SHORT.pack(len(user.skills)), *(_pack_str(skill_id) for skill_id in user.skills),
+        SHORT.pack(len(user.inventory))
+    ]
+    for item_id, count in user.inventory.items():
+        parts.append(_pack_str(item_id))
+        parts.append(COUNT.pack(count))
+    payload = b"".join(parts)
+    return LENGTH.pack(len(payload)) + payload
+
+def decode_record(buffer, offset: int) -> Dict[str, Any]:
+    offset += LENGTH.size
+    user_id, status, flags, date_joined, action_count = RECORD_FIXED.unpack_from(buffer, offset)
+    offset += RECORD_FIXED.size
+
+    def read_str() -> str:
+        nonlocal offset
+        (length,) = SHORT.unpack_from(buffer, offset)
+        offset += SHORT.size + length
+        return bytes(buffer[offset - length:offset]).decode()
+
+    char_name, char_race, char_class = read_str(), read_str(), read_str()
+    (skill_count,) = SHORT.unpack_from(buffer, offset)
+    offset += SHORT.size
+    skills = [read_str() for _ in range(skill_count)]
+    (item_count,) = SHORT.unpack_from(buffer, offset)
+    offset += SHORT.size
+    inventory = {}
+    for _ in range(item_count):
+        item_id = read_str()
+        (inventory[item_id],) = COUNT.unpack_from(buffer, offset)
+        offset += COUNT.size
+
+    return {
+        "status": status, "ask_ban": bool(flags & FLAG_ASK_BAN), "user_id": user_id,
+        "date_joined": date_joined, "action_count": action_count,
+        "char_name": char_name, "char_race": char_race, "char_class": char_class,
+        "action": bool(flags & FLAG_ACTION), "skills": skills, "inventory": inventory
+    }
+
+
+def write_snapshot(path: str, records: Iterable[bytes], meta: Dict[str, Any], compression: str = "none") -> None:
+    body, index, offset = [], [], 0
+    for record in records:
+        (user_id,) = struct.unpack_from("<q", record, LENGTH.size)
+        index.append((user_id, offset))
+        body.append(record)
+        offset += len(record)
+    index.sort()
+    body.append(b"".join(INDEX_ENTRY.pack(*entry) for entry in index))
+    body = b"".join(body)
+    if COMPRESSION[compression]:
+        body = _compress[COMPRESSION[compression]](body)
+
+    meta = json.dumps(meta).encode()
+    file = open(path, "wb")
+    file.write(HEADER.pack(MAGIC, VERSION, COMPRESSION[compression], len(index), offset, len(meta)))
+    file.write(meta)
+    file.write(body)
+    file.flush()
+    os.fsync(file.fileno())
+    file.close()
+
+
+# Random access to a snapshot: the index is read once at open, after which
+# any single user is one dict lookup plus one record decode. Uncompressed
+# files are memory-mapped; compressed ones are inflated into memory.
+# Deleting a key only hides it, which is how UserManager consumes records.
+class SnapshotReader(MutableMapping):
+    def __init__(self, path: str):
+        file = open(path, "rb")
+        magic, version, compression, count, index_offset, meta_length = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a user snapshot")
+        if version != VERSION:
+            raise ValueError(f"Unsupported snapshot version {version}")
+        self.meta = json.loads(file.read(meta_length))
+
+        if compression:
+            self._buffer = memoryview(_decompress[compression](file.read()))
+        else:
+            body_start = HEADER.size + meta_length
+            self._buffer = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))[body_start:]
+        file.close()
+
+        self._index = {}
+        for i in range(count):
+            user_id, offset = INDEX_ENTRY.unpack_from(self._buffer, index_offset + i * INDEX_ENTRY.size)
+            self._index[user_id] = offset
+
+    def __getitem__(self, user_id: int) -> Dict[str, Any]:
+        return decode_record(self._buffer, self._index[user_id])
+
+    def __delitem__(self, user_id: int) -> None:
+        del self._index[user_id]
+
+    def popitem(self) -> tuple[int, Dict[str, Any]]:
+        user_id, offset = self._index.popitem()
+        return user_id, decode_record(self._buffer, offset)
+
+    def __setitem__(self, user_id, value):
+        raise TypeError("Snapshots are read-only")
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._index
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(list(self._index))
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+def json_to_binary(source: str, target: str, compression: str = "none") -> int:
+    file = open(source, "r", encoding="utf-8")
+    raw_users = json.load(file)
+    file.close()
+    meta = {}
+    if "users" in raw_users:
+        meta, raw_users = raw_users["meta"], raw_users["users"]
+    write_snapshot(target, (encode_record(User.from_dict(raw)) for raw in raw_users.values()), meta, compression)
+    return len(raw_users)
+
+def binary_to_json(source: str, target: str) -> int:
+    reader = SnapshotReader(source)
+    users = {user_id: User.from_dict(reader[user_id]).to_dict() for user_id in reader}
+    file = open(target, "w", encoding="utf-8")
+    json.dump({"meta": reader.meta, "users": users}, file, indent=2)
+    file.close()
+    return len(users)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert user snapshots between JSON and binary")
+    parser.add_argument("direction", choices=("to-binary", "to-json"))
+    parser.add_argument("source")
+    parser.add_argument("target")
+    parser.add_argument("--compression", choices=tuple(COMPRESSION), default="none")
+    args = parser.parse_args()
+
+    if args.direction == "to-binary":
+        count = json_to_binary(args.source, args.target, args.compression)
+    else:
+        count = binary_to_json(args.source, args.target)
+    print(f"Converted {count} users")
@@ -0,0 +1,264 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+
+from aiogram.enums.parse_mode import ParseMode
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendDocument, SendPhoto
+from aiogram.types import FSInputFile, Message
+
+from managers.media_manager import MediaManager
+from managers.replies_manager import RepliesManager
+from managers.send_manager import Lane, SendManager
+from managers.user import UserStatus
+from managers.user_manager import UserManager
+
+METHODS = {"photo": SendPhoto, "document": SendDocument}
+
+class BroadcastManager:
+    # A photo or document with a caption for every active player, one
+    # broadcast at a time. The job is written to data/broadcast/job.json
+    # before anything is sent and deliveries are appended to progress.log
+    # about every second, off the loop, so after a crash or restart the job
+    # resumes with the players not reached yet (messages delivered in the
+    # last second or so may go out twice). The GM gets a summary and a CSV with every recipient's outcome.
+    data_dir = "data"
+    parallelism = 50
+    flush_interval = 1
+    chat_id = 0
+    _task: asyncio.Task = None
+
+    @classmethod
+    def _path(cls, name: str) -> str:
+        return os.path.join(cls.data_dir, "broadcast", name)
+
+    @classmethod
+    def start(cls, chat_id: int, data_dir: str):
+        cls.chat_id, cls.data_dir = chat_id, data_dir
+        cls.parallelism = int(os.getenv("PTB_BROADCAST_PARALLELISM", cls.parallelism))
+        if os.path.exists(cls._path("job.json")):
+            cls._task = asyncio.create_task(cls._resume())
+
+    # The job stays on disk and resumes on the next start
+    @classmethod
+    def stop(cls):
+        if cls._task is not None:
+            cls._task.cancel()
+            cls._task = None
+
+    @classmethod
+    def busy(cls) -> bool:
+        return cls._task is not None and not cls._task.done()
+
+    # `media` is a file_id, or with `local` the name of a file in data/media.
+    # Returns the number of recipients.
+    @classmethod
+    async def broadcast(cls, kind: str, media: str, caption: str | None, local: bool = False) -> int:
+        job = {
+            "id": int(time.time()), "kind": kind, "media": media, "local": local, "caption": caption,
+            "recipients": UserManager.with_status(UserStatus.ACTIVE)
+        }
+        # The task is set before the job is written, so busy() holds from here on
+        cls._task = asyncio.create_task(cls._start(job))
+        return len(job["recipients"])
+
+    #region Job files
+    @classmethod
+    def _write_job(cls, job: dict):
+        os.makedirs(cls._path(""), exist_ok=True)
+        file = open(cls._path("job.json.tmp"), "w", encoding="utf-8")
+        json.dump(job, file)
+        file.flush()
+        os.fsync(file.fileno())
+        file.close()
+        os.replace(cls._path("job.json.tmp"), cls._path("job.json"))
+        cls._start_progress(job)
+
+    # The progress starts with the id of its job, so lines left from an
+    # earlier job (the process died before they were cleared) are not
+    # counted for this one
+    @classmethod
+    def _start_progress(cls, job: dict):
+        file = open(cls._path("progress.log"), "w", encoding="utf-8")
+        file.write(f"#{job['id']}\n")
+        file.close()
+
+    @classmethod
+    def _read_job(cls) -> tuple[dict, dict[int, str]]:
+        file = open(cls._path("job.json"), "r", encoding="utf-8")
+        job = json.load(file)
+        file.close()
+        done = {}
+        path = cls._path("progress.log")
+        if os.path.exists(path):
+            file = open(path, "rb")
+            intact = 0
+            # The first line is the job id (older files start with a result
+            # right away); the progress of another job is dropped
+            header = file.readline()
+            if header == f"#{job['id']}\n".encode():
+                intact = len(header)
+            elif header.startswith(b"#") or not header.endswith(b"\n"):
+                file.close()
+                cls._start_progress(job)
+                return job, done
+            else:
+                file.seek(0)
+            for line in file:
+                # A torn last line is sent again
+                if not line.endswith(b"\n"):
+                    break
+                chat_id, outcome = line.decode().rstrip("\n").split("\t", 1)
+                done[int(chat_id)] = outcome
+                intact += len(line)
+            file.close()
+            # Cut it off, or the next line would be appended to it
+            if intact < os.path.getsize(path):
+                os.truncate(path, intact)
+        return job, done
+
+    @classmethod
+    def _clear_job(cls):
+        for name in ("job.json", "progress.log"):
+            if os.path.exists(cls._path(name)):
+                os.remove(cls._path(name))
+    #endregion
+
+    #region Sending
+    @classmethod
+    async def _start(cls, job: dict):
+        try:
+            await asyncio.to_thread(cls._write_job, job)
+        except Exception as error:
+            logging.exception(f"Broadcast {job['id']} not saved")
+            SendManager.send(cls.chat_id, RepliesManager.get("broadcast_failed", error=error))
+            return
+        await cls._run(job, {})
+
+    @classmethod
+    async def _resume(cls):
+        await UserManager.wait_ready()
+        job, done = await asyncio.to_thread(cls._read_job)
+        remaining = len(job["recipients"]) - len(done)
+        logging.log(logging.INFO, f"Broadcast {job['id']} resumed, {remaining} recipients left")
+        SendManager.send(cls.chat_id, RepliesManager.get(
+            "broadcast_resumed", count=remaining, total=len(job["recipients"])
+        ))
+        await cls._run(job, done)
+
+    @classmethod
+    async def _run(cls, job: dict, done: dict[int, str]):
+        try:
+            file_id = await cls._file_id(job)
+        except Exception as error:
+            logging.exception(f"Broadcast {job['id']} media upload failed")
+            SendManager.send(cls.chat_id, RepliesManager.get("broadcast_failed", error=error))
+            await asyncio.to_thread(cls._clear_job)
+            return
+
+        method = METHODS[job["kind"]]
+        log = open(cls._path("progress.log"), "a", encoding="utf-8")
+        lines = []
+        finished = asyncio.Event()
+
+        def record(chat_id: int, error: Exception | None):
+            outcome = "ok" if error is None else " ".join(str(error).split())
+            done[chat_id] = outcome
+            lines.append(f"{chat_id}\t{outcome}\n")
+
+        def write(batch: list[str]):
+            log.write("".join(batch))
+            log.flush()
+
+        async def write_progress():
+            while not finished.is_set():
+                try:
+                    await asyncio.wait_for(finished.wait(), cls.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                if lines:
+                    batch = lines.copy()
+                    lines.clear()
+                    await asyncio.to_thread(write, batch)
+
+        started = time.perf_counter()
+        writer = asyncio.create_task(write_progress())
+        try:
+            await SendManager.fan_out_method(
+                [chat_id for chat_id in job["recipients"] if chat_id not in done],
+                lambda chat_id: method(chat_id=chat_id, caption=job["caption"], parse_mode=ParseMode.HTML,
+                                       **{job["kind"]: file_id}),
+                Lane.LOW, cls.parallelism, on_result=record
+            )
+        finally:
+            # The last batch is written even when the broadcast is stopped
+            finished.set()
+            await writer
+            log.close()
+        logging.log(logging.INFO, f"Broadcast {job['id']} sent in {time.perf_counter() - started:.1f}s")
+        await cls._report(job, done)
+        await asyncio.to_thread(cls._clear_job)
+
+    # Files from data/media are uploaded once, to the GM as a preview, and
+    # sent to players by the file_id that comes back
+    @classmethod
+    async def _file_id(cls, job: dict) -> str:
+        if not job["local"]:
+            return job["media"]
+        kind, path = job["kind"], MediaManager.path(job["media"])
+        if path is None:
+            raise FileNotFoundError(job["media"])
+        digest = await asyncio.to_thread(MediaManager.digest, path)
+        method = METHODS[kind]
+
+        file_id = MediaManager.get(digest, kind)
+        if file_id is not None:
+            try:
+                await SendManager.enqueue(method(
+                    chat_id=cls.chat_id, caption=job["caption"], parse_mode=ParseMode.HTML, **{kind: file_id}
+                ))
+                return file_id
+            except TelegramBadRequest:
+                MediaManager.forget(digest, kind)
+
+        message: Message = await SendManager.enqueue(method(
+            chat_id=cls.chat_id, caption=job["caption"], parse_mode=ParseMode.HTML, **{kind: FSInputFile(path)}
+        ))
+        file_id = message.photo[-1].file_id if kind == "photo" else message.document.file_id
+        MediaManager.put(digest, kind, file_id)
+        logging.log(logging.INFO, f"Uploaded {job['media']} for broadcasting")
+        return file_id
+    #endregion
+
+    #region Report
+    @classmethod
+    def _write_report(cls, job: dict, done: dict[int, str]) -> str:
+        path = cls._path(f"report_{job['id']}.csv")
+        file = open(path, "w", encoding="utf-8", newline="")
+        writer = csv.writer(file)
+        writer.writerow(("user_id", "char_name", "status"))
+        for chat_id in job["recipients"]:
+            user = UserManager.lookup(chat_id)
+            writer.writerow((chat_id, user.char_name if user is not None else "", done.get(chat_id, "pending")))
+        file.close()
+        return path
+
+    @classmethod
+    async def _report(cls, job: dict, done: dict[int, str]):
+        sent = sum(outcome == "ok" for outcome in done.values())
+        SendManager.send(cls.chat_id, RepliesManager.get(
+            "broadcast_done", count=len(job["recipients"]), sent=sent, failed=len(done) - sent
+        ))
+        if not job["recipients"]:
+            return
+        path = await asyncio.to_thread(cls._write_report, job, done)
+        try:
+            await SendManager.enqueue(SendDocument(chat_id=cls.chat_id, document=FSInputFile(path)))
+        except Exception:
+            logging.exception(f"Broadcast {job['id']} report not delivered")
+        finally:
+            os.remove(path)
+    #endregion
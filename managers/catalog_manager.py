@@ -0,0 +1,121 @@
+import asyncio
+from dataclasses import dataclass
+import json
+import logging
+import os
+from types import MappingProxyType
+from typing import Any, Callable, Mapping
+import yaml
+
+from managers.replies_manager import RepliesManager, Template
+
+@dataclass(frozen=True, slots=True)
+class Catalog:
+    version: int
+    replies: Mapping[str, Template]
+    skills: Mapping[str, Mapping[str, Any]]
+    items: Mapping[str, Mapping[str, Any]]
+
+
+def _freeze(entries: dict[str, dict[str, Any]]) -> Mapping[str, Mapping[str, Any]]:
+    return MappingProxyType({key: MappingProxyType(value) for key, value in entries.items()})
+
+
+class CatalogManager:
+    # Replies, skills and items as one immutable, versioned Catalog. Changed
+    # files are parsed off the event loop and the new catalog replaces the
+    # old one with a single assignment, so anything holding a Catalog keeps
+    # a consistent view and nothing ever locks.
+    _instance = None
+    data_dir = "data"
+    watch_interval = 5
+    catalog: Catalog = None
+    _mtimes: dict[str, float] = {}
+    _watcher: asyncio.Task = None
+
+    FILES: dict[str, tuple[str, Callable[[Any], Any]]] = {
+        "replies": ("replies.yaml", lambda raw: MappingProxyType(RepliesManager.compile(raw))),
+        "skills": ("skills.json", _freeze),
+        "items": ("items.json", _freeze)
+    }
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._swap(*cls._build(force=True))
+        return cls._instance
+
+    # The mtimes are taken over only here, so files read for a catalog that
+    # is thrown away are read again on the next pass
+    @classmethod
+    def _swap(cls, catalog: Catalog | None, mtimes: dict[str, float]) -> None:
+        cls._mtimes.update(mtimes)
+        if catalog is None:
+            return
+        cls.catalog = catalog
+        RepliesManager.templates = catalog.replies
+
+    @classmethod
+    def _mtime(cls, name: str) -> float:
+        return os.stat(os.path.join(cls.data_dir, name)).st_mtime_ns
+
+    @classmethod
+    def _read(cls, name: str) -> Any:
+        file = open(os.path.join(cls.data_dir, name), "r", encoding="utf-8")
+        data = yaml.safe_load(file) if name.endswith(".yaml") else json.load(file)
+        file.close()
+        return data
+
+    @classmethod
+    def _build(cls, force: bool = False) -> tuple[Catalog | None, dict[str, float]]:
+        # Only files whose mtime moved are parsed again; the rest are shared
+        # with the current catalog. A file that fails to parse keeps its old
+        # contents until it is edited again. Returns the new catalog (None if
+        # nothing changed) and the mtimes of the files read for it.
+        parts, mtimes, changed = {}, {}, False
+        for part, (name, convert) in cls.FILES.items():
+            mtime = cls._mtime(name)
+            parts[part] = getattr(cls.catalog, part, None)
+            if not force and mtime == cls._mtimes.get(name):
+                continue
+            mtimes[name] = mtime
+            try:
+                parts[part] = convert(cls._read(name))
+                changed = True
+            except (ValueError, yaml.YAMLError) as error:
+                if force:
+                    raise
+                logging.log(logging.ERROR, f"Keeping the previous {name}: {error}")
+        if not changed:
+            return None, mtimes
+        return Catalog(version=cls.catalog.version + 1 if cls.catalog else 1, **parts), mtimes
+
+    @classmethod
+    async def reload(cls, force: bool = False) -> bool:
+        try:
+            catalog, mtimes = await asyncio.to_thread(cls._build, force)
+        except (OSError, ValueError, yaml.YAMLError) as error:
+            logging.log(logging.ERROR, f"Catalog reload failed: {error}")
+            return False
+        cls._swap(catalog, mtimes)
+        if catalog is None:
+            return False
+        logging.log(logging.INFO, f"Catalog version {catalog.version} loaded")
+        return True
+
+    @classmethod
+    async def _watch(cls):
+        while True:
+            await asyncio.sleep(cls.watch_interval)
+            await cls.reload()
+
+    @classmethod
+    def start_watching(cls):
+        if cls._watcher is None:
+            cls._watcher = asyncio.create_task(cls._watch())
+
+    @classmethod
+    def stop_watching(cls):
+        if cls._watcher is not None:
+            cls._watcher.cancel()
+            cls._watcher = None
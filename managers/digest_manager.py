@@ -0,0 +1,115 @@
+import asyncio
+from collections import deque
+import os
+import time
+
+from managers.replies_manager import RepliesManager
+from managers.send_manager import Lane, SendManager
+
+MESSAGE_LIMIT = 4096
+
+# Joins parts into as few messages as possible, never cutting a part unless
+# it is longer than a message on its own
+def split_message(parts: list[str], limit: int = MESSAGE_LIMIT, separator: str = "\n\n") -> list[str]:
+    messages, current = [], ""
+    for part in parts:
+        while len(part) > limit:
+            if current:
+                messages.append(current)
+                current = ""
+            messages.append(part[:limit])
+            part = part[limit:]
+        if not current:
+            current = part
+        elif len(current) + len(separator) + len(part) <= limit:
+            current += separator + part
+        else:
+            messages.append(current)
+            current = part
+    if current:
+        messages.append(current)
+    return messages
+
+
+class DigestManager:
+    # new_user/new_action/new_ask notifications for the GM. With PTB_DIGEST
+    # on they are buffered and sent as combined messages once `size` of them
+    # pile up, `window` seconds after the first one, or on /digest. Sent
+    # notifications stay in a bounded history the GM pages through with
+    # /digest_queue.
+    enabled = False
+    size = 20
+    window = 300
+    retain = 500
+    page_size = 5
+    chat_id = 0
+    _buffer: list[tuple[float, str]] = []
+    _history: deque[tuple[float, str]] = deque(maxlen=retain)
+    _added = 0
+    _timer: asyncio.TimerHandle = None
+
+    @classmethod
+    def start(cls, chat_id: int):
+        cls.chat_id = chat_id
+        cls.enabled = os.getenv("PTB_DIGEST", "off") == "on"
+        cls.size = int(os.getenv("PTB_DIGEST_SIZE", cls.size))
+        cls.window = float(os.getenv("PTB_DIGEST_WINDOW", cls.window))
+        cls.retain = int(os.getenv("PTB_DIGEST_RETAIN", cls.retain))
+        cls._history = deque(cls._history, maxlen=cls.retain)
+
+    @classmethod
+    def notify(cls, text: str):
+        entry = (time.time(), text)
+        cls._history.append(entry)
+        cls._added += 1
+        if not cls.enabled:
+            SendManager.send(cls.chat_id, text, Lane.LOW)
+            return
+
+        cls._buffer.append(entry)
+        if len(cls._buffer) >= cls.size:
+            cls.flush()
+        elif cls._timer is None:
+            cls._timer = asyncio.get_running_loop().call_later(cls.window, cls.flush)
+
+    # Returns how many notifications were sent
+    @classmethod
+    def flush(cls) -> int:
+        if cls._timer is not None:
+            cls._timer.cancel()
+            cls._timer = None
+        entries, cls._buffer = cls._buffer, []
+        if not entries:
+            return 0
+
+        messages = split_message([cls._format(entry) for entry in entries], MESSAGE_LIMIT - 100)
+        for part, message in enumerate(messages, 1):
+            header = RepliesManager.get("digest_header", count=len(entries), part=part, parts=len(messages))
+            SendManager.send(cls.chat_id, f"{header}\n{message}", Lane.LOW)
+        return len(entries)
+
+    @staticmethod
+    def _format(entry: tuple[float, str]) -> str:
+        return f"[{time.strftime('%d.%m %H:%M', time.localtime(entry[0]))}]\n{entry[1].strip()}"
+
+    @classmethod
+    def pending(cls) -> int:
+        return len(cls._buffer)
+
+    # Changes whenever a notification arrives, so stale page buttons reset
+    @classmethod
+    def version(cls) -> int:
+        return cls._added & 0xFFFF
+
+    # Newest first; returns (text, page count) like PageManager
+    @classmethod
+    def page(cls, page: int) -> tuple[str, int]:
+        if not cls._history:
+            return RepliesManager.get("digest_queue_empty"), 0
+        pages = (len(cls._history) - 1) // cls.page_size + 1
+        page = min(page, pages - 1)
+        start = len(cls._history) - page * cls.page_size
+        entries = [cls._history[i] for i in range(start - 1, max(start - cls.page_size, 0) - 1, -1)]
+        header = RepliesManager.get("digest_page", page=page + 1, pages=pages, count=len(cls._history)).strip()
+        text = split_message([header] + [cls._format(entry) for entry in entries])[0]
+        return text, pages
@@ -0,0 +1,145 @@
+import atexit
+from contextvars import ContextVar
+import copy
+import datetime
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import shutil
+
+# Per-update records, one for every handled update
+UPDATE_LOGGER = "ptb.updates"
+# Loggers that write a record per update and are sampled
+SAMPLED_LOGGERS = (UPDATE_LOGGER, "aiogram.event")
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Set by the middlewares for the update being handled
+update_id_var: ContextVar[int | None] = ContextVar("update_id", default=None)
+user_id_var: ContextVar[int | None] = ContextVar("user_id", default=None)
+handler_var: ContextVar[str | None] = ContextVar("handler", default=None)
+
+class ContextFilter(logging.Filter):
+    # Runs in the thread that logs, where the context variables of the update
+    # are still set, and copies them onto the record
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.update_id = update_id_var.get()
+        record.user_id = user_id_var.get()
+        if getattr(record, "handler", None) is None:
+            record.handler = handler_var.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    # Keeps `rate` of the records below WARNING from the sampled loggers.
+    # Warnings, errors and updates slower than `slow` seconds are always kept.
+    def __init__(self, rate: float, slow: float):
+        super().__init__()
+        self.rate = rate
+        self.slow = slow
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.name not in SAMPLED_LOGGERS or record.levelno >= logging.WARNING:
+            return True
+        if getattr(record, "latency", 0) >= self.slow:
+            return True
+        return random.random() < self.rate
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line; context fields are left out when unset
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for field in ("update_id", "user_id", "handler"):
+            if (value := getattr(record, field, None)) is not None:
+                entry[field] = value
+        if (latency := getattr(record, "latency", None)) is not None:
+            entry["latency_ms"] = round(latency * 1000, 3)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # The stock prepare() formats the record here, on the event loop, with a
+    # default formatter. Only the message and the traceback are resolved
+    # now; the fields stay on the record for the formatter in the listener.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def _gzip_rotator(source: str, dest: str):
+    file = open(source, "rb")
+    archive = gzip.open(dest, "wb")
+    shutil.copyfileobj(file, archive)
+    archive.close()
+    file.close()
+    os.remove(source)
+
+class LogManager:
+    # Log calls only put the record on a queue; a QueueListener thread does
+    # the formatting and the disk I/O, so the event loop never waits for the
+    # disk. The file in logs/ is rotated by size (PTB_LOG_ROTATE=size) or by
+    # time (a TimedRotatingFileHandler `when`, e.g. "midnight") and rotated
+    # files are gzipped.
+    _listener: logging.handlers.QueueListener = None
+
+    @classmethod
+    def setup(cls):
+        directory = os.getenv("PTB_LOG_DIR", "logs")
+        os.makedirs(directory, exist_ok=True)
+        handler = cls._file_handler(os.path.join(directory, "bot.log"))
+        handler.setFormatter(JsonFormatter() if os.getenv("PTB_LOG_FORMAT", "json") == "json"
+                             else logging.Formatter(TEXT_FORMAT))
+
+        records = queue.SimpleQueue()
+        queue_handler = _QueueHandler(records)
+        # Sampled out records never reach the queue
+        queue_handler.addFilter(SamplingFilter(
+            float(os.getenv("PTB_LOG_SAMPLE", 0.1)), float(os.getenv("PTB_LOG_SLOW", 1.0))
+        ))
+        queue_handler.addFilter(ContextFilter())
+        root = logging.getLogger()
+        root.setLevel(os.getenv("PTB_LOG_LEVEL", "INFO").upper())
+        root.addHandler(queue_handler)
+
+        cls._listener = logging.handlers.QueueListener(records, handler)
+        cls._listener.start()
+        # Registered before the managers' own exit hooks, so it runs after them
+        # and their last records are written
+        atexit.register(cls.stop)
+
+    @staticmethod
+    def _file_handler(path: str) -> logging.Handler:
+        backups = int(os.getenv("PTB_LOG_BACKUPS", 10))
+        rotate = os.getenv("PTB_LOG_ROTATE", "size")
+        if rotate == "size":
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=int(os.getenv("PTB_LOG_MAX_BYTES", 10 * 1024 * 1024)),
+                backupCount=backups, encoding="utf-8"
+            )
+        else:
+            handler = logging.handlers.TimedRotatingFileHandler(
+                path, when=rotate, backupCount=backups, encoding="utf-8"
+            )
+        handler.namer = lambda name: name + ".gz"
+        handler.rotator = _gzip_rotator
+        return handler
+
+    # Writes out what is still queued
+    @classmethod
+    def stop(cls):
+        if cls._listener is not None:
+            cls._listener.stop()
+            cls._listener = None
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import logging
+import os
+
+# Extensions sent as photos; anything else goes out as a document
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+class MediaManager:
+    # Files the GM drops into data/media are uploaded once. The file_id
+    # Telegram returns is kept in data/media_cache.json under the SHA-256 of
+    # the content and the way it was sent (photo or document), so the same
+    # picture is never uploaded again, even renamed or after a restart.
+    data_dir = "data"
+    _cache: dict[str, dict[str, str]] = {}
+
+    @classmethod
+    def load(cls, data_dir: str):
+        cls.data_dir = data_dir
+        path = os.path.join(data_dir, "media_cache.json")
+        if not os.path.exists(path):
+            cls._cache = {}
+            return
+        file = open(path, "r", encoding="utf-8")
+        cls._cache = json.load(file)
+        file.close()
+        logging.log(logging.INFO, f"{len(cls._cache)} cached media files")
+
+    @classmethod
+    def _save(cls):
+        path = os.path.join(cls.data_dir, "media_cache.json")
+        file = open(path + ".tmp", "w", encoding="utf-8")
+        json.dump(cls._cache, file, indent=2)
+        file.close()
+        os.replace(path + ".tmp", path)
+
+    # Path of a file in data/media, or None if there is no such file
+    @classmethod
+    def path(cls, name: str) -> str | None:
+        path = os.path.join(cls.data_dir, "media", name)
+        if os.path.basename(name) != name or not os.path.isfile(path):
+            return None
+        return path
+
+    @staticmethod
+    def kind(name: str) -> str:
+        return "photo" if name.lower().endswith(PHOTO_EXTENSIONS) else "document"
+
+    @staticmethod
+    def digest(path: str) -> str:
+        file = open(path, "rb")
+        digest = hashlib.file_digest(file, "sha256").hexdigest()
+        file.close()
+        return digest
+
+    @classmethod
+    def get(cls, digest: str, kind: str) -> str | None:
+        return cls._cache.get(digest, {}).get(kind)
+
+    @classmethod
+    def put(cls, digest: str, kind: str, file_id: str):
+        cls._cache.setdefault(digest, {})[kind] = file_id
+        cls._save()
+
+    # For a file_id Telegram no longer accepts (e.g. after a bot token change)
+    @classmethod
+    def forget(cls, digest: str, kind: str):
+        if cls._cache.get(digest, {}).pop(kind, None) is not None:
+            if not cls._cache[digest]:
+                del cls._cache[digest]
+            cls._save()
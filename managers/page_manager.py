@@ -0,0 +1,77 @@
+from collections import OrderedDict
+
+from managers.catalog_manager import CatalogManager
+from managers.digest_manager import split_message
+from managers.replies_manager import RepliesManager
+from managers.user import User
+from managers.user_manager import UserManager
+
+class PageManager:
+    # Rendered /skill_info and /inventory pages, LRU-evicted. Keys carry the
+    # user's content version and the catalog version, so add_skill, item
+    # changes and catalog reloads make old entries unreachable on their own.
+    page_size = 10
+    cache_size = 4096
+    _cache: OrderedDict[tuple, tuple[str, int]] = OrderedDict()
+
+    @classmethod
+    def _cached(cls, key: tuple, render) -> tuple[str, int]:
+        page = cls._cache.get(key)
+        if page is not None:
+            cls._cache.move_to_end(key)
+            return page
+        page = cls._cache[key] = render()
+        if len(cls._cache) > cls.cache_size:
+            cls._cache.popitem(last=False)
+        return page
+
+    # Both return (text, page count); a page count of 0 means nothing to show
+    @classmethod
+    def skill_page(cls, user: User, page: int) -> tuple[str, int]:
+        key = ("skill", user.user_id, page, user.skills_version, CatalogManager.catalog.version)
+        return cls._cached(key, lambda: cls._render_skill(user, page))
+
+    @classmethod
+    def inventory_page(cls, user: User, page: int) -> tuple[str, int]:
+        key = ("inventory", user.user_id, page, user.inventory_version, CatalogManager.catalog.version)
+        return cls._cached(key, lambda: cls._render_inventory(user, page))
+
+    @staticmethod
+    def _render_skill(user: User, page: int) -> tuple[str, int]:
+        if not user.skills:
+            return RepliesManager.get("no_skills_info"), 0
+        # Versions can still collide; a stale page number must not index past the list
+        page = min(max(page, 0), len(user.skills) - 1)
+        skill = CatalogManager.catalog.skills[user.skills[page]]
+        return RepliesManager.get("skill_info", skill_name=skill["name"], skill_desc=skill["description"]), len(user.skills)
+
+    @classmethod
+    def _render_inventory(cls, user: User, page: int) -> tuple[str, int]:
+        if not user.inventory:
+            return RepliesManager.get("inventory_empty_info"), 0
+        inventory = list(user.inventory.items())
+        pages = (len(inventory) - 1) // cls.page_size + 1
+        start = min(max(page, 0), pages - 1) * cls.page_size
+        lines = []
+        for number, (item_id, count) in enumerate(inventory[start:start + cls.page_size], start + 1):
+            item = CatalogManager.catalog.items[item_id]
+            lines.append(f"\n{number}. {item['name']}{f' x{count}' if count > 1 else ''}\n{item['description']}\n")
+        return RepliesManager.get("inventory_info", items="".join(lines)), pages
+
+    # GM lists of users (/pending, /idle). Not cached: every operation can
+    # change them. A page past the end, left by a shrinking list, shows the last one.
+    roster_size = 20
+
+    @classmethod
+    def roster_page(cls, kind: str, user_ids: list[int], page: int) -> tuple[str, int]:
+        if not user_ids:
+            return RepliesManager.get(f"roster_{kind}_empty"), 0
+        pages = (len(user_ids) - 1) // cls.roster_size + 1
+        page = min(page, pages - 1)
+        lines = [RepliesManager.get(f"roster_{kind}_page", count=len(user_ids), page=page + 1, pages=pages)]
+        for user_id in sorted(user_ids)[page * cls.roster_size:(page + 1) * cls.roster_size]:
+            user = UserManager.get_user(user_id)
+            lines.append(RepliesManager.get("roster_entry",
+                user_id=user_id, char_name=user.char_name, char_race=user.char_race, char_class=user.char_class
+            ))
+        return split_message(lines, separator="")[0], pages
@@ -0,0 +1,145 @@
+import asyncio
+from collections import deque
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, Sized
+
+from aiogram.methods import SendDocument
+from aiogram.types import FSInputFile
+
+from managers.send_manager import SendManager
+
+# Traces of the profiler itself, left out of memory snapshots
+IGNORED = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+           tracemalloc.Filter(False, "<unknown>"))
+
+class ProfileManager:
+    # /profile_start runs cProfile on the event loop thread for a number of
+    # seconds, which covers the loop and every handler (work sent to other
+    # threads is not profiled). /mem_snapshot lists the allocation sites
+    # holding the most memory and the sizes of the big containers. Neither
+    # costs anything while unused: the profiler is enabled only for its
+    # window, and allocations are traced only with PTB_TRACEMALLOC set at
+    # start (the number of frames kept per allocation, e.g. 1 or 10).
+    data_dir = "data"
+    top = 30
+    max_seconds = 600
+    # name -> getter of the container, read when a snapshot is taken
+    containers: Dict[str, Callable[[], Sized]] = {}
+    _task: asyncio.Task = None
+
+    @classmethod
+    def start(cls, data_dir: str):
+        cls.data_dir = data_dir
+        if (frames := os.getenv("PTB_TRACEMALLOC")) and not tracemalloc.is_tracing():
+            tracemalloc.start(int(frames))
+            logging.log(logging.INFO, f"Tracing allocations, {frames} frames each")
+
+    @classmethod
+    def stop(cls):
+        if cls._task is not None:
+            cls._task.cancel()
+            cls._task = None
+
+    @classmethod
+    def container(cls, name: str, read: Callable[[], Sized]):
+        cls.containers[name] = read
+
+    @classmethod
+    def busy(cls) -> bool:
+        return cls._task is not None and not cls._task.done()
+
+    @classmethod
+    def _report_path(cls, name: str) -> str:
+        os.makedirs(os.path.join(cls.data_dir, "profiles"), exist_ok=True)
+        return os.path.join(cls.data_dir, "profiles", f"{name}_{int(time.time())}.txt")
+
+    @classmethod
+    async def _send_report(cls, chat_id: int, path: str):
+        try:
+            await SendManager.enqueue(SendDocument(chat_id=chat_id, document=FSInputFile(path)))
+        finally:
+            os.remove(path)
+
+    #region CPU
+    # The report is sent to `chat_id` once the profile is over
+    @classmethod
+    def profile(cls, chat_id: int, seconds: float):
+        cls._task = asyncio.create_task(cls._profile(chat_id, seconds))
+
+    @classmethod
+    async def _profile(cls, chat_id: int, seconds: float):
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        elapsed = time.perf_counter() - started
+        logging.log(logging.INFO, f"Profiled the event loop for {elapsed:.1f}s")
+        path = await asyncio.to_thread(cls._write_profile, profiler, elapsed)
+        try:
+            await cls._send_report(chat_id, path)
+        except Exception:
+            logging.exception("Profile report not delivered")
+
+    @classmethod
+    def _write_profile(cls, profiler: cProfile.Profile, elapsed: float) -> str:
+        report = io.StringIO()
+        report.write(f"Event loop profile, {elapsed:.1f}s\n")
+        stats = pstats.Stats(profiler, stream=report)
+        for order in ("cumulative", "tottime"):
+            report.write(f"\n=== Top {cls.top} by {order} time ===\n")
+            stats.sort_stats(order).print_stats(cls.top)
+        path = cls._report_path("profile")
+        file = open(path, "w", encoding="utf-8")
+        file.write(report.getvalue())
+        file.close()
+        return path
+    #endregion
+
+    #region Memory
+    # Returns False when allocations are not traced
+    @classmethod
+    async def snapshot(cls, chat_id: int) -> bool:
+        if not tracemalloc.is_tracing():
+            return False
+        # Read here, on the loop: some containers (the sqlite state store) may
+        # only be used from the thread that opened them
+        sizes = []
+        for name, read in sorted(cls.containers.items()):
+            container = read()
+            shallow = f"{sys.getsizeof(container) / 2**10:.1f} KiB" if isinstance(container, (dict, list, set, deque)) else "-"
+            sizes.append(f"{name:<32} {len(container):>10} entries {shallow:>14}")
+        path = await asyncio.to_thread(cls._write_snapshot, sizes)
+        try:
+            await cls._send_report(chat_id, path)
+        except Exception:
+            logging.exception("Memory report not delivered")
+        return True
+
+    @classmethod
+    def _write_snapshot(cls, sizes: list[str]) -> str:
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(IGNORED)
+        lines = [f"Traced memory: {current / 2**20:.1f} MiB, peak {peak / 2**20:.1f} MiB", "", "=== Containers ==="]
+        lines += sizes
+        lines += ["", f"=== Top {cls.top} allocation sites ==="]
+        for stat in snapshot.statistics("traceback" if tracemalloc.get_traceback_limit() > 1 else "lineno")[:cls.top]:
+            lines.append(f"{stat.size / 2**10:>10.1f} KiB {stat.count:>9} blocks  {stat.traceback[-1]}")
+            if len(stat.traceback) > 1:
+                lines += ["    " + line for line in stat.traceback.format(most_recent_first=True)[2:]]
+
+        path = cls._report_path("memory")
+        file = open(path, "w", encoding="utf-8")
+        file.write("\n".join(lines) + "\n")
+        file.close()
+        return path
+    #endregion
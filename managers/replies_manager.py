@@ -1,22 +1,153 @@
-from typing import Dict, Any
-import yaml
+from functools import lru_cache
+from string import Formatter
+from typing import Dict, Any, Mapping
 
-class RepliesManager:
-    _instance = None
-    templates: Dict[str, Any] = {}
+# Parameters each reply is rendered with. A template may use any of them,
+# and static templates by name; any other {field} fails the load, so a typo
+# in replies.yaml is caught on start or reload rather than by a player.
+PARAMETERS: Dict[str, tuple[str, ...]] = {
+    "sub_help": ("char_name",),
+    "start_msg": ("sub_help", "gm_id"),
+    "join": ("char_name",),
+    "description_msg": ("join",),
+    "profile_msg": ("char_name", "join_date", "action_count", "char_race", "char_class", "action", "skill_list",
+                    "add_info"),
+    "reject_msg": ("reason",),
+    "reject_action_msg": ("reason",),
+    "new_skill_added": ("skill_name",),
+    "skill_info": ("skill_name", "skill_desc"),
+    "inventory_info": ("items",),
+    "new_item_added": ("item_name", "count"),
+    "new_user": ("user_id", "char_name", "char_race", "race_desc", "char_class", "class_desc", "description"),
+    "new_action": ("char_name", "user_id", "action"),
+    "new_ask": ("char_name", "user_id", "ask"),
+    "user_approved": ("count", "failed"),
+    "user_rejected": ("count", "failed"),
+    "skill_added": ("count", "skipped", "failed"),
+    "item_given": ("count", "failed"),
+    "user_banned": ("count",),
+    "user_unbanned": ("count",),
+    "from_gm": ("msg",),
+    "rollover_started": ("turn_date", "count"),
+    "rollover_progress": ("turn_date", "sent", "count", "failed", "failed_ids"),
+    "rollover_done": ("turn_date", "sent", "count", "failed", "failed_ids"),
+    "archive_week_page": ("week", "count", "page", "pages"),
+    "archive_user_page": ("user_id", "count", "page", "pages"),
+    "archive_action": ("date", "char_name", "user_id", "text"),
+    "archive_ask": ("date", "char_name", "user_id", "text"),
+    "digest_header": ("count", "part", "parts"),
+    "digest_page": ("count", "page", "pages"),
+    "roster_pending_page": ("count", "page", "pages"),
+    "roster_idle_page": ("count", "page", "pages"),
+    "roster_entry": ("user_id", "char_name", "char_race", "char_class"),
+    "top_entry": ("place", "char_name", "user_id", "action_count"),
+    "census_msg": ("count", "races", "classes"),
+    "census_entry": ("name", "count"),
+    "auto_ask_ban": ("char_name", "user_id", "minutes"),
+    "broadcast_started": ("count",),
+    "broadcast_resumed": ("count", "total"),
+    "broadcast_done": ("sent", "count", "failed"),
+    "broadcast_failed": ("error",),
+    "profile_started": ("seconds",),
+    "skill_not_found_error": ("skill_id",),
+    "item_not_found_error": ("item_id",),
+    "targets_error": ("targets",),
+    "media_not_found_error": ("name",)
+}
+
+# Rendered with text players or the GM wrote, or with values that hardly
+# ever repeat; memoizing them would only churn the cache and keep that text
+# in memory
+UNCACHED = frozenset({
+    "profile_msg", "reject_msg", "reject_action_msg", "inventory_info", "new_user", "new_action", "new_ask",
+    "from_gm", "archive_action", "archive_ask", "census_msg", "broadcast_failed"
+})
+
+def _escape(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class Template:
+    # A reply compiled once at load: templates without parameters are kept
+    # pre-rendered, the rest format through a bounded per-template LRU
+    # keyed on the parameters they actually use (or directly, if UNCACHED).
+    __slots__ = ("key", "text", "fields", "_cached")
+
+    def __init__(self, key: str, text: str, fields: tuple[str, ...]):
+        self.key = key
+        self.text = text
+        self.fields = fields
+        self._cached = self._format if key in UNCACHED else lru_cache(maxsize=RepliesManager.cache_size)(self._format)
+
+    def _format(self, values: tuple) -> str:
+        return self.text.format_map(dict(zip(self.fields, values)))
 
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._load_replies()
-        return cls._instance
+    def render(self, **kwargs) -> str:
+        if not self.fields:
+            return self.text
+        try:
+            values = tuple(kwargs[field] for field in self.fields)
+        except KeyError as error:
+            raise KeyError(f"Reply '{self.key}' requires {error}") from None
+        try:
+            return self._cached(values)
+        except TypeError:  # Unhashable parameter
+            return self._format(values)
+
+
+class RepliesManager:
+    cache_size = 256
+    # Swapped in by CatalogManager on every reload
+    templates: Mapping[str, Template] = {}
 
     @classmethod
-    def _load_replies(cls) -> None:
-        file = open("data/replies.yaml", "r", encoding="utf-8")
-        cls.templates = yaml.safe_load(file)
-        file.close()
+    def compile(cls, raw: Dict[str, Any]) -> Dict[str, Template]:
+        parts = {key: cls._parse(key, text) for key, text in raw.items()}
+        templates = {}
+
+        # A field named after another template is filled in here when that
+        # template is static, e.g. {help_msg} inside sub_help
+        def resolve(key: str, stack: tuple[str, ...]) -> Template:
+            if key in templates:
+                return templates[key]
+            if key in stack:
+                raise ValueError(f"Reply '{key}' includes itself through {' -> '.join(stack)}")
+            text, own = [], []
+            for literal, field in parts[key]:
+                text.append(_escape(literal))
+                if field is None:
+                    continue
+                if field in raw and not resolve(field, stack + (key,)).fields:
+                    text.append(_escape(templates[field].text))
+                    continue
+                if field not in PARAMETERS.get(key, ()):
+                    raise ValueError(f"Reply '{key}' references unknown key '{{{field}}}'")
+                text.append("{" + field + "}")
+                if field not in own:
+                    own.append(field)
+            text = "".join(text)
+            # Static templates are stored already rendered
+            templates[key] = Template(key, text.format() if not own else text, tuple(own))
+            return templates[key]
+
+        for key in raw:
+            resolve(key, ())
+        return templates
+
+    @staticmethod
+    def _parse(key: str, text: Any) -> list[tuple[str, str | None]]:
+        if not isinstance(text, str):
+            raise ValueError(f"Reply '{key}' is not a string")
+        try:
+            parsed = list(Formatter().parse(text))
+        except ValueError as error:
+            raise ValueError(f"Reply '{key}' is malformed: {error}") from None
+
+        for _, field, spec, conversion in parsed:
+            if field is not None and (not field.isidentifier() or spec or conversion):
+                raise ValueError(f"Reply '{key}' uses unsupported field '{{{field}}}', only {{name}} is allowed")
+        return [(literal, field) for literal, field, _, _ in parsed]
 
     @classmethod
     def get(cls, key: str, **kwargs) -> str:
-        return cls.templates[key].format(**kwargs)
\ No newline at end of file
+        return cls.templates[key].render(**kwargs)
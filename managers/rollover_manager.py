@@ -0,0 +1,142 @@
+import asyncio
+import datetime
+import logging
+import os
+import time
+
+from aiogram.enums.parse_mode import ParseMode
+from aiogram.methods import EditMessageText
+
+from managers.replies_manager import RepliesManager
+from managers.send_manager import Lane, SendManager
+from managers.user_manager import UserManager
+
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+# "fri 00:00" -> (4, 0, 0)
+def parse_schedule(schedule: str) -> tuple[int, int, int]:
+    try:
+        day, clock = schedule.lower().split()
+        hour, minute = map(int, clock.split(":"))
+        weekday = WEEKDAYS.index(day[:3])
+    except ValueError:
+        raise ValueError(f"Rollover schedule must look like 'fri 00:00', got '{schedule}'") from None
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"Rollover time out of range: '{schedule}'")
+    return weekday, hour, minute
+
+
+class RolloverManager:
+    # Weekly turn rollover. A turn is identified by the ordinal of the day it
+    # starts on, and UserManager refuses to start a turn that is not newer
+    # than the stored one, so restarts and duplicate timers never reset
+    # actions twice. A rollover missed while the bot was down is caught up
+    # on start if it is less than `catch_up` seconds old.
+    schedule = "fri 00:00"
+    catch_up = 24 * 3600
+    parallelism = 50
+    progress_interval = 10
+    chat_id = 0
+    _task: asyncio.Task = None
+
+    @classmethod
+    def start(cls, chat_id: int):
+        cls.chat_id = chat_id
+        schedule = os.getenv("PTB_ROLLOVER", cls.schedule)
+        cls.catch_up = float(os.getenv("PTB_ROLLOVER_CATCH_UP", cls.catch_up))
+        cls.parallelism = int(os.getenv("PTB_ROLLOVER_PARALLELISM", cls.parallelism))
+        # Turned off, the default schedule still marks where archive weeks start
+        if schedule == "off":
+            return
+        parse_schedule(schedule)
+        cls.schedule = schedule
+        cls._task = asyncio.create_task(cls._run())
+
+    @classmethod
+    def stop(cls):
+        if cls._task is not None:
+            cls._task.cancel()
+            cls._task = None
+
+    @classmethod
+    def last_due(cls, now: datetime.datetime) -> datetime.datetime:
+        weekday, hour, minute = parse_schedule(cls.schedule)
+        due = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        due -= datetime.timedelta(days=(now.weekday() - weekday) % 7)
+        if due > now:
+            due -= datetime.timedelta(days=7)
+        return due
+
+    @classmethod
+    async def _run(cls):
+        await UserManager.wait_ready()
+        due = cls.last_due(datetime.datetime.now())
+        if (datetime.datetime.now() - due).total_seconds() <= cls.catch_up:
+            await cls.rollover(due)
+        while True:
+            due += datetime.timedelta(days=7)
+            # Sleep in bounded steps so clock changes and suspends are noticed
+            while (delay := (due - datetime.datetime.now()).total_seconds()) > 0:
+                await asyncio.sleep(min(delay, 3600))
+            await cls.rollover(due)
+
+    @classmethod
+    async def rollover(cls, due: datetime.datetime) -> bool:
+        user_ids = await asyncio.to_thread(UserManager.new_turn, due.date().toordinal())
+        if user_ids is None:
+            logging.log(logging.INFO, f"Turn of {due:%d.%m %Y} already started")
+            return False
+        logging.log(logging.INFO, f"Turn of {due:%d.%m %Y} started for {len(user_ids)} users")
+        try:
+            await cls._broadcast(user_ids, due)
+        except Exception:
+            logging.exception("New turn broadcast failed")
+        return True
+
+    @classmethod
+    async def _broadcast(cls, user_ids: list[int], due: datetime.datetime):
+        turn_date = f"{due:%d.%m %Y}"
+        text = RepliesManager.get("new_turn_msg")
+        progress = {"sent": 0, "failed": []}
+        # The turn has started already; players hear of it even if the GM's
+        # report can't be delivered
+        try:
+            report = await SendManager.send(cls.chat_id, RepliesManager.get(
+                "rollover_started", turn_date=turn_date, count=len(user_ids)
+            ))
+        except Exception:
+            logging.exception("New turn report not delivered")
+            report = None
+
+        def progress_msg(key: str) -> str:
+            return RepliesManager.get(key,
+                turn_date=turn_date, count=len(user_ids), sent=progress["sent"], failed=len(progress["failed"]),
+                failed_ids=", ".join(map(str, progress["failed"][:50])) or "-"
+            )
+
+        async def report_progress():
+            last = None
+            while True:
+                await asyncio.sleep(cls.progress_interval)
+                # Telegram rejects edits that change nothing
+                if (current := progress_msg("rollover_progress")) != last:
+                    SendManager.enqueue(EditMessageText(chat_id=cls.chat_id, message_id=report.message_id, text=current))
+                    last = current
+
+        started = time.perf_counter()
+        reporter = asyncio.create_task(report_progress()) if report is not None else None
+        try:
+            await SendManager.fan_out(user_ids, text, Lane.LOW, cls.parallelism, progress, parse_mode=ParseMode.HTML)
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+        if report is not None:
+            SendManager.enqueue(EditMessageText(
+                chat_id=cls.chat_id, message_id=report.message_id, text=progress_msg("rollover_done")
+            ))
+        else:
+            SendManager.send(cls.chat_id, progress_msg("rollover_done"))
+        logging.log(logging.INFO,
+            f"New turn sent to {progress['sent']} users, {len(progress['failed'])} failed, "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
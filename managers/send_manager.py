@@ -0,0 +1,333 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import SendMessage, TelegramMethod
+
+from managers.stats_manager import StatsManager
+
+class Lane(IntEnum):
+    # Replies to whoever is talking to the bot
+    HIGH = 0
+    # GM notifications, messages to other players, broadcasts
+    LOW = 1
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until a token is available
+    def delay(self, now: float) -> float:
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float) -> None:
+        self._refill(now)
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+@dataclass(slots=True)
+class _Job:
+    method: TelegramMethod
+    lane: Lane
+    future: asyncio.Future
+    queued: float
+    attempts: int = 0
+
+
+@dataclass(slots=True)
+class _Chat:
+    bucket: TokenBucket
+    queues: tuple[deque, deque] = field(default_factory=lambda: (deque(), deque()))
+    # Whether the chat has an entry in that lane's ready heap
+    scheduled: list[bool] = field(default_factory=lambda: [False, False])
+    # One request per chat at a time keeps messages in order
+    busy: bool = False
+
+
+class SendManager:
+    # Every outgoing message goes through here. Jobs queue per chat and per
+    # lane; a single worker hands them to the bot under a global and a
+    # per-chat token bucket, preferring the HIGH lane but giving LOW at
+    # least one in `low_every` messages while it has any ready. Chats waiting
+    # to send sit in one heap per lane keyed by when their bucket allows the
+    # next message, so the worker never scans idle chats. A RetryAfter puts
+    # the job back at the head of its chat and pauses that chat's bucket.
+    global_rate = 30
+    chat_rate = 1
+    chat_burst = 3
+    max_attempts = 5
+    low_every = 5
+    drain_timeout = 10
+    prune_interval = 60
+    bot: Bot = None
+    _chats: dict[int, _Chat] = {}
+    _ready: tuple[list, list] = ([], [])
+    _sequence = itertools.count()
+    _global: TokenBucket = None
+    _pending = 0
+    # HIGH messages picked since the last LOW one
+    _high_streak = 0
+    _wakeup: asyncio.Event = None
+    _idle: asyncio.Event = None
+    _worker: asyncio.Task = None
+    # Sends in flight; the loop keeps only weak references to tasks
+    _sending: set[asyncio.Task] = set()
+
+    @classmethod
+    def start(cls, bot: Bot):
+        cls.bot = bot
+        cls.global_rate = float(os.getenv("PTB_SEND_RATE", cls.global_rate))
+        cls.chat_rate = float(os.getenv("PTB_SEND_CHAT_RATE", cls.chat_rate))
+        cls.low_every = int(os.getenv("PTB_SEND_LOW_EVERY", cls.low_every))
+        cls._global = TokenBucket(cls.global_rate, cls.global_rate)
+        cls._wakeup = asyncio.Event()
+        cls._idle = asyncio.Event()
+        if cls._pending == 0:
+            cls._idle.set()
+        cls._worker = asyncio.create_task(cls._run())
+        StatsManager.gauge("send_queue", lambda: cls._pending)
+        StatsManager.gauge("send_chats", lambda: len(cls._chats))
+
+    @classmethod
+    async def stop(cls):
+        # Give queued messages a chance to go out, then drop the rest
+        if cls._worker is None:
+            return
+        try:
+            await asyncio.wait_for(cls._idle.wait(), cls.drain_timeout)
+        except asyncio.TimeoutError:
+            logging.log(logging.WARNING, f"{cls._pending} outgoing messages dropped on shutdown")
+        cls._worker.cancel()
+        cls._worker = None
+        for task in cls._sending:
+            task.cancel()
+        await asyncio.gather(*cls._sending, return_exceptions=True)
+        for chat in cls._chats.values():
+            for queue in chat.queues:
+                for job in queue:
+                    job.future.cancel()
+        cls._chats.clear()
+        cls._pending = 0
+
+    #region Queue
+    @classmethod
+    def send(cls, chat_id: int, text: str, lane: Lane = Lane.HIGH, **kwargs) -> asyncio.Future:
+        return cls.enqueue(SendMessage(chat_id=chat_id, text=text, **kwargs), lane)
+
+    # Any method with a chat_id; the future resolves to what the bot returns.
+    # Callers may ignore it, failures are logged here.
+    @classmethod
+    def enqueue(cls, method: TelegramMethod, lane: Lane = Lane.HIGH) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(cls._retrieve)
+        chat_id = int(method.chat_id)
+        chat = cls._chat(chat_id)
+        chat.queues[lane].append(_Job(method, lane, future, time.perf_counter()))
+        cls._pending += 1
+        if cls._idle is not None:
+            cls._idle.clear()
+        cls._schedule(chat_id, chat, time.monotonic())
+        return future
+
+    # One text to many chats with at most `parallelism` of them queued at a
+    # time, so a large fan-out never crowds out the rest of its lane. Counts
+    # go into `progress` as they happen: {"sent": int, "failed": [chat_id]}.
+    @classmethod
+    async def fan_out(cls, chat_ids: list[int], text: str, lane: Lane = Lane.LOW, parallelism: int = 50,
+                      progress: dict | None = None, **kwargs) -> dict:
+        return await cls.fan_out_method(
+            chat_ids, lambda chat_id: SendMessage(chat_id=chat_id, text=text, **kwargs), lane, parallelism, progress
+        )
+
+    # The same for any method: `build` makes the one for a chat, and
+    # `on_result(chat_id, error)` is called as each chat finishes
+    @classmethod
+    async def fan_out_method(cls, chat_ids: list[int], build: Callable[[int], TelegramMethod], lane: Lane = Lane.LOW,
+                             parallelism: int = 50, progress: dict | None = None,
+                             on_result: Callable[[int, Exception | None], None] | None = None) -> dict:
+        progress = progress if progress is not None else {}
+        progress.setdefault("sent", 0)
+        progress.setdefault("failed", [])
+        pending = iter(chat_ids)
+
+        async def deliver():
+            for chat_id in pending:
+                error = None
+                try:
+                    await cls.enqueue(build(chat_id), lane)
+                    progress["sent"] += 1
+                except Exception as exception:
+                    progress["failed"].append(chat_id)
+                    error = exception
+                if on_result is not None:
+                    on_result(chat_id, error)
+
+        await asyncio.gather(*(deliver() for _ in range(parallelism)))
+        return progress
+
+    @staticmethod
+    def _retrieve(future: asyncio.Future) -> None:
+        # Marks the exception as seen so unawaited futures don't warn
+        if not future.cancelled():
+            future.exception()
+
+    @classmethod
+    def _chat(cls, chat_id: int) -> _Chat:
+        chat = cls._chats.get(chat_id)
+        if chat is None:
+            chat = cls._chats[chat_id] = _Chat(TokenBucket(cls.chat_rate, cls.chat_burst))
+        return chat
+
+    @classmethod
+    def _schedule(cls, chat_id: int, chat: _Chat, now: float) -> None:
+        if chat.busy:
+            return
+        for lane in Lane:
+            if chat.queues[lane] and not chat.scheduled[lane]:
+                chat.scheduled[lane] = True
+                heapq.heappush(cls._ready[lane], (now + chat.bucket.delay(now), next(cls._sequence), chat_id))
+        if cls._wakeup is not None:
+            cls._wakeup.set()
+
+    @classmethod
+    def _next_job(cls, now: float) -> tuple[int, _Chat, _Job] | None:
+        lanes = (Lane.LOW, Lane.HIGH) if cls._high_streak >= cls.low_every - 1 else (Lane.HIGH, Lane.LOW)
+        for lane in lanes:
+            heap = cls._ready[lane]
+            while heap and heap[0][0] <= now:
+                _, _, chat_id = heapq.heappop(heap)
+                chat = cls._chats.get(chat_id)
+                if chat is None:
+                    continue
+                chat.scheduled[lane] = False
+                # Rescheduled by _send once the request in flight completes
+                if chat.busy or not chat.queues[lane]:
+                    continue
+                delay = chat.bucket.delay(now)
+                if delay > 0:
+                    chat.scheduled[lane] = True
+                    heapq.heappush(heap, (now + delay, next(cls._sequence), chat_id))
+                    continue
+                chat.bucket.consume(now)
+                cls._high_streak = cls._high_streak + 1 if lane == Lane.HIGH else 0
+                return chat_id, chat, chat.queues[lane].popleft()
+        return None
+
+    @classmethod
+    def _next_wait(cls, now: float) -> float | None:
+        heads = [heap[0][0] for heap in cls._ready if heap]
+        return max(0, min(heads) - now) if heads else None
+
+    @classmethod
+    def _prune(cls, now: float) -> None:
+        for chat_id in [chat_id for chat_id, chat in cls._chats.items()
+                        if not chat.busy and not any(chat.queues) and chat.bucket.full(now)]:
+            del cls._chats[chat_id]
+    #endregion
+
+    #region Worker
+    @classmethod
+    async def _run(cls):
+        pruned = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now - pruned > cls.prune_interval:
+                cls._prune(now)
+                pruned = now
+
+            delay = cls._global.delay(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            cls._wakeup.clear()
+            picked = cls._next_job(now)
+            if picked is None:
+                try:
+                    await asyncio.wait_for(cls._wakeup.wait(), cls._next_wait(now))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            cls._global.consume(now)
+            chat_id, chat, job = picked
+            chat.busy = True
+            task = asyncio.create_task(cls._send(chat_id, chat, job))
+            cls._sending.add(task)
+            task.add_done_callback(cls._sending.discard)
+
+    @classmethod
+    async def _send(cls, chat_id: int, chat: _Chat, job: _Job):
+        done = True
+        started = time.perf_counter()
+        try:
+            if not job.future.cancelled():
+                result = await cls.bot(job.method)
+                StatsManager.observe("send", time.perf_counter() - started)
+                StatsManager.observe("send_wait", time.perf_counter() - job.queued)
+                job.future.set_result(result)
+        except asyncio.CancelledError:
+            # Shutdown gave up on it
+            job.future.cancel()
+            raise
+        except TelegramRetryAfter as error:
+            StatsManager.observe("send", time.perf_counter() - started, error=True)
+            logging.log(logging.WARNING, f"Flood limit for chat {chat_id}, retrying in {error.retry_after}s")
+            chat.bucket.pause(time.monotonic(), error.retry_after)
+            done = False
+        except (TelegramNetworkError, TelegramServerError) as error:
+            StatsManager.observe("send", time.perf_counter() - started, error=True)
+            job.attempts += 1
+            if job.attempts < cls.max_attempts:
+                chat.bucket.pause(time.monotonic(), 2 ** job.attempts)
+                done = False
+            else:
+                logging.log(logging.ERROR, f"Giving up on a message to chat {chat_id}: {error}")
+                cls._fail(job, error)
+        except Exception as error:
+            StatsManager.observe("send", time.perf_counter() - started, error=True)
+            logging.log(logging.ERROR, f"Message to chat {chat_id} failed: {error}")
+            cls._fail(job, error)
+
+        if done:
+            cls._pending -= 1
+            if cls._pending == 0:
+                cls._idle.set()
+        else:
+            chat.queues[job.lane].appendleft(job)
+        chat.busy = False
+        cls._schedule(chat_id, chat, time.monotonic())
+
+    @staticmethod
+    def _fail(job: _Job, error: Exception) -> None:
+        if not job.future.done():
+            job.future.set_exception(error)
+    #endregion
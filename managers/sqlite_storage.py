@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from typing import Dict, Any
+
+from managers.storage import Storage, JsonStorage
+from managers.user import User, UserStatus
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    status TEXT NOT NULL,
+    ask_ban INTEGER NOT NULL,
+    date_joined TEXT NOT NULL,
+    action_count INTEGER NOT NULL,
+    char_name TEXT NOT NULL,
+    char_race TEXT NOT NULL,
+    char_class TEXT NOT NULL,
+    action INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_status ON users(status);
+CREATE INDEX IF NOT EXISTS users_action ON users(action);
+CREATE INDEX IF NOT EXISTS users_ask_ban ON users(ask_ban);
+CREATE TABLE IF NOT EXISTS user_skills (
+    user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    skill_id TEXT NOT NULL,
+    PRIMARY KEY (user_id, skill_id)
+);
+CREATE TABLE IF NOT EXISTS user_items (
+    user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    item_id TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, item_id)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+USER_COLUMNS = ("user_id", "status", "ask_ban", "date_joined", "action_count",
+                "char_name", "char_race", "char_class", "action")
+
+INSERT_USER = f"INSERT INTO users ({', '.join(USER_COLUMNS)}) VALUES ({', '.join(':' + c for c in USER_COLUMNS)})"
+INSERT_SKILL = "INSERT OR IGNORE INTO user_skills (user_id, skill_id) VALUES (:user_id, :skill_id)"
+INSERT_ITEM = """INSERT INTO user_items (user_id, item_id, count) VALUES (:user_id, :item_id, :count)
+    ON CONFLICT (user_id, item_id) DO UPDATE SET count = count + excluded.count"""
+
+# Bulk operations pass their user ids as one JSON array
+USER_IDS = "SELECT value FROM json_each(:user_ids)"
+SET_META = "INSERT INTO meta (key, value) VALUES (:key, :value) ON CONFLICT (key) DO UPDATE SET value = excluded.value"
+
+# One parameterized statement per UserManager operation; sqlite3 keeps them
+# in its statement cache, so each mutation is a single indexed row update.
+# Bulk operations are a tuple of statements committed together.
+OPERATIONS = {
+    "approve_user": "UPDATE users SET status = 'active', action = 1 WHERE user_id = :user_id",
+    "reject_user": "DELETE FROM users WHERE user_id = :user_id",
+    "do_action": "UPDATE users SET action = 0, action_count = action_count + 1 WHERE user_id = :user_id",
+    "reject_action": "UPDATE users SET action = 1, action_count = action_count - 1 WHERE user_id = :user_id",
+    "ban_ask": "UPDATE users SET ask_ban = 1 WHERE user_id = :user_id",
+    "unban_ask": "UPDATE users SET ask_ban = 0 WHERE user_id = :user_id",
+    "add_skill": INSERT_SKILL,
+    "approve_users": f"UPDATE users SET status = 'active', action = 1 WHERE user_id IN ({USER_IDS})",
+    "reject_users": f"DELETE FROM users WHERE user_id IN ({USER_IDS})",
+    "ban_ask_users": f"UPDATE users SET ask_ban = 1 WHERE user_id IN ({USER_IDS})",
+    "unban_ask_users": f"UPDATE users SET ask_ban = 0 WHERE user_id IN ({USER_IDS})",
+    "grant_skill": "INSERT OR IGNORE INTO user_skills (user_id, skill_id) SELECT value, :skill_id FROM json_each(:user_ids)",
+    "give_item": """INSERT INTO user_items (user_id, item_id, count) SELECT value, :item_id, :count FROM json_each(:user_ids) WHERE true
+        ON CONFLICT (user_id, item_id) DO UPDATE SET count = count + excluded.count""",
+    "new_turn": (
+        "UPDATE users SET action = 1 WHERE status = 'active'",
+        "INSERT INTO meta (key, value) VALUES ('turn', :turn) ON CONFLICT (key) DO UPDATE SET value = excluded.value"
+    ),
+}
+
+class SqliteStorage(Storage):
+    def __init__(self, path: str, lock: threading.RLock):
+        super().__init__(lock)
+        self.db = sqlite3.connect(path, check_same_thread=False, cached_statements=64)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.executescript(SCHEMA)
+
+    def load(self):
+        raw_users = {}
+        for row in self.db.execute(f"SELECT {', '.join(USER_COLUMNS)} FROM users"):
+            user = dict(zip(USER_COLUMNS, row))
+            user["ask_ban"], user["action"] = bool(user["ask_ban"]), bool(user["action"])
+            user["skills"], user["inventory"] = [], {}
+            raw_users[user["user_id"]] = user
+        for user_id, skill_id in self.db.execute("SELECT user_id, skill_id FROM user_skills ORDER BY rowid"):
+            raw_users[user_id]["skills"].append(skill_id)
+        for user_id, item_id, count in self.db.execute("SELECT user_id, item_id, count FROM user_items ORDER BY rowid"):
+            raw_users[user_id]["inventory"][item_id] = count
+        self.meta = {key: json.loads(value) for key, value in self.db.execute("SELECT key, value FROM meta")}
+        return raw_users, []
+
+    def record(self, op, args):
+        if op == "create":
+            self._insert(args)
+        else:
+            statements = OPERATIONS[op]
+            args = {key: json.dumps(value) if isinstance(value, list) else value for key, value in args.items()}
+            for statement in statements if isinstance(statements, tuple) else (statements,):
+                self.db.execute(statement, args)
+        self.db.commit()
+        self.pending += 1
+
+    def _insert(self, user: Dict[str, Any]) -> None:
+        self.db.execute(INSERT_USER, user)
+        self.db.executemany(INSERT_SKILL, [{"user_id": user["user_id"], "skill_id": s} for s in user["skills"]])
+        self.db.executemany(INSERT_ITEM, [
+            {"user_id": user["user_id"], "item_id": i, "count": c} for i, c in user["inventory"].items()
+        ])
+
+    def compact(self, users):
+        with self.lock:
+            self.pending = 0
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def select(self, users, **filters):
+        filters = {k: v.label if isinstance(v, UserStatus) else v for k, v in filters.items()}
+        where = " AND ".join(f"{field} = :{field}" for field in filters if field in USER_COLUMNS)
+        with self.lock:
+            return [row[0] for row in self.db.execute(f"SELECT user_id FROM users WHERE {where or 1}", filters)]
+
+    def import_users(self, users: Dict[int, User]) -> None:
+        with self.lock:
+            self.db.execute("DELETE FROM users")
+            for user in users.values():
+                self._insert(user.to_dict())
+            for key, value in self.meta.items():
+                self.db.execute(SET_META, {"key": key, "value": json.dumps(value)})
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+# One-shot migration: python -m managers.sqlite_storage [data_dir]
+def migrate(data_dir: str) -> int:
+    from managers.user_manager import UserManager
+
+    UserManager.data_dir = data_dir
+    UserManager.storage = JsonStorage(data_dir, UserManager._lock)
+    UserManager._load_users()
+    UserManager.storage.close()
+
+    storage = SqliteStorage(os.path.join(data_dir, "user_data.db"), threading.RLock())
+    storage.meta = UserManager.storage.meta
+    storage.import_users(UserManager.user_data)
+    storage.close()
+    return len(UserManager.user_data)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    count = migrate(sys.argv[1] if len(sys.argv) > 1 else "data")
+    logging.log(logging.INFO, f"Migrated {count} users to SQLite")
@@ -0,0 +1,129 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict
+
+# Multi-step conversation state (character creation drafts, pending /action
+# and /ask_gm) keyed by user id. States are plain JSON-able dicts; callers
+# write a state back with `set` after changing it.
+class StateStore(ABC):
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    @abstractmethod
+    def get(self, user_id: int) -> Dict[str, Any] | None:
+        ...
+
+    @abstractmethod
+    def set(self, user_id: int, state: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def pop(self, user_id: int) -> Dict[str, Any] | None:
+        ...
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStateStore(StateStore):
+    # Entries are kept in write order, so expired ones are always at the front
+    # and both TTL expiry and the size bound evict from there.
+    def __init__(self, ttl: float, max_size: int):
+        super().__init__(ttl)
+        self.max_size = max_size
+        self._states: OrderedDict[int, tuple[float, Dict[str, Any]]] = OrderedDict()
+
+    def _expire(self, now: float) -> None:
+        while self._states:
+            user_id, (expires_at, _) = next(iter(self._states.items()))
+            if expires_at > now and len(self._states) <= self.max_size:
+                break
+            del self._states[user_id]
+
+    def get(self, user_id):
+        entry = self._states.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._states[user_id]
+            return None
+        return entry[1]
+
+    def set(self, user_id, state):
+        now = time.monotonic()
+        self._states.pop(user_id, None)
+        self._states[user_id] = (now + self.ttl, state)
+        self._expire(now)
+
+    def pop(self, user_id):
+        state = self.get(user_id)
+        self._states.pop(user_id, None)
+        return state
+
+    def __len__(self):
+        return len(self._states)
+
+
+class SqliteStateStore(StateStore):
+    # Survives restarts, so a half-written character draft is not lost
+    def __init__(self, path: str, ttl: float):
+        super().__init__(ttl)
+        self.db = sqlite3.connect(path, cached_statements=16)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS states (user_id INTEGER PRIMARY KEY, state TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS states_expires_at ON states(expires_at)")
+        self._prune()
+
+    def _prune(self) -> None:
+        self.db.execute("DELETE FROM states WHERE expires_at <= ?", (time.time(),))
+        self.db.commit()
+
+    def get(self, user_id):
+        row = self.db.execute(
+            "SELECT state FROM states WHERE user_id = ? AND expires_at > ?", (user_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, user_id, state):
+        self.db.execute(
+            "INSERT OR REPLACE INTO states (user_id, state, expires_at) VALUES (?, ?, ?)",
+            (user_id, json.dumps(state, ensure_ascii=False), time.time() + self.ttl)
+        )
+        self.db.commit()
+
+    def pop(self, user_id):
+        state = self.get(user_id)
+        self.db.execute("DELETE FROM states WHERE user_id = ?", (user_id,))
+        self.db.commit()
+        return state
+
+    def __len__(self):
+        self._prune()
+        return self.db.execute("SELECT COUNT(*) FROM states").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+def open_state_store(backend: str, data_dir: str) -> StateStore:
+    ttl = float(os.getenv("PTB_STATE_TTL", 24 * 3600))
+    match backend:
+        case "memory":
+            return MemoryStateStore(ttl, int(os.getenv("PTB_STATE_MAX_SIZE", 100_000)))
+        case "sqlite":
+            return SqliteStateStore(os.path.join(data_dir, "states.db"), ttl)
+    raise ValueError(f"Unknown state store: {backend}")
@@ -0,0 +1,116 @@
+import bisect
+import time
+from typing import Callable, Dict
+
+# Upper bucket bounds in seconds, plus an implicit +Inf bucket
+BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Histogram:
+    # Fixed buckets, so recording is a bisect and an increment however many
+    # samples come in
+    __slots__ = ("counts", "count", "total", "maximum", "errors")
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        self.counts[bisect.bisect_left(BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+        if error:
+            self.errors += 1
+
+    # Upper bound of the bucket holding the quantile, capped at the largest sample
+    def quantile(self, q: float) -> float:
+        rank, seen = q * self.count, 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(BOUNDS[index], self.maximum) if index < len(BOUNDS) else self.maximum
+        return 0.0
+
+
+class StatsManager:
+    # Handler latencies (StatsMiddleware), storage timings (save, load) and
+    # outbound messages (send: the request, send_wait: enqueue to delivery).
+    # Gauges are read only when stats are rendered.
+    started = time.time()
+    handlers: Dict[str, Histogram] = {}
+    timings: Dict[str, Histogram] = {}
+    gauges: Dict[str, Callable[[], float]] = {}
+
+    @classmethod
+    def observe_handler(cls, name: str, seconds: float, error: bool = False):
+        histogram = cls.handlers.get(name)
+        if histogram is None:
+            histogram = cls.handlers[name] = Histogram()
+        histogram.observe(seconds, error)
+
+    @classmethod
+    def observe(cls, name: str, seconds: float, error: bool = False):
+        histogram = cls.timings.get(name)
+        if histogram is None:
+            histogram = cls.timings[name] = Histogram()
+        histogram.observe(seconds, error)
+
+    @classmethod
+    def gauge(cls, name: str, read: Callable[[], float]):
+        cls.gauges[name] = read
+
+    #region Output
+    @staticmethod
+    def _rows(histograms: Dict[str, Histogram]) -> list[str]:
+        rows = []
+        for name, histogram in sorted(histograms.items()):
+            rows.append(
+                f"{name[:16]:<16} {histogram.count:>7} {histogram.errors:>5} "
+                f"{histogram.quantile(0.5) * 1000:>7.1f} {histogram.quantile(0.95) * 1000:>7.1f} "
+                f"{histogram.quantile(0.99) * 1000:>7.1f} {histogram.maximum * 1000:>8.1f}"
+            )
+        return rows
+
+    # Plain-text table for /stats; latencies in ms
+    @classmethod
+    def render(cls) -> str:
+        header = f"{'':<16} {'count':>7} {'err':>5} {'p50':>7} {'p95':>7} {'p99':>7} {'max':>8}"
+        lines = [f"uptime {int(time.time() - cls.started)}s"]
+        lines += [f"{name} {read():g}" for name, read in sorted(cls.gauges.items())]
+        for title, histograms in (("handlers", cls.handlers), ("timings", cls.timings)):
+            if histograms:
+                lines += ["", title, header, *cls._rows(histograms)]
+        return "\n".join(lines)
+
+    @staticmethod
+    def _prometheus_histogram(metric: str, labels: str, histogram: Histogram) -> list[str]:
+        lines, cumulative = [], 0
+        for bound, count in zip((*BOUNDS, "+Inf"), histogram.counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{metric}_sum{{{labels}}} {histogram.total}")
+        lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+        return lines
+
+    @classmethod
+    def prometheus(cls) -> str:
+        lines = [
+            "# TYPE ptb_uptime_seconds gauge",
+            f"ptb_uptime_seconds {time.time() - cls.started}",
+            "# TYPE ptb_handler_seconds histogram"
+        ]
+        for name, histogram in sorted(cls.handlers.items()):
+            lines += cls._prometheus_histogram("ptb_handler_seconds", f'handler="{name}"', histogram)
+        lines.append("# TYPE ptb_handler_errors_total counter")
+        lines += [f'ptb_handler_errors_total{{handler="{name}"}} {h.errors}' for name, h in sorted(cls.handlers.items())]
+        lines.append("# TYPE ptb_timing_seconds histogram")
+        for name, histogram in sorted(cls.timings.items()):
+            lines += cls._prometheus_histogram("ptb_timing_seconds", f'name="{name}"', histogram)
+        for name, read in sorted(cls.gauges.items()):
+            lines += [f"# TYPE ptb_{name} gauge", f"ptb_{name} {read()}"]
+        return "\n".join(lines) + "\n"
+    #endregion
@@ -0,0 +1,251 @@
+from abc import ABC, abstractmethod
+import datetime
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Dict, Any
+
+from managers.binary_snapshot import SnapshotReader, encode_record, write_snapshot
+from managers.user import User
+
+# Users copied per lock hold during a compaction
+COPY_BATCH = 1000
+
+# UserManager keeps the roster in memory and calls `record` (under its lock)
+# for every mutation it applies, so a backend only has to make that one change
+# durable. `compact` is run by the autosave worker.
+class Storage(ABC):
+    def __init__(self, lock: threading.RLock):
+        self.lock = lock
+        self.pending = 0
+        # Roster-wide values kept next to the users (e.g. the current turn),
+        # filled by `load` and written back by `compact`
+        self.meta: Dict[str, Any] = {}
+
+    # Raw user records plus the mutations still to be replayed on top of them
+    @abstractmethod
+    def load(self) -> tuple[Dict[int, Dict[str, Any]], list[tuple[str, Dict[str, Any]]]]:
+        ...
+
+    @abstractmethod
+    def record(self, op: str, args: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def compact(self, users: Dict[int, User]) -> None:
+        ...
+
+    def select(self, users: Dict[int, User], **filters) -> list[int]:
+        with self.lock:
+            return [
+                key for key, user in users.items()
+                if all(getattr(user, field) == value for field, value in filters.items())
+            ]
+
+    def close(self) -> None:
+        pass
+
+
+# Users are kept as JSON text while a compaction runs: strings are not
+# tracked by the garbage collector, so copying 100k users does not set off
+# full collections while the lock is held. One line per user.
+def _encode_json(user: User) -> str:
+    return json.dumps(user.to_dict())
+
+
+# A snapshot (`user_data.json`, or the compact `user_data.bin`) plus an
+# append-only `user_data.journal`
+class JsonStorage(Storage):
+    def __init__(self, data_dir: str, lock: threading.RLock, snapshot_format: str = "json",
+                 compression: str = "none", backups: int = 0):
+        super().__init__(lock)
+        self.snapshot_format = snapshot_format
+        self.compression = compression
+        self.backups = backups
+        self.data_dir = data_dir
+        self.snapshot_path = os.path.join(data_dir, "user_data.bin" if snapshot_format == "binary" else "user_data.json")
+        self.journal_path = os.path.join(data_dir, "user_data.journal")
+        self.seq = 0
+        self._journal = None
+        # While a compaction copies users: the ids changed meanwhile, or
+        # None when a record named no users (it may have changed any)
+        self._touched: set[int] | None = None
+        self._copying = False
+
+    def _read_snapshot(self):
+        json_path = os.path.join(self.data_dir, "user_data.json")
+        binary_path = os.path.join(self.data_dir, "user_data.bin")
+        # Switching formats picks up the other file until the first compaction
+        if os.path.exists(binary_path) and (self.snapshot_format == "binary" or not os.path.exists(json_path)):
+            reader = SnapshotReader(binary_path)
+            return reader.meta, reader
+
+        meta, raw_users = {}, {}
+        if os.path.exists(json_path):
+            file = open(json_path, "r", encoding="utf-8")
+            raw_users = json.load(file)
+            file.close()
+            # Snapshots written before the journal are a bare {user_id: user} dict
+            if "users" in raw_users:
+                meta, raw_users = raw_users["meta"], raw_users["users"]
+        return meta, {int(key): value for key, value in raw_users.items()}
+
+    def load(self):
+        meta, raw_users = self._read_snapshot()
+        self.seq = meta.get("seq", 0)
+        self.meta = {key: value for key, value in meta.items() if key != "seq"}
+
+        records = []
+        if os.path.exists(self.journal_path):
+            file = open(self.journal_path, "rb")
+            # End of the last complete record
+            intact = 0
+            for line in file:
+                try:
+                    # A record without its newline was cut off too, even if it parses
+                    if not line.endswith(b"\n"):
+                        raise ValueError
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn tail from a crash mid-write; everything before it is intact
+                    logging.log(logging.WARNING, f"Journal truncated after seq {self.seq}")
+                    break
+                intact += len(line)
+                seq, op = record.pop("seq"), record.pop("op")
+                # Records already folded into the snapshot by a compaction
+                if seq <= self.seq:
+                    continue
+                records.append((op, record))
+                self.seq = seq
+            file.close()
+            # Cut the torn tail off, or new records would be appended to it
+            # and lost on the next load along with it
+            if intact < os.path.getsize(self.journal_path):
+                os.truncate(self.journal_path, intact)
+            logging.log(logging.INFO, f"Replaying {len(records)} journal records")
+
+        self.close()
+        self._journal = open(self.journal_path, "ab")
+        self.pending = len(records)
+        return raw_users, records
+
+    def record(self, op, args):
+        self.seq += 1
+        self._journal.write(json.dumps({"seq": self.seq, "op": op, **args}).encode() + b"\n")
+        self._journal.flush()
+        self.pending += 1
+        if self._copying and self._touched is not None:
+            if "user_id" in args:
+                self._touched.add(args["user_id"])
+            elif "user_ids" in args:
+                self._touched.update(args["user_ids"])
+            else:
+                self._touched = None
+
+    # Users are copied in batches with the lock released in between, so a
+    # mutator waits for one batch at most. Users changed meanwhile are
+    # copied again in the last batch, which also pins the journal position
+    # the copy matches; a change that names no users (new_turn) starts the
+    # copy over.
+    def _copy(self, users: Dict[int, User]) -> tuple[Dict[int, Any], Dict[str, Any], int]:
+        encode = encode_record if self.snapshot_format == "binary" else _encode_json
+        while True:
+            with self.lock:
+                self._touched, self._copying = set(), True
+                keys = list(users)
+            ready_data = {}
+            for start in range(0, len(keys), COPY_BATCH):
+                with self.lock:
+                    for key in keys[start:start + COPY_BATCH]:
+                        if (user := users.get(key)) is not None:
+                            ready_data[key] = encode(user)
+
+            with self.lock:
+                if self._touched is None:
+                    continue
+                for key in self._touched:
+                    if (user := users.get(key)) is not None:
+                        ready_data[key] = encode(user)
+                    else:
+                        ready_data.pop(key, None)
+                self._touched, self._copying = None, False
+                meta = {**self.meta, "seq": self.seq}
+                offset = self._journal.tell()
+                self.pending = 0
+                return ready_data, meta, offset
+
+    def compact(self, users):
+        # Fold the journal into a fresh snapshot. Only the copy is taken under
+        # the lock, in batches; serialization and disk I/O run outside of it.
+        ready_data, meta, offset = self._copy(users)
+
+        if self.snapshot_format == "binary":
+            write_snapshot(self.snapshot_path + ".tmp", ready_data.values(), meta, self.compression)
+        else:
+            file = open(self.snapshot_path + ".tmp", "w", encoding="utf-8")
+            file.write(f'{{\n  "meta": {json.dumps(meta)},\n  "users": {{')
+            file.write(",".join(f'\n    "{key}": {user}' for key, user in ready_data.items()))
+            file.write("\n  }\n}" if ready_data else "}\n}")
+            file.flush()
+            os.fsync(file.fileno())
+            file.close()
+        if self.backups:
+            self._rotate_backups()
+        os.replace(self.snapshot_path + ".tmp", self.snapshot_path)
+
+        # Keep only the records appended while the snapshot was being written
+        with self.lock:
+            self._journal.close()
+            try:
+                file = open(self.journal_path, "rb")
+                file.seek(offset)
+                tail = file.read()
+                file.close()
+                file = open(self.journal_path + ".tmp", "wb")
+                file.write(tail)
+                file.close()
+                os.replace(self.journal_path + ".tmp", self.journal_path)
+            finally:
+                # Left whole when the swap fails: the records already in the
+                # snapshot are skipped by seq on the next load
+                self._journal = open(self.journal_path, "ab")
+
+    def _rotate_backups(self):
+        # The outgoing snapshot is hard-linked, not copied, so a backup costs no extra I/O
+        if not os.path.exists(self.snapshot_path):
+            return
+        backup_dir = os.path.join(self.data_dir, "backups")
+        os.makedirs(backup_dir, exist_ok=True)
+        name, extension = os.path.splitext(os.path.basename(self.snapshot_path))
+        backup = os.path.join(backup_dir, f"{name}_{datetime.datetime.now().strftime('%y.%m.%d_%H-%M-%S')}{extension}")
+        try:
+            os.link(self.snapshot_path, backup)
+        except OSError:
+            shutil.copy2(self.snapshot_path, backup)
+
+        backups = sorted(os.listdir(backup_dir))
+        for old in backups[:-self.backups]:
+            os.remove(os.path.join(backup_dir, old))
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+def open_storage(backend: str, data_dir: str, lock: threading.RLock) -> Storage:
+    match backend:
+        case "json":
+            return JsonStorage(
+                data_dir, lock,
+                snapshot_format=os.getenv("PTB_SNAPSHOT_FORMAT", "json"),
+                compression=os.getenv("PTB_SNAPSHOT_COMPRESSION", "none"),
+                backups=int(os.getenv("PTB_SNAPSHOT_BACKUPS", "0"))
+            )
+        case "sqlite":
+            from managers.sqlite_storage import SqliteStorage
+            return SqliteStorage(os.path.join(data_dir, "user_data.db"), lock)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
@@ -0,0 +1,166 @@
+import asyncio
+from collections import OrderedDict
+import json
+import logging
+import os
+import time
+from typing import Any, Dict
+
+import yaml
+
+from managers.digest_manager import DigestManager
+from managers.replies_manager import RepliesManager
+from managers.stats_manager import StatsManager
+from managers.user_manager import UserManager
+
+class ThrottleManager:
+    # Per-user sliding-window limits from data/throttling.yaml. Each
+    # (user, rule) pair keeps a fixed window start plus the previous and
+    # current window counts, and the rate is estimated by weighting the
+    # previous count by how much of it still overlaps the sliding window.
+    # Pairs live in an LRU of `capacity` entries, so memory stays bounded
+    # however many users write; an evicted pair just starts from zero.
+    # Users who keep hitting the limits can be ask-banned for a while; those
+    # bans are kept in data/ask_bans.json until they are lifted.
+    data_dir = "data"
+    capacity = 50000
+    rules: Dict[str, tuple[int, float]] = {}
+    commands: Dict[str, tuple[int, float]] = {}
+    # (strikes, window, ban seconds); ban 0 turns escalation off
+    escalation = (0, 0.0, 0.0)
+    dropped = 0
+    _counters: OrderedDict[tuple[int, str], tuple[float, int, int]] = OrderedDict()
+    # user_id -> unix time of the unban
+    _bans: Dict[int, float] = {}
+    _task: asyncio.Task = None
+
+    @classmethod
+    def start(cls, data_dir: str):
+        cls.data_dir = data_dir
+        path = os.path.join(data_dir, "throttling.yaml")
+        if not os.path.exists(path):
+            logging.log(logging.WARNING, "No throttling.yaml, requests are not throttled")
+            return
+        file = open(path, "r", encoding="utf-8")
+        config = yaml.safe_load(file)
+        file.close()
+        cls._configure(config)
+        cls._bans = cls._read_bans()
+        cls._task = asyncio.create_task(cls._unban_loop())
+        StatsManager.gauge("throttled", lambda: cls.dropped)
+        StatsManager.gauge("throttle_entries", lambda: len(cls._counters))
+
+    @classmethod
+    def stop(cls):
+        if cls._task is not None:
+            cls._task.cancel()
+            cls._task = None
+
+    @classmethod
+    def _configure(cls, config: Dict[str, Any]):
+        def rule(raw: Dict[str, Any]) -> tuple[int, float]:
+            return int(raw["limit"]), float(raw["window"])
+
+        cls.capacity = int(config.get("capacity", cls.capacity))
+        cls.rules = {name: rule(config[name]) for name in ("default", "message", "callback") if name in config}
+        cls.commands = {name: rule(raw) for name, raw in (config.get("commands") or {}).items()}
+        escalation = config.get("escalation") or {}
+        cls.escalation = (int(escalation.get("strikes", 0)), float(escalation.get("window", 0)),
+                          float(escalation.get("ban", 0)))
+
+    #region Limits
+    # Counts the request and returns whether it is within the limit
+    @classmethod
+    def _hit(cls, key: tuple[int, str], limit: int, window: float) -> bool:
+        now = time.monotonic()
+        entry = cls._counters.get(key)
+        if entry is None:
+            start, previous, current = now, 0, 0
+        else:
+            start, previous, current = entry
+            cls._counters.move_to_end(key)
+            if (elapsed := now - start) >= window:
+                periods = int(elapsed // window)
+                previous, current = (current if periods == 1 else 0), 0
+                start += periods * window
+
+        allowed = previous * (1 - (now - start) / window) + current < limit
+        cls._counters[key] = (start, previous, current + allowed)
+        if len(cls._counters) > cls.capacity:
+            cls._counters.popitem(last=False)
+        return allowed
+
+    # `rule` is a command name, "callback" or "message"; commands without
+    # a rule of their own share "default"
+    @classmethod
+    def allow(cls, user_id: int, rule: str) -> bool:
+        limits = cls.commands.get(rule)
+        if limits is None:
+            if rule not in ("callback", "message") or rule not in cls.rules:
+                rule = "default"
+            limits = cls.rules.get(rule)
+            if limits is None:
+                return True
+        if cls._hit((user_id, rule), *limits):
+            return True
+
+        cls.dropped += 1
+        strikes, window, ban = cls.escalation
+        if ban and not cls._hit((user_id, "strikes"), strikes, window):
+            cls._ban(user_id, ban)
+        return False
+    #endregion
+
+    #region Bans
+    @classmethod
+    def _read_bans(cls) -> Dict[int, float]:
+        path = os.path.join(cls.data_dir, "ask_bans.json")
+        if not os.path.exists(path):
+            return {}
+        file = open(path, "r", encoding="utf-8")
+        bans = {int(user_id): until for user_id, until in json.load(file).items()}
+        file.close()
+        return bans
+
+    @classmethod
+    def _write_bans(cls):
+        path = os.path.join(cls.data_dir, "ask_bans.json")
+        file = open(path + ".tmp", "w", encoding="utf-8")
+        json.dump(cls._bans, file)
+        file.close()
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def _ban(cls, user_id: int, seconds: float):
+        user = UserManager.lookup(user_id)
+        if user is None or user.ask_ban:
+            return
+        UserManager.ban_ask(user_id)
+        cls._bans[user_id] = time.time() + seconds
+        cls._write_bans()
+        logging.log(logging.INFO, f"User {user_id} ask-banned for {seconds:g}s for flooding")
+        DigestManager.notify(RepliesManager.get("auto_ask_ban",
+            char_name=user.char_name, user_id=user_id, minutes=round(seconds / 60)
+        ))
+
+    # The GM's own /ban_ask and /unban_ask replace a timed ban
+    @classmethod
+    def forget(cls, user_ids: list[int]):
+        if any([cls._bans.pop(user_id, None) is not None for user_id in user_ids]):
+            cls._write_bans()
+
+    @classmethod
+    async def _unban_loop(cls):
+        await UserManager.wait_ready()
+        while True:
+            now = time.time()
+            due = [user_id for user_id, until in cls._bans.items() if until <= now]
+            if due:
+                UserManager.unban_ask_users([user_id for user_id in due if UserManager.ensure_user(user_id)])
+                for user_id in due:
+                    del cls._bans[user_id]
+                cls._write_bans()
+                logging.log(logging.INFO, f"Timed ask bans lifted for {len(due)} users")
+            # Bounded steps, so bans added meanwhile are not overslept by much
+            await asyncio.sleep(min(min(cls._bans.values(), default=now + 60) - now, 60))
+    #endregion
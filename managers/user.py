@@ -1,12 +1,30 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+import datetime
+from enum import IntEnum
+import sys
+from typing import Any
+import zlib
 
-@dataclass
+DATE_FORMAT = "%d.%m %Y"
+
+class UserStatus(IntEnum):
+    AWAIT = 0
+    ACTIVE = 1
+
+    @property
+    def label(self) -> str:
+        return self.name.lower()
+
+# Slotted, with the join date as a day ordinal, and race/class/skill/item ids
+# interned so every user shares one copy of each. The inventory is a counted
+# multiset {item_id: count} instead of repeated ids.
+@dataclass(slots=True)
 class User:
-    status: str
+    status: UserStatus
     ask_ban: bool
     # User info
     user_id: int
-    date_joined: str
+    date_joined: int
     action_count: int
     # Char info
     char_name: str
@@ -14,6 +32,73 @@ class User:
     char_class: str
 
     action: bool
-    skills: list[str]
-    inventory: list[str]
+    skills: tuple[str, ...]
+    inventory: dict[str, int]
+    _versions: tuple[int, int] | None = field(default=None, init=False, repr=False, compare=False)
+
+    # Content versions are checksums rather than counters, so they agree
+    # across restarts and processes. Computed on first use; anything that
+    # changes skills or inventory must call `touch`.
+    @property
+    def skills_version(self) -> int:
+        return self._content_versions()[0]
+
+    @property
+    def inventory_version(self) -> int:
+        return self._content_versions()[1]
+
+    def _content_versions(self) -> tuple[int, int]:
+        if self._versions is None:
+            self._versions = (
+                zlib.crc32("\0".join(self.skills).encode()),
+                zlib.crc32(repr(self.inventory).encode())
+            )
+        return self._versions
+
+    def touch(self) -> None:
+        self._versions = None
+
+    @property
+    def join_date(self) -> str:
+        return datetime.date.fromordinal(self.date_joined).strftime(DATE_FORMAT)
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "User":
+        status = data["status"]
+        date_joined = data["date_joined"]
+        inventory = data["inventory"]
+        if isinstance(inventory, list):
+            counted = {}
+            for item_id in inventory:
+                counted[item_id] = counted.get(item_id, 0) + 1
+            inventory = counted
+
+        return cls(
+            status=UserStatus[status.upper()] if isinstance(status, str) else UserStatus(status),
+            ask_ban=data["ask_ban"],
+            user_id=data["user_id"],
+            date_joined=datetime.datetime.strptime(date_joined, DATE_FORMAT).toordinal()
+                if isinstance(date_joined, str) else date_joined,
+            action_count=data["action_count"],
+            char_name=data["char_name"],
+            char_race=sys.intern(data["char_race"]),
+            char_class=sys.intern(data["char_class"]),
+            action=data["action"],
+            skills=tuple(sys.intern(skill_id) for skill_id in data["skills"]),
+            inventory={sys.intern(item_id): count for item_id, count in inventory.items()}
+        )
 
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "status": self.status.label,
+            "ask_ban": self.ask_ban,
+            "user_id": self.user_id,
+            "date_joined": self.join_date,
+            "action_count": self.action_count,
+            "char_name": self.char_name,
+            "char_race": self.char_race,
+            "char_class": self.char_class,
+            "action": self.action,
+            "skills": list(self.skills),
+            "inventory": dict(self.inventory)
+        }
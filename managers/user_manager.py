@@ -1,139 +1,570 @@
-from dacite import from_dict
-from dataclasses import asdict
-import json
+import asyncio
+import atexit
+import bisect
+from collections import Counter
 import logging
+import os
+import sys
 import threading
 import time
-from typing import Dict, Any
+from typing import Any, Callable, Dict
 
-from managers.user import User
+from managers.binary_snapshot import MAX_COUNT
+from managers.catalog_manager import CatalogManager
+from managers.stats_manager import StatsManager
+from managers.storage import Storage, open_storage
+from managers.user import User, UserStatus
 
 class UserManager:
     _instance = None
+    data_dir = "data"
+    storage: Storage = None
+    _lock = threading.RLock()
     user_data: Dict[int, User] = {}
-    skill_list: Dict[str, Dict[str, Any]] = {}
-    item_list: Dict[str, Dict[str, Any]] = {}
+    # Records read from storage but not yet turned into User objects
+    _raw: Dict[int, Dict[str, Any]] = {}
 
-    def __new__(cls):
+    def __new__(cls, background: bool = False):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
-            cls._load_data()
+            # In background mode users are loaded by `start_loading` once the event loop runs
+            if not background:
+                cls._load_users()
             cls._start_autosave()
         return cls._instance
 
     @classmethod
-    def _load_data(cls):
-        file = open("data/user_data.json", "r", encoding="utf-8")
-        raw_users = json.load(file)
-        file.close()
+    def _load_users(cls, lazy: bool = False):
+        if cls.storage is None:
+            cls.storage = open_storage(os.getenv("PTB_STORAGE", "json"), cls.data_dir, cls._lock)
 
-        for key in raw_users:
-            cls.user_data[int(key)] = from_dict(data_class=User, data=raw_users[key])
+        started = time.perf_counter()
+        with cls._lock:
+            cls._ready.clear()
+            raw_users, records = cls.storage.load()
+            cls.user_data, cls._raw = {}, raw_users
+            cls._reset_indexes()
+            # Replayed operations decode only the users they touch
+            for op, kwargs in records:
+                getattr(cls, f"_op_{op}")(**kwargs)
+            cls._ready.set()
+        StatsManager.observe("load", time.perf_counter() - started)
+        if not lazy:
+            cls._materialize_all()
 
-        ## Load skills
-        file = open("data/skills.json", "r", encoding="utf-8")
-        cls.skill_list = json.load(file)
-        file.close()
+    @classmethod
+    def _materialize_all(cls):
+        while cls._raw:
+            # Small batches, so handlers decoding their own user are not held up
+            with cls._lock:
+                for _ in range(min(1000, len(cls._raw))):
+                    user_id, raw = cls._raw.popitem()
+                    user = cls.user_data[user_id] = User.from_dict(raw)
+                    cls._index(user)
+
+    @classmethod
+    def _user(cls, user_id: int) -> User:
+        user = cls.user_data.get(user_id)
+        if user is None:
+            with cls._lock:
+                user = cls.user_data.get(user_id)
+                if user is None:
+                    user = cls.user_data[user_id] = User.from_dict(cls._raw.pop(user_id))
+                    cls._index(user)
+        return user
 
-        ## Load items
-        file = open("data/items.json", "r", encoding="utf-8")
-        cls.item_list = json.load(file)
-        file.close()
+    #region Background loading
+    # Polling starts before the roster is decoded: the storage is read and the
+    # journal replayed off the loop, after which any single user is decoded on
+    # first access while the rest are converted in the background.
+    _ready = threading.Event()
+    _ready_async: asyncio.Event = None
+    _loading: asyncio.Task = None
+    _load_error: Exception = None
 
+    # `on_failure` is called when the storage cannot be read; updates waiting
+    # for the users are released with an error
     @classmethod
-    def reload_data(cls):
-        cls._save()
-        cls._load_data()
+    def start_loading(cls, on_failure: Callable[[], None] = None):
+        cls._ready_async = asyncio.Event()
+        cls._load_error = None
+        cls._loading = asyncio.create_task(cls._load_users_async(on_failure))
+
+    @classmethod
+    async def _load_users_async(cls, on_failure: Callable[[], None] = None):
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(cls._load_users, True)
+        except Exception as error:
+            logging.exception("User data could not be loaded")
+            cls._load_error = error
+            cls._ready_async.set()
+            if on_failure is not None:
+                on_failure()
+            return
+        cls._ready_async.set()
+        logging.log(logging.INFO, f"User data ready in {time.perf_counter() - started:.3f}s")
+        try:
+            await asyncio.to_thread(cls._materialize_all)
+        except Exception:
+            # The rest are still decoded one by one on first access
+            logging.exception("Users could not be decoded in the background")
+            return
+        logging.log(logging.INFO, f"{len(cls.user_data)} users decoded in {time.perf_counter() - started:.3f}s")
+
+    @classmethod
+    async def wait_ready(cls):
+        if cls._ready_async is not None and not cls._ready.is_set():
+            await cls._ready_async.wait()
+        if cls._load_error is not None:
+            raise RuntimeError("User data could not be loaded") from cls._load_error
+
+    # The user, decoded on first access, or None if there is no such user
+    @classmethod
+    def lookup(cls, user_id: int) -> User | None:
+        try:
+            return cls._user(user_id)
+        except KeyError:
+            return None
+
+    @classmethod
+    def ensure_user(cls, user_id: int) -> bool:
+        return cls.lookup(user_id) is not None
+    #endregion
 
+    #region Users
     @classmethod
     def get_user(cls, user_id: int):
-        return cls.user_data[user_id]
+        return cls._user(user_id)
 
+    # Complete once loading finishes; before that it always holds the users
+    # that were looked up (every sender is, see ContextMiddleware)
     @classmethod
     def user_list(cls):
         return cls.user_data.keys()
 
+    # e.g. find(status=UserStatus.AWAIT) or find(action=False)
+    @classmethod
+    def find(cls, **filters) -> list[int]:
+        cls._materialize_all()
+        return cls.storage.select(cls.user_data, **filters)
+
     @classmethod
     def create(cls, **kwargs):
-        cls.user_data[kwargs["user_id"]] = User(status="await", **kwargs)
-        cls._save()
+        cls._apply("create", **User.from_dict({"status": UserStatus.AWAIT, **kwargs}).to_dict())
 
     @classmethod
     def approve_user(cls, user_id: int):
-        cls.user_data[user_id].status = "active"
-        cls.user_data[user_id].action = True
+        cls._apply("approve_user", user_id=user_id)
 
     @classmethod
     def reject_user(cls, user_id: int):
-        cls.user_data.pop(user_id)
+        cls._apply("reject_user", user_id=user_id)
 
     @classmethod
     def do_action(cls, user_id: int):
-        cls.user_data[user_id].action = False
-        cls.user_data[user_id].action_count += 1
+        cls._apply("do_action", user_id=user_id)
 
     @classmethod
     def reject_action(cls, user_id: int):
-        cls.user_data[user_id].action = True
-        cls.user_data[user_id].action_count -= 1
+        cls._apply("reject_action", user_id=user_id)
 
     @classmethod
     def ban_ask(cls, user_id: int):
-        cls.user_data[user_id].ask_ban = True
+        cls._apply("ban_ask", user_id=user_id)
 
     @classmethod
     def unban_ask(cls, user_id):
-        cls.user_data[user_id].ask_ban = False
+        cls._apply("unban_ask", user_id=user_id)
+
+    @classmethod
+    def current_turn(cls) -> int:
+        return cls.storage.meta.get("turn", 0)
+
+    # Gives every active user their action back. Turns only move forward, so
+    # a repeated or late rollover for a turn already started does nothing and
+    # returns None; otherwise returns the users to notify.
+    @classmethod
+    def new_turn(cls, turn: int) -> list[int] | None:
+        with cls._lock:
+            if cls.current_turn() >= turn:
+                return None
+            cls._apply("new_turn", turn=turn)
+            return list(cls._by_status[UserStatus.ACTIVE])
+    #endregion
+
+    #region Bulk
+    TARGET_FILTERS = {"all": None, "active": UserStatus.ACTIVE, "pending": UserStatus.AWAIT}
+
+    # GM commands take user ids and the filters above, optionally limited to
+    # one status. Returns the distinct ids in order plus the targets that are
+    # not (suitable) users, so nothing is applied unless the whole list checks out.
+    @classmethod
+    def resolve(cls, targets: list[str], status: UserStatus | None = None) -> tuple[list[int], list[str]]:
+        user_ids, invalid = {}, []
+        for target in targets:
+            if target in cls.TARGET_FILTERS:
+                found = cls.TARGET_FILTERS[target]
+                found = cls.with_status(found) if found is not None else cls.find()
+                user_ids.update(dict.fromkeys(
+                    user_id for user_id in found if status is None or user_id in cls._by_status[status]
+                ))
+                continue
+            try:
+                user_id = int(target)
+            except ValueError:
+                invalid.append(target)
+                continue
+            if not cls.ensure_user(user_id) or (status is not None and cls._user(user_id).status != status):
+                invalid.append(target)
+                continue
+            user_ids[user_id] = None
+        return list(user_ids), invalid
+
+    # Each is a single operation, so one journal line or one transaction
+    @classmethod
+    def approve_users(cls, user_ids: list[int]):
+        if user_ids:
+            cls._apply("approve_users", user_ids=user_ids)
+
+    @classmethod
+    def reject_users(cls, user_ids: list[int]):
+        if user_ids:
+            cls._apply("reject_users", user_ids=user_ids)
+
+    @classmethod
+    def ban_ask_users(cls, user_ids: list[int]):
+        if user_ids:
+            cls._apply("ban_ask_users", user_ids=user_ids)
+
+    @classmethod
+    def unban_ask_users(cls, user_ids: list[int]):
+        if user_ids:
+            cls._apply("unban_ask_users", user_ids=user_ids)
+
+    # Returns the users that did not have the skill yet
+    @classmethod
+    def grant_skill(cls, user_ids: list[int], skill_id: str) -> list[int]:
+        with cls._lock:
+            user_ids = [user_id for user_id in user_ids if skill_id not in cls._user(user_id).skills]
+            if user_ids:
+                cls._apply("grant_skill", skill_id=skill_id, user_ids=user_ids)
+        return user_ids
+
+    @classmethod
+    def give_item(cls, user_ids: list[int], item_id: str, count: int):
+        if user_ids:
+            cls._apply("give_item", item_id=item_id, count=count, user_ids=user_ids)
+    #endregion
+
+    #region Indexes
+    # Secondary indexes over the decoded users, kept up to date by every
+    # operation and whenever a user is decoded, so the GM queries below cost
+    # the size of their answer rather than a scan of the roster. Operations
+    # change indexed fields only through the setters here.
+    _by_status: Dict[UserStatus, set[int]] = {status: set() for status in UserStatus}
+    # Users whose action for the current turn is still unused
+    _with_action: set[int] = set()
+    _ask_banned: set[int] = set()
+    _races: Counter = Counter()
+    _classes: Counter = Counter()
+    # action_count -> users, and the distinct counts in ascending order
+    _by_count: Dict[int, set[int]] = {}
+    _counts: list[int] = []
+
+    @classmethod
+    def _reset_indexes(cls):
+        cls._by_status = {status: set() for status in UserStatus}
+        cls._with_action, cls._ask_banned = set(), set()
+        cls._races, cls._classes = Counter(), Counter()
+        cls._by_count, cls._counts = {}, []
+
+    @classmethod
+    def _index(cls, user: User):
+        cls._by_status[user.status].add(user.user_id)
+        if user.action:
+            cls._with_action.add(user.user_id)
+        if user.ask_ban:
+            cls._ask_banned.add(user.user_id)
+        cls._races[user.char_race] += 1
+        cls._classes[user.char_class] += 1
+        cls._rank(user.user_id, user.action_count)
+
+    @classmethod
+    def _unindex(cls, user: User):
+        cls._by_status[user.status].discard(user.user_id)
+        cls._with_action.discard(user.user_id)
+        cls._ask_banned.discard(user.user_id)
+        for counter, key in ((cls._races, user.char_race), (cls._classes, user.char_class)):
+            counter[key] -= 1
+            if not counter[key]:
+                del counter[key]
+        cls._unrank(user.user_id, user.action_count)
+
+    @classmethod
+    def _rank(cls, user_id: int, count: int):
+        users = cls._by_count.get(count)
+        if users is None:
+            users = cls._by_count[count] = set()
+            bisect.insort(cls._counts, count)
+        users.add(user_id)
+
+    @classmethod
+    def _unrank(cls, user_id: int, count: int):
+        users = cls._by_count[count]
+        users.discard(user_id)
+        if not users:
+            del cls._by_count[count]
+            cls._counts.pop(bisect.bisect_left(cls._counts, count))
+
+    @classmethod
+    def _set_status(cls, user: User, status: UserStatus):
+        cls._by_status[user.status].discard(user.user_id)
+        user.status = status
+        cls._by_status[status].add(user.user_id)
+
+    @classmethod
+    def _set_action(cls, user: User, action: bool):
+        user.action = action
+        (cls._with_action.add if action else cls._with_action.discard)(user.user_id)
+
+    @classmethod
+    def _set_ask_ban(cls, user: User, ask_ban: bool):
+        user.ask_ban = ask_ban
+        (cls._ask_banned.add if ask_ban else cls._ask_banned.discard)(user.user_id)
+
+    @classmethod
+    def _set_action_count(cls, user: User, count: int):
+        cls._unrank(user.user_id, user.action_count)
+        user.action_count = count
+        cls._rank(user.user_id, count)
+
+    # Queries decode whatever is still loading first, so they see every user
+    @classmethod
+    def with_status(cls, status: UserStatus) -> list[int]:
+        cls._materialize_all()
+        with cls._lock:
+            return list(cls._by_status[status])
+
+    # Active users who have not used this turn's action
+    @classmethod
+    def idle(cls) -> list[int]:
+        cls._materialize_all()
+        with cls._lock:
+            active = cls._by_status[UserStatus.ACTIVE]
+            return [user_id for user_id in cls._with_action if user_id in active]
+
+    @classmethod
+    def ask_banned(cls) -> list[int]:
+        cls._materialize_all()
+        with cls._lock:
+            return list(cls._ask_banned)
+
+    # [(user_id, action_count)] for the `count` active players with the most
+    # actions; ties come in no particular order
+    @classmethod
+    def top(cls, count: int) -> list[tuple[int, int]]:
+        cls._materialize_all()
+        leaders = []
+        with cls._lock:
+            active = cls._by_status[UserStatus.ACTIVE]
+            for action_count in reversed(cls._counts):
+                for user_id in cls._by_count[action_count]:
+                    if len(leaders) == count:
+                        return leaders
+                    if user_id in active:
+                        leaders.append((user_id, action_count))
+        return leaders
+
+    # Users per race and per class, most common first
+    @classmethod
+    def census(cls) -> tuple[list[tuple[str, int]], list[tuple[str, int]]]:
+        cls._materialize_all()
+        with cls._lock:
+            return cls._races.most_common(), cls._classes.most_common()
+    #endregion
 
     #region Skills
     @classmethod
     def add_skill(cls, user_id: int, skill_id: str) -> bool:
-        if skill_id in cls.user_data[user_id].skills:
+        if skill_id in cls._user(user_id).skills:
             return False
-        cls.user_data[user_id].skills.append(skill_id)
+        cls._apply("add_skill", user_id=user_id, skill_id=skill_id)
         return True
 
     @classmethod
     def get_skill_name(cls, skill_id: str):
-        return cls.skill_list[skill_id]["name"]
+        return CatalogManager.catalog.skills[skill_id]["name"]
 
     @classmethod
     def get_skill(cls, skill_id: str):
-        return cls.skill_list[skill_id]
+        return CatalogManager.catalog.skills[skill_id]
 
     @classmethod
     def get_item(cls, item_id: str):
-        return cls.item_list[item_id]
+        return CatalogManager.catalog.items[item_id]
+
+    @classmethod
+    def get_item_name(cls, item_id: str):
+        return CatalogManager.catalog.items[item_id]["name"]
+
+    #endregion
+
+    #region Operations
+    # Every mutation is an `_op_<name>` applied to memory and then recorded by
+    # the storage backend as one change (a journal line or a row update).
+    @classmethod
+    def _op_create(cls, **kwargs):
+        user = cls.user_data[kwargs["user_id"]] = User.from_dict({"status": UserStatus.AWAIT, **kwargs})
+        cls._index(user)
+
+    @classmethod
+    def _op_approve_user(cls, user_id: int):
+        user = cls._user(user_id)
+        cls._set_status(user, UserStatus.ACTIVE)
+        cls._set_action(user, True)
+
+    @classmethod
+    def _op_reject_user(cls, user_id: int):
+        cls._user(user_id)
+        cls._unindex(cls.user_data.pop(user_id))
+
+    @classmethod
+    def _op_do_action(cls, user_id: int):
+        user = cls._user(user_id)
+        cls._set_action(user, False)
+        cls._set_action_count(user, user.action_count + 1)
+
+    @classmethod
+    def _op_reject_action(cls, user_id: int):
+        user = cls._user(user_id)
+        cls._set_action(user, True)
+        cls._set_action_count(user, user.action_count - 1)
+
+    @classmethod
+    def _op_ban_ask(cls, user_id: int):
+        cls._set_ask_ban(cls._user(user_id), True)
+
+    @classmethod
+    def _op_unban_ask(cls, user_id: int):
+        cls._set_ask_ban(cls._user(user_id), False)
+
+    @classmethod
+    def _op_add_skill(cls, user_id: int, skill_id: str):
+        user = cls._user(user_id)
+        user.skills = (*user.skills, sys.intern(skill_id))
+        user.touch()
 
+    @classmethod
+    def _op_approve_users(cls, user_ids: list[int]):
+        for user_id in user_ids:
+            cls._op_approve_user(user_id)
+
+    @classmethod
+    def _op_reject_users(cls, user_ids: list[int]):
+        for user_id in user_ids:
+            cls._op_reject_user(user_id)
+
+    @classmethod
+    def _op_ban_ask_users(cls, user_ids: list[int]):
+        for user_id in user_ids:
+            cls._op_ban_ask(user_id)
+
+    @classmethod
+    def _op_unban_ask_users(cls, user_ids: list[int]):
+        for user_id in user_ids:
+            cls._op_unban_ask(user_id)
+
+    @classmethod
+    def _op_grant_skill(cls, skill_id: str, user_ids: list[int]):
+        for user_id in user_ids:
+            if skill_id not in cls._user(user_id).skills:
+                cls._op_add_skill(user_id, skill_id)
+
+    @classmethod
+    def _op_give_item(cls, item_id: str, count: int, user_ids: list[int]):
+        item_id = sys.intern(item_id)
+        for user_id in user_ids:
+            user = cls._user(user_id)
+            # Capped, so the count still fits a binary snapshot
+            user.inventory[item_id] = min(user.inventory.get(item_id, 0) + count, MAX_COUNT)
+            user.touch()
+
+    @classmethod
+    def _op_new_turn(cls, turn: int):
+        cls._materialize_all()
+        active = cls._by_status[UserStatus.ACTIVE]
+        for user_id in active - cls._with_action:
+            cls.user_data[user_id].action = True
+        cls._with_action |= active
+        cls.storage.meta["turn"] = turn
+
+    @classmethod
+    def _apply(cls, op: str, **kwargs):
+        with cls._lock:
+            getattr(cls, f"_op_{op}")(**kwargs)
+            cls.storage.record(op, kwargs)
+        if cls.storage.pending >= cls.compact_after:
+            cls._dirty.set()
     #endregion
 
     #region Autosave
+    # A single worker thread owns compaction. Mutators only record one change
+    # in the storage and mark the state dirty; marks arriving within
+    # `save_delay` are merged into one compaction.
+    autosave_interval = 3600  # One hour
+    save_delay = 2
+    compact_after = 1000
     _autosave = False
     _as_thread = None
+    _dirty = threading.Event()
 
     @classmethod
     def _start_autosave(cls):
         if cls._autosave:
             return
         cls._autosave = True
-        cls._as_thread = threading.Thread(target=cls._autosave_loop, daemon=True)
+        cls._as_thread = threading.Thread(target=cls._autosave_loop, name="user-autosave", daemon=True)
         cls._as_thread.start()
+        atexit.register(cls._stop_autosave)
         logging.log(logging.INFO, "Autosave enabled!")
 
     @classmethod
     def _autosave_loop(cls):
+        # A failed save is retried on the next wake-up; the journal keeps
+        # every change until a save goes through
+        failed = False
         while cls._autosave:
-            time.sleep(3600)  # One hour
-            cls._save()
+            cls._dirty.wait(cls.autosave_interval)
+            if not cls._autosave:
+                break
+            time.sleep(cls.save_delay)
+            cls._dirty.clear()
+            if cls.storage.pending or failed:
+                try:
+                    cls._save()
+                    failed = False
+                except Exception:
+                    logging.exception("Autosave failed, retrying on the next wake-up")
+                    failed = True
+
+    @classmethod
+    def request_save(cls):
+        cls._dirty.set()
+
+    @classmethod
+    def shutdown(cls):
+        cls._stop_autosave()
 
     @classmethod
     def _save(cls):
-        ready_data = {}
-        for key in cls.user_data:
-            ready_data[key] = asdict(cls.user_data[key])
-        file = open("data/user_data.json", "w", encoding="utf-8")
-        json.dump(ready_data, file, indent=2)
-        file.close()
+        # Nothing can have changed before the storage was read
+        if not cls._ready.is_set():
+            return
+        started = time.perf_counter()
+        cls._materialize_all()
+        cls.storage.compact(cls.user_data)
+        StatsManager.observe("save", time.perf_counter() - started)
         logging.log(logging.INFO, "User data saved!")
 
     @classmethod
@@ -141,8 +572,11 @@ class UserManager:
         if not cls._autosave:
             return
         cls._autosave = False
+        cls._dirty.set()
         if cls._as_thread is not None:
             cls._as_thread.join()
         cls._save()
+        if cls.storage is not None:
+            cls.storage.close()
         logging.log(logging.INFO, "Autosave disabled!")
     #endregion
@@ -0,0 +1,43 @@
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User as TelegramUser
+
+from managers.state_store import StateStore
+from managers.user import UserStatus
+from managers.user_manager import UserManager
+
+class Role(IntEnum):
+    GUEST = 0
+    PENDING = 1
+    PLAYER = 2
+    GM = 3
+
+class ContextMiddleware(BaseMiddleware):
+    # Resolves the sender once per update and hands handlers `user` (their
+    # User, or None without a character), `role` and `conversation` (the
+    # step of a character creation, action or question in progress, or None).
+    # Routers filter on these, so a command outside the sender's role never
+    # reaches a handler.
+    def __init__(self, gm_id: int, conversations: StateStore):
+        self.gm_id = gm_id
+        self.conversations = conversations
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        sender: TelegramUser | None = data.get("event_from_user")
+        user, role, conversation = None, Role.GUEST, None
+        if sender is not None:
+            user = UserManager.lookup(sender.id)
+            conversation = self.conversations.get(sender.id)
+            if sender.id == self.gm_id:
+                role = Role.GM
+            elif user is not None:
+                role = Role.PENDING if user.status == UserStatus.AWAIT else Role.PLAYER
+        data["user"], data["role"], data["conversation"] = user, role, conversation
+        return await handler(event, data)
@@ -0,0 +1,19 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from managers.user_manager import UserManager
+
+class LoadGateMiddleware(BaseMiddleware):
+    # Holds an update only until user data is readable; the sender's record
+    # is then decoded on its own by ContextMiddleware, so handlers can keep
+    # using the synchronous UserManager API
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        await UserManager.wait_ready()
+        return await handler(event, data)
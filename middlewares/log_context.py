@@ -0,0 +1,24 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update, User as TelegramUser
+
+from managers.log_manager import update_id_var, user_id_var
+
+class LogContextMiddleware(BaseMiddleware):
+    # The first outer middleware: every record logged while the update is
+    # handled carries its update_id and the sender's user_id
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        sender: TelegramUser | None = data.get("event_from_user")
+        update_token = update_id_var.set(event.update_id)
+        user_token = user_id_var.set(sender.id if sender is not None else None)
+        try:
+            return await handler(event, data)
+        finally:
+            user_id_var.reset(user_token)
+            update_id_var.reset(update_token)
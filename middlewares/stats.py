@@ -0,0 +1,36 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from managers.log_manager import UPDATE_LOGGER, handler_var
+from managers.stats_manager import StatsManager
+
+class StatsMiddleware(BaseMiddleware):
+    # Registered as an inner middleware, so it only runs for the handler that
+    # matched and can name it. Logs one (sampled) record per update with the
+    # handler and its latency.
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        name = data["handler"].callback.__name__
+        token = handler_var.set(name)
+        started = time.perf_counter()
+        error = True
+        try:
+            result = await handler(event, data)
+            error = False
+            return result
+        finally:
+            seconds = time.perf_counter() - started
+            StatsManager.observe_handler(name, seconds, error)
+            logging.getLogger(UPDATE_LOGGER).log(
+                logging.ERROR if error else logging.INFO, "Update failed" if error else "Update handled",
+                extra={"latency": seconds}
+            )
+            handler_var.reset(token)
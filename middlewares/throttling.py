@@ -0,0 +1,37 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update, User as TelegramUser
+
+from managers.replies_manager import RepliesManager
+from managers.throttle_manager import ThrottleManager
+from middlewares.context import Role
+
+class ThrottlingMiddleware(BaseMiddleware):
+    # Outer middleware after ContextMiddleware: a request over its limit is
+    # dropped before any filter or handler sees it. The GM is never throttled.
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        sender: TelegramUser | None = data.get("event_from_user")
+        if sender is None or data.get("role") == Role.GM:
+            return await handler(event, data)
+
+        if event.callback_query is not None:
+            rule = "callback"
+        elif event.message is not None:
+            # "/ask_gm@bot text" -> "ask_gm"
+            command = (event.message.text or "").split(maxsplit=1)
+            rule = command[0][1:].split("@")[0].lower() if command and command[0].startswith("/") else "message"
+        else:
+            return await handler(event, data)
+
+        if not ThrottleManager.allow(sender.id, rule):
+            # Otherwise the button keeps spinning until Telegram gives up
+            if event.callback_query is not None:
+                await event.callback_query.answer(text=RepliesManager.get("throttled_alert").strip())
+            return None
+        return await handler(event, data)
@@ -0,0 +1,68 @@
+import datetime
+import os
+
+import pytest
+
+from managers.archive_manager import USER_ENTRY, WEEK_ENTRY, ArchiveManager
+from managers.rollover_manager import WEEKDAYS, RolloverManager
+
+
+@pytest.fixture
+def archive(tmp_path):
+    ArchiveManager.open(str(tmp_path))
+    yield ArchiveManager
+    ArchiveManager.close()
+
+
+def texts(records):
+    return [record["text"] for record in records]
+
+
+def test_recovered_records_are_chained_to_earlier_entries(archive, tmp_path):
+    archive.append("action", 5, "Hero", "first")
+    archive.append("action", 6, "Other", "other")
+    archive.append("ask", 5, "Hero", "second")
+    archive.append("action", 5, "Hero", "third")
+    # A crash after the record but before its index entries
+    archive.close()
+    for name, entry in (("week.idx", WEEK_ENTRY), ("user.idx", USER_ENTRY)):
+        path = os.path.join(str(tmp_path), "archive", name)
+        os.truncate(path, os.path.getsize(path) - entry.size)
+
+    archive.open(str(tmp_path))
+    assert archive._count == 4
+    records, total = archive.user_page(5, 0, 10)
+    assert total == 3
+    assert texts(records) == ["third", "second", "first"]
+    assert texts(archive.user_page(6, 0, 10)[0]) == ["other"]
+
+
+def test_torn_record_is_dropped(archive, tmp_path):
+    archive.append("action", 5, "Hero", "first")
+    archive.close()
+    file = open(os.path.join(str(tmp_path), "archive", "archive.log"), "ab")
+    file.write(b'{"ts": 1, "week"')
+    file.close()
+
+    archive.open(str(tmp_path))
+    archive.append("action", 5, "Hero", "second")
+    records, total = archive.user_page(5, 0, 10)
+    assert total == 2
+    assert texts(records) == ["second", "first"]
+
+
+def test_weeks_do_not_decrease_when_the_schedule_moves(archive, tmp_path, monkeypatch):
+    monkeypatch.setattr(RolloverManager, "schedule", RolloverManager.schedule)
+    weekday = datetime.date.today().weekday()
+    # The turn started today, then a schedule whose turn started yesterday
+    RolloverManager.schedule = f"{WEEKDAYS[weekday]} 00:00"
+    archive.append("action", 5, "Hero", "first")
+    RolloverManager.schedule = f"{WEEKDAYS[(weekday - 1) % 7]} 00:00"
+    archive.append("action", 5, "Hero", "second")
+    week = datetime.date.today().toordinal()
+    assert archive.current_week() == week
+    assert texts(archive.week_page(week, 0, 10)[0]) == ["first", "second"]
+
+    archive.close()
+    archive.open(str(tmp_path))
+    assert archive.current_week() == week
@@ -0,0 +1,49 @@
+import asyncio
+import json
+import os
+import shutil
+
+import pytest
+
+from managers.catalog_manager import CatalogManager
+
+
+def write(data_dir, name, data):
+    file = open(os.path.join(data_dir, name), "w", encoding="utf-8")
+    file.write(data if isinstance(data, str) else json.dumps(data))
+    file.close()
+
+
+@pytest.fixture
+def catalog_dir(tmp_path):
+    shutil.copy(os.path.join("data", "replies.yaml"), tmp_path)
+    write(tmp_path, "skills.json", {"fire": {"name": "Fire", "description": "Burns"}})
+    write(tmp_path, "items.json", {"sword": {"name": "Sword", "description": "Sharp"}})
+    CatalogManager.data_dir, CatalogManager.catalog, CatalogManager._mtimes = str(tmp_path), None, {}
+    CatalogManager._instance = None
+    CatalogManager()
+    yield tmp_path
+    CatalogManager._instance = None
+
+
+def test_failed_forced_reload_keeps_other_edits_pending(catalog_dir):
+    write(catalog_dir, "skills.json", {"ice": {"name": "Ice", "description": "Freezes"}})
+    write(catalog_dir, "items.json", "{broken")
+    assert not asyncio.run(CatalogManager.reload(force=True))
+    assert "fire" in CatalogManager.catalog.skills
+
+    write(catalog_dir, "items.json", {"shield": {"name": "Shield", "description": "Blocks"}})
+    assert asyncio.run(CatalogManager.reload())
+    assert "ice" in CatalogManager.catalog.skills
+    assert "shield" in CatalogManager.catalog.items
+
+
+def test_broken_file_keeps_previous_contents(catalog_dir):
+    version = CatalogManager.catalog.version
+    write(catalog_dir, "items.json", "{broken")
+    write(catalog_dir, "skills.json", {"ice": {"name": "Ice", "description": "Freezes"}})
+    assert asyncio.run(CatalogManager.reload())
+    assert CatalogManager.catalog.version == version + 1
+    assert "sword" in CatalogManager.catalog.items
+    # Not parsed again until it is edited
+    assert not asyncio.run(CatalogManager.reload())
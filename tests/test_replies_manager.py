@@ -0,0 +1,57 @@
+import os
+
+import pytest
+import yaml
+
+from managers.replies_manager import RepliesManager
+
+
+def test_shipped_replies_compile():
+    file = open(os.path.join("data", "replies.yaml"), "r", encoding="utf-8")
+    raw = yaml.safe_load(file)
+    file.close()
+    templates = RepliesManager.compile(raw)
+    assert set(templates) == set(raw)
+
+
+def test_static_templates_are_inlined():
+    templates = RepliesManager.compile({
+        "help_msg": "/help {{not a field}}",
+        "sub_help": "{char_name}, see {help_msg}",
+        "start_msg": "{sub_help} or ask {gm_id}"
+    })
+    assert templates["help_msg"].fields == ()
+    assert templates["help_msg"].render() == "/help {not a field}"
+    assert templates["sub_help"].fields == ("char_name",)
+    assert templates["sub_help"].render(char_name="Hero") == "Hero, see /help {not a field}"
+
+
+def test_parameters_are_kept_in_order_of_first_use():
+    template = RepliesManager.compile({"new_item_added": "{count} x {item_name}, {count} total"})["new_item_added"]
+    assert template.fields == ("count", "item_name")
+    assert template.render(item_name="Sword", count=2) == "2 x Sword, 2 total"
+
+
+def test_missing_parameter_names_the_reply():
+    template = RepliesManager.compile({"new_item_added": "{count} x {item_name}"})["new_item_added"]
+    with pytest.raises(KeyError, match="new_item_added"):
+        template.render(count=2)
+
+
+@pytest.mark.parametrize("raw, error", [
+    ({"join": "{char_nmae} joined"}, "unknown key '{char_nmae}'"),
+    # Parameters of one reply are not known to another
+    ({"join": "{reason}"}, "unknown key '{reason}'"),
+    # Nor are templates that take parameters themselves
+    ({"join": "{char_name}", "description_msg": "{join}", "reject_msg": "{description_msg}"}, "unknown key"),
+    ({"join": "{char_name!r}"}, "unsupported field"),
+    ({"join": "{char_name:>10}"}, "unsupported field"),
+    ({"join": "{user.name}"}, "unsupported field"),
+    ({"join": "{0}"}, "unsupported field"),
+    ({"join": "{char_name"}, "malformed"),
+    ({"join": 5}, "not a string"),
+    ({"a": "{b}", "b": "{a}"}, "includes itself"),
+])
+def test_invalid_templates_are_rejected(raw, error):
+    with pytest.raises(ValueError, match=error.replace("{", r"\{").replace("}", r"\}")):
+        RepliesManager.compile(raw)
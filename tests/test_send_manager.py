@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+
+from managers.send_manager import Lane, SendManager, TokenBucket
+
+
+@pytest.fixture
+def sender(monkeypatch):
+    for name, value in (("_chats", {}), ("_ready", ([], [])), ("_pending", 0), ("_high_streak", 0),
+                        ("_wakeup", None), ("_idle", None), ("_worker", None), ("_sending", set())):
+        monkeypatch.setattr(SendManager, name, value)
+    monkeypatch.setenv("PTB_SEND_RATE", "1000")
+    monkeypatch.setenv("PTB_SEND_CHAT_RATE", "1000")
+    monkeypatch.setenv("PTB_SEND_LOW_EVERY", "5")
+    return SendManager
+
+
+class FakeBot:
+    # Fails the first `retries` requests with a RetryAfter of `retry_after` seconds
+    def __init__(self, retries=0, retry_after=1):
+        self.retries = retries
+        self.retry_after = retry_after
+        self.sent = []
+
+    async def __call__(self, method):
+        if self.retries:
+            self.retries -= 1
+            raise TelegramRetryAfter(method, "Flood control exceeded", self.retry_after)
+        self.sent.append((method.chat_id, method.text, time.monotonic()))
+        return True
+
+
+def test_bucket_refills_at_its_rate_up_to_capacity():
+    bucket = TokenBucket(2, 3)
+    now = bucket.updated
+    for _ in range(3):
+        assert bucket.delay(now) == 0
+        bucket.consume(now)
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.5) == 0
+    assert not bucket.full(now + 1)
+    assert bucket.full(now + 10)
+    assert bucket.tokens == 3
+
+
+def test_bucket_pause_waits_out_the_retry_after():
+    bucket = TokenBucket(2, 3)
+    now = bucket.updated
+    # Saved up tokens do not shorten the pause
+    bucket.pause(now, 4)
+    assert bucket.delay(now) == pytest.approx(4.5)
+    assert bucket.delay(now + 4.5) == 0
+
+
+def test_retry_after_requeues_at_the_head_of_the_chat(sender):
+    bot = FakeBot(retries=1)
+
+    async def run():
+        sender.start(bot)
+        started = time.monotonic()
+        first = sender.send(7, "first")
+        second = sender.send(7, "second")
+        other = sender.send(8, "other")
+        await asyncio.gather(first, second, other)
+        await sender.stop()
+        return started
+
+    started = asyncio.run(run())
+    assert [text for chat_id, text, _ in bot.sent if chat_id == 7] == ["first", "second"]
+    sent_at = {text: at for _, text, at in bot.sent}
+    # Only the flooded chat waits
+    assert sent_at["first"] - started >= 0.9
+    assert sent_at["other"] - started < 0.5
+
+
+def test_low_lane_gets_a_share_under_high_traffic(sender, monkeypatch):
+    # The queued messages are dropped, not sent
+    monkeypatch.setattr(sender, "drain_timeout", 0)
+
+    async def run():
+        sender.start(FakeBot())
+        sender._worker.cancel()
+        for chat_id in range(100):
+            sender.send(chat_id, "reply")
+            sender.send(1000 + chat_id, "notification", Lane.LOW)
+        now = time.monotonic() + 1
+        lanes = [sender._next_job(now)[2].lane for _ in range(20)]
+        await sender.stop()
+        return lanes
+
+    assert asyncio.run(run()) == ([Lane.HIGH] * 4 + [Lane.LOW]) * 4
@@ -0,0 +1,116 @@
+import json
+import threading
+
+from managers.storage import JsonStorage
+from managers.user import User
+
+
+def write_journal(path, records, tail=b""):
+    file = open(path, "wb")
+    for record in records:
+        file.write(json.dumps(record).encode() + b"\n")
+    file.write(tail)
+    file.close()
+
+
+def test_torn_journal_tail_is_cut_before_appending(tmp_path):
+    storage = JsonStorage(str(tmp_path), threading.RLock())
+    write_journal(storage.journal_path, [
+        {"seq": 1, "op": "ban_ask", "user_id": 10},
+        {"seq": 2, "op": "ban_ask", "user_id": 11}
+    ], tail=b'{"seq": 3, "op": "ban_a')
+
+    _, records = storage.load()
+    assert [args["user_id"] for _, args in records] == [10, 11]
+    storage.record("unban_ask", {"user_id": 12})
+    storage.close()
+
+    storage = JsonStorage(str(tmp_path), threading.RLock())
+    _, records = storage.load()
+    storage.close()
+    assert records == [("ban_ask", {"user_id": 10}), ("ban_ask", {"user_id": 11}), ("unban_ask", {"user_id": 12})]
+
+
+def test_record_without_newline_counts_as_torn(tmp_path):
+    storage = JsonStorage(str(tmp_path), threading.RLock())
+    write_journal(storage.journal_path, [{"seq": 1, "op": "ban_ask", "user_id": 10}],
+                  tail=b'{"seq": 2, "op": "ban_ask", "user_id": 11}')
+
+    _, records = storage.load()
+    storage.record("ban_ask", {"user_id": 12})
+    storage.close()
+
+    storage = JsonStorage(str(tmp_path), threading.RLock())
+    _, records = storage.load()
+    storage.close()
+    assert [args["user_id"] for _, args in records] == [10, 12]
+
+
+def make_user(user_id, **changes):
+    return User.from_dict({
+        "status": "active", "ask_ban": False, "user_id": user_id, "date_joined": 739000, "action_count": 0,
+        "char_name": f"Character {user_id}", "char_race": "elf", "char_class": "mage", "action": True,
+        "skills": [], "inventory": {}, **changes
+    })
+
+
+class MutatingUsers(dict):
+    # Runs `mutate` once, in the middle of the compaction's copy
+    def __init__(self, users, after, mutate):
+        super().__init__(users)
+        self.reads, self.after, self.mutate = 0, after, mutate
+
+    def get(self, key, default=None):
+        self.reads += 1
+        if self.reads == self.after:
+            self.mutate()
+        return super().get(key, default)
+
+
+def compact_and_reload(tmp_path, users, after, mutate):
+    storage = JsonStorage(str(tmp_path), threading.RLock())
+    storage.load()
+    users = MutatingUsers(users, after, lambda: mutate(storage, users))
+    storage.compact(users)
+    expected = {key: user.to_dict() for key, user in users.items()}
+    storage.close()
+
+    storage = JsonStorage(str(tmp_path), threading.RLock())
+    raw_users, records = storage.load()
+    storage.close()
+    return raw_users, records, expected
+
+
+def test_users_changed_during_compaction_are_copied_again(tmp_path, monkeypatch):
+    monkeypatch.setattr("managers.storage.COPY_BATCH", 2)
+    users = {user_id: make_user(user_id) for user_id in range(1, 7)}
+
+    def mutate(storage, users):
+        # User 1 is copied already, user 7 is new and user 2 goes away
+        with storage.lock:
+            users[1].action_count = 5
+            storage.record("do_action", {"user_id": 1})
+            users[7] = make_user(7)
+            storage.record("create", users[7].to_dict())
+            del users[2]
+            storage.record("reject_user", {"user_id": 2})
+
+    raw_users, records, expected = compact_and_reload(tmp_path, users, 4, mutate)
+    assert records == []
+    assert raw_users == expected
+
+
+def test_change_without_user_ids_restarts_the_copy(tmp_path, monkeypatch):
+    monkeypatch.setattr("managers.storage.COPY_BATCH", 2)
+    users = {user_id: make_user(user_id) for user_id in range(1, 7)}
+
+    def mutate(storage, users):
+        with storage.lock:
+            for user in users.values():
+                user.action = False
+            storage.record("new_turn", {"turn": 2})
+
+    raw_users, records, expected = compact_and_reload(tmp_path, users, 3, mutate)
+    assert records == []
+    assert raw_users == expected
+    assert not any(user["action"] for user in raw_users.values())
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+
+import pytest
+
+import managers.throttle_manager
+from managers.throttle_manager import ThrottleManager
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(managers.throttle_manager, "time", clock)
+    for name, value in (("_counters", OrderedDict()), ("dropped", 0), ("rules", {}), ("commands", {}),
+                        ("escalation", (0, 0.0, 0.0)), ("capacity", ThrottleManager.capacity)):
+        monkeypatch.setattr(ThrottleManager, name, value)
+    return clock
+
+
+def hits(count, key=(1, "default"), limit=3, window=10.0):
+    return [ThrottleManager._hit(key, limit, window) for _ in range(count)]
+
+
+def test_limit_within_a_window(clock):
+    assert hits(4) == [True, True, True, False]
+    # Refused requests are not counted
+    assert ThrottleManager._counters[(1, "default")] == (1000.0, 0, 3)
+
+
+def test_previous_window_is_weighted_by_its_overlap(clock):
+    hits(3)
+    # The whole previous window still overlaps
+    clock.now += 10
+    assert hits(1) == [False]
+    # Half of it does: 1.5 + 0, 1.5 + 1, then 1.5 + 2 is over the limit
+    clock.now += 5
+    assert hits(3) == [True, True, False]
+    assert ThrottleManager._counters[(1, "default")] == (1010.0, 3, 2)
+
+
+def test_windows_without_requests_reset_the_count(clock):
+    hits(3)
+    clock.now += 25
+    assert hits(3) == [True, True, True]
+    assert ThrottleManager._counters[(1, "default")] == (1020.0, 0, 3)
+
+
+def test_oldest_pairs_are_evicted(clock):
+    ThrottleManager.capacity = 2
+    hits(3, key=(1, "default"))
+    hits(1, key=(2, "default"))
+    # Touching user 1 makes user 2 the oldest
+    hits(1, key=(1, "default"))
+    hits(1, key=(3, "default"))
+    assert list(ThrottleManager._counters) == [(1, "default"), (3, "default")]
+
+
+def test_rules_fall_back_to_default(clock):
+    ThrottleManager._configure({
+        "default": {"limit": 1, "window": 10}, "callback": {"limit": 2, "window": 10},
+        "commands": {"start": {"limit": 3, "window": 10}}
+    })
+    assert [ThrottleManager.allow(1, "start") for _ in range(4)] == [True, True, True, False]
+    assert [ThrottleManager.allow(1, "callback") for _ in range(3)] == [True, True, False]
+    # Other commands and plain messages share the default rule
+    assert [ThrottleManager.allow(1, "help") for _ in range(2)] == [True, False]
+    assert ThrottleManager.allow(1, "message") is False
+    assert ThrottleManager.dropped == 4
+
+
+def test_repeated_refusals_escalate_to_a_ban(clock, monkeypatch):
+    bans = []
+    monkeypatch.setattr(ThrottleManager, "_ban", classmethod(lambda cls, user_id, seconds: bans.append((user_id, seconds))))
+    ThrottleManager._configure({
+        "default": {"limit": 1, "window": 10}, "escalation": {"strikes": 2, "window": 60, "ban": 300}
+    })
+    ThrottleManager.allow(1, "help")
+    # Refusals up to `strikes` within the window are let go
+    for _ in range(2):
+        ThrottleManager.allow(1, "help")
+        clock.now += 1
+    assert bans == []
+    ThrottleManager.allow(1, "help")
+    assert bans == [(1, 300.0)]
+
+    # Strikes that fall out of the escalation window are forgotten
+    for _ in range(3):
+        clock.now += 130
+        assert ThrottleManager.allow(2, "help")
+        assert not ThrottleManager.allow(2, "help")
+    assert bans == [(1, 300.0)]
@@ -0,0 +1,109 @@
+from collections import Counter
+
+import pytest
+
+from managers.user import UserStatus
+from managers.user_manager import UserManager
+
+
+def new_user(user_id, race="elf", char_class="mage"):
+    return dict(user_id=user_id, date_joined=739000, action_count=0, ask_ban=False, char_name=f"Character {user_id}",
+                char_race=race, char_class=char_class, action=False, skills=[], inventory={})
+
+
+@pytest.fixture
+def users(tmp_path, monkeypatch):
+    monkeypatch.setenv("PTB_STORAGE", "json")
+    monkeypatch.setattr(UserManager, "data_dir", str(tmp_path))
+    UserManager.storage = None
+    UserManager._load_users()
+    yield UserManager
+    UserManager.storage.close()
+    UserManager.storage = None
+
+
+def reload(users, lazy=False):
+    users.storage.close()
+    users.storage = None
+    users._load_users(lazy)
+
+
+# The indexes as they would be built from scratch over the decoded users
+def assert_indexes(users):
+    decoded = users.user_data.values()
+    assert users._by_status == {
+        status: {user.user_id for user in decoded if user.status == status} for status in UserStatus
+    }
+    assert users._with_action == {user.user_id for user in decoded if user.action}
+    assert users._ask_banned == {user.user_id for user in decoded if user.ask_ban}
+    assert users._races == Counter(user.char_race for user in decoded)
+    assert users._classes == Counter(user.char_class for user in decoded)
+    by_count = {}
+    for user in decoded:
+        by_count.setdefault(user.action_count, set()).add(user.user_id)
+    assert users._by_count == by_count
+    assert users._counts == sorted(by_count)
+
+
+def test_indexes_follow_every_operation(users):
+    steps = [
+        lambda: users.create(**new_user(1)),
+        lambda: users.create(**new_user(2, "dwarf", "warrior")),
+        lambda: users.create(**new_user(3, "dwarf", "mage")),
+        lambda: users.create(**new_user(4, "human", "rogue")),
+        lambda: users.approve_user(1),
+        lambda: users.approve_users([2, 3]),
+        lambda: users.do_action(1),
+        lambda: users.do_action(2),
+        lambda: users.reject_action(2),
+        lambda: users.ban_ask(1),
+        lambda: users.ban_ask_users([2, 4]),
+        lambda: users.unban_ask(1),
+        lambda: users.unban_ask_users([2]),
+        lambda: users.add_skill(1, "fire"),
+        lambda: users.grant_skill([1, 2], "fire"),
+        lambda: users.give_item([1, 3], "sword", 2),
+        lambda: users.new_turn(1),
+        lambda: users.do_action(3),
+        lambda: users.reject_user(4),
+        lambda: users.reject_users([2]),
+    ]
+    for step in steps:
+        step()
+        assert_indexes(users)
+
+    before = {user_id: user.to_dict() for user_id, user in users.user_data.items()}
+    reload(users)
+    assert {user_id: user.to_dict() for user_id, user in users.user_data.items()} == before
+    assert_indexes(users)
+
+
+def test_replay_over_a_lazy_load_indexes_only_decoded_users(users):
+    for user_id in range(1, 6):
+        users.create(**new_user(user_id))
+    users.approve_users([1, 2, 3, 4])
+    users._save()
+    users.do_action(2)
+    users.reject_user(5)
+
+    reload(users, lazy=True)
+    # Replay decoded only the users it touched
+    assert set(users.user_data) == {2}
+    assert_indexes(users)
+    users._materialize_all()
+    assert set(users.user_data) == {1, 2, 3, 4}
+    assert_indexes(users)
+
+
+def test_top_ranks_active_players_by_actions(users):
+    for user_id in range(1, 6):
+        users.create(**new_user(user_id))
+    users.approve_users([1, 2, 3, 4])
+    for user_id, actions in ((1, 1), (2, 3), (3, 2), (5, 4)):
+        for _ in range(actions):
+            users.do_action(user_id)
+
+    # User 5 has the most actions but is not active; user 4 has none
+    assert users.top(10) == [(2, 3), (3, 2), (1, 1), (4, 0)]
+    assert users.top(2) == [(2, 3), (3, 2)]
+    assert users.top(0) == []
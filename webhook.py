@@ -0,0 +1,118 @@
+import asyncio
+import hmac
+import logging
+import os
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+from managers.stats_manager import StatsManager
+from managers.user_manager import UserManager
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class WebhookServer:
+    # Updates are acknowledged as soon as they are parsed and handled in the
+    # background, at most `concurrency` at a time. When every slot is busy
+    # the request waits for one, so Telegram (or a reverse proxy) sees the
+    # back-pressure instead of the bot queueing without bound.
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, path: str = "/webhook",
+                 secret: str | None = None, concurrency: int = 64):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.concurrency = concurrency
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks: set[asyncio.Task] = set()
+
+    @classmethod
+    def from_env(cls, dispatcher: Dispatcher, bot: Bot) -> "WebhookServer":
+        return cls(
+            dispatcher, bot,
+            path=os.getenv("PTB_WEBHOOK_PATH", "/webhook"),
+            secret=os.getenv("PTB_WEBHOOK_SECRET") or None,
+            concurrency=int(os.getenv("PTB_WEBHOOK_CONCURRENCY", 64))
+        )
+
+    def create_app(self, webhook_url: str | None = None) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/health", self.health)
+
+        async def on_startup(_):
+            await self.dispatcher.emit_startup(bot=self.bot, **self.dispatcher.workflow_data)
+            StatsManager.gauge("webhook_in_flight", lambda: len(self._tasks))
+            # Without a public URL the server only takes whatever is POSTed at it,
+            # e.g. recorded updates during local testing
+            if webhook_url:
+                await self.bot.set_webhook(
+                    webhook_url.rstrip("/") + self.path,
+                    secret_token=self.secret,
+                    allowed_updates=self.dispatcher.resolve_used_update_types()
+                )
+                logging.log(logging.INFO, f"Webhook set to {webhook_url.rstrip('/')}{self.path}")
+
+        async def on_shutdown(_):
+            # Finish the updates already acknowledged before state is flushed
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self.dispatcher.emit_shutdown(bot=self.bot, **self.dispatcher.workflow_data)
+            await self.bot.session.close()
+
+        app.on_startup.append(on_startup)
+        app.on_shutdown.append(on_shutdown)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError:
+            return web.Response(status=400)
+
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update) -> None:
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+        except Exception:
+            logging.exception(f"Update {update.update_id} failed")
+        finally:
+            self._slots.release()
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "ok",
+            "users_ready": UserManager._ready.is_set(),
+            "in_flight": len(self._tasks),
+            "concurrency": self.concurrency
+        })
+
+    def run(self) -> None:
+        web.run_app(
+            self.create_app(os.getenv("PTB_WEBHOOK_URL")),
+            host=os.getenv("PTB_WEBHOOK_HOST", "0.0.0.0"),
+            port=int(os.getenv("PTB_WEBHOOK_PORT", 8080)),
+            print=None
+        )
+
+
+async def metrics(request: web.Request) -> web.Response:
+    return web.Response(text=StatsManager.prometheus(), headers={"Content-Type": "text/plain; version=0.0.4"})
+
+# Prometheus metrics on their own port, kept off the public webhook listener
+async def start_metrics(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.log(logging.INFO, f"Metrics served on {host}:{port}/metrics")
+    return runner